@@ -0,0 +1,157 @@
+"""Device table and command coalescing for the actuator gateway.
+
+One gateway process drives every actuator of a kind (HVAC units,
+indicators, ...) through a wildcard command subscription. Each device has a
+small slotted ``DeviceState`` entry; a command only produces a retained state
+publish when it changes the device's state.
+
+``CommandCoalescer`` turns command bursts into at most two transitions per
+device: the first command for an idle device is applied at once and opens a
+``window_s`` window, later commands in the window replace each other, and
+the last one is applied when the window closes (which opens the next one).
+A lone command therefore pays no coalescing delay.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+
+@dataclass
+class ActuatorKind:
+    name: str
+    command_topic_template: str
+    state_topic_template: str
+    # Device id for rooms without an entry in ``devices``.
+    device_template: str = "{kind}-{room_id}"
+    # Room id -> device id.
+    devices: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, name: str, payload: Mapping[str, Any]) -> "ActuatorKind":
+        kind = cls(name=name, **payload)
+        if "{room_id}" not in kind.command_topic_template.split("/"):
+            raise ValueError(f"Actuator {name}: command_topic_template needs a {{room_id}} level")
+        return kind
+
+    @property
+    def command_filter(self) -> str:
+        return self.command_topic_template.format(room_id="+")
+
+    @property
+    def room_level(self) -> int:
+        return self.command_topic_template.split("/").index("{room_id}")
+
+    def device_for(self, room_id: str) -> str:
+        device_id = self.devices.get(room_id)
+        return self.device_template.format(kind=self.name, room_id=room_id) if device_id is None else device_id
+
+
+class DeviceState:
+    __slots__ = (
+        "kind",
+        "device_id",
+        "room_id",
+        "state_topic",
+        "state",
+        "pending",
+        "window_open",
+        "commands",
+        "transitions",
+    )
+
+    def __init__(self, kind: str, device_id: str, room_id: str, state_topic: str) -> None:
+        self.kind = kind
+        self.device_id = device_id
+        self.room_id = room_id
+        self.state_topic = state_topic
+        # None until the first command: the first one always publishes.
+        self.state: Optional[str] = None
+        # Latest command of the open coalescing window.
+        self.pending: Optional[Dict[str, Any]] = None
+        self.window_open = False
+        self.commands = 0
+        self.transitions = 0
+
+
+class CommandCoalescer:
+    """Applies a device's first command at once and the last one of its burst when the window closes."""
+
+    def __init__(self, window_s: float, apply: Callable[[DeviceState, Dict[str, Any]], None]) -> None:
+        self._window_s = window_s
+        self._apply = apply
+        self._due: List[Tuple[float, int, DeviceState]] = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.coalesced = 0
+
+    def start(self) -> None:
+        if self._window_s > 0:
+            self._thread = threading.Thread(target=self._run, name="command-coalescer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, device: DeviceState, command: Dict[str, Any]) -> None:
+        device.commands += 1
+        if self._window_s <= 0:
+            self._apply(device, command)
+            return
+        with self._condition:
+            leading = not device.window_open
+            if leading:
+                device.window_open = True
+                self._open_window(device)
+            else:
+                if device.pending is not None:
+                    self.coalesced += 1
+                device.pending = command
+        if leading:
+            self._apply(device, command)
+
+    def discard(self, device: DeviceState) -> None:
+        """Drop a device's open window (its room was released)."""
+        with self._condition:
+            device.pending = None
+
+    def _open_window(self, device: DeviceState) -> None:
+        heapq.heappush(self._due, (time.monotonic() + self._window_s, next(self._order), device))
+        self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopping and (not self._due or self._due[0][0] > time.monotonic()):
+                    self._condition.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                if self._stopping:
+                    return
+                now = time.monotonic()
+                ready = []
+                while self._due and self._due[0][0] <= now:
+                    _, _, device = heapq.heappop(self._due)
+                    if device.pending is None:
+                        device.window_open = False
+                        continue
+                    ready.append((device, device.pending))
+                    device.pending = None
+                    # Commands right after a burst keep coalescing instead of going out at once.
+                    self._open_window(device)
+            for device, command in ready:
+                try:
+                    self._apply(device, command)
+                except Exception:  # pragma: no cover - one device must not stop the others
+                    logging.getLogger("command-coalescer").exception("Failed to apply %s command", device.device_id)
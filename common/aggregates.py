@@ -0,0 +1,265 @@
+"""Incremental sliding-window aggregates for per-room stream processing.
+
+Every aggregate is updated with the sample entering the window and the one
+leaving it, so the cost per sample is O(1) (mean, variance, EWMA, amortized
+min/max) or O(log n) (median) regardless of the window length.
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+AGGREGATES = ("mean", "ewma", "min", "max", "median", "variance", "stddev")
+
+
+class Moments:
+    """Sliding mean and variance using Welford's add/remove updates."""
+
+    __slots__ = ("count", "mean", "_m2")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float, seq: int) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def remove(self, value: float, seq: int) -> None:
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self._m2 -= delta * (value - self.mean)
+
+    def state(self) -> Tuple[int, float, float]:
+        return self.count, self.mean, self._m2
+
+    def restore(self, count: int, mean: float, m2: float) -> None:
+        self.count, self.mean, self._m2 = count, mean, m2
+
+    @property
+    def variance(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        # Population variance; clamp tiny negative drift from the removals.
+        return max(self._m2 / self.count, 0.0)
+
+
+class Ewma:
+    """Exponentially weighted moving average; ignores window evictions."""
+
+    __slots__ = ("alpha", "value")
+
+    def __init__(self, alpha: float) -> None:
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError(f"EWMA alpha must be in (0, 1]: {alpha}")
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def add(self, value: float, seq: int) -> None:
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+
+    def remove(self, value: float, seq: int) -> None:
+        return None
+
+
+class SlidingExtreme:
+    """Sliding min or max backed by a monotonic deque of (seq, value)."""
+
+    __slots__ = ("_queue", "_is_max")
+
+    def __init__(self, is_max: bool) -> None:
+        self._queue: Deque[Tuple[int, float]] = deque()
+        self._is_max = is_max
+
+    def add(self, value: float, seq: int) -> None:
+        queue = self._queue
+        if self._is_max:
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+        else:
+            while queue and queue[-1][1] >= value:
+                queue.pop()
+        queue.append((seq, value))
+
+    def remove(self, value: float, seq: int) -> None:
+        if self._queue and self._queue[0][0] == seq:
+            self._queue.popleft()
+
+    @property
+    def value(self) -> Optional[float]:
+        return self._queue[0][1] if self._queue else None
+
+
+class SlidingMedian:
+    """Sliding median with two heaps and lazy deletion by sequence number."""
+
+    __slots__ = ("_low", "_high", "_side", "_low_count", "_high_count")
+
+    _LOW = 0
+    _HIGH = 1
+
+    def __init__(self) -> None:
+        self._low: List[Tuple[float, int]] = []  # max-heap via negated values
+        self._high: List[Tuple[float, int]] = []
+        self._side: Dict[int, int] = {}
+        self._low_count = 0
+        self._high_count = 0
+
+    def add(self, value: float, seq: int) -> None:
+        self._prune()
+        if self._low_count == 0 or value <= -self._low[0][0]:
+            heapq.heappush(self._low, (-value, seq))
+            self._side[seq] = self._LOW
+            self._low_count += 1
+        else:
+            heapq.heappush(self._high, (value, seq))
+            self._side[seq] = self._HIGH
+            self._high_count += 1
+        self._rebalance()
+
+    def remove(self, value: float, seq: int) -> None:
+        side = self._side.pop(seq, None)
+        if side is None:
+            return
+        if side == self._LOW:
+            self._low_count -= 1
+        else:
+            self._high_count -= 1
+        self._rebalance()
+        self._compact()
+
+    @property
+    def value(self) -> Optional[float]:
+        self._prune()
+        if self._low_count == 0:
+            return None
+        if self._low_count > self._high_count:
+            return -self._low[0][0]
+        return (-self._low[0][0] + self._high[0][0]) / 2.0
+
+    def _prune(self) -> None:
+        side = self._side
+        low, high = self._low, self._high
+        while low and side.get(low[0][1]) != self._LOW:
+            heapq.heappop(low)
+        while high and side.get(high[0][1]) != self._HIGH:
+            heapq.heappop(high)
+
+    def _rebalance(self) -> None:
+        while self._low_count > self._high_count + 1:
+            self._prune()
+            negated, seq = heapq.heappop(self._low)
+            heapq.heappush(self._high, (-negated, seq))
+            self._side[seq] = self._HIGH
+            self._low_count -= 1
+            self._high_count += 1
+        while self._high_count > self._low_count:
+            self._prune()
+            value, seq = heapq.heappop(self._high)
+            heapq.heappush(self._low, (-value, seq))
+            self._side[seq] = self._LOW
+            self._high_count -= 1
+            self._low_count += 1
+
+    def _compact(self) -> None:
+        # Evicted entries buried below the heap tops are only dropped lazily;
+        # rebuild occasionally so the heaps stay proportional to the window.
+        live = self._low_count + self._high_count
+        if len(self._low) + len(self._high) <= 2 * live + 16:
+            return
+        self._low = [entry for entry in self._low if self._side.get(entry[1]) == self._LOW]
+        self._high = [entry for entry in self._high if self._side.get(entry[1]) == self._HIGH]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
+
+
+class WindowAggregator:
+    """Count-based sliding window that maintains the selected aggregates."""
+
+    def __init__(self, window_size: int, aggregates: Iterable[str] = ("mean",), ewma_alpha: float = 0.3) -> None:
+        names = tuple(aggregates)
+        unknown = set(names) - set(AGGREGATES)
+        if unknown:
+            raise ValueError(f"Unknown aggregates: {sorted(unknown)}")
+        if window_size < 1:
+            raise ValueError("window_size must be positive")
+        self.window_size = window_size
+        self.names = names
+        self._values: Deque[float] = deque()
+        self._seq = 0
+        self._moments = Moments() if {"mean", "variance", "stddev"} & set(names) else None
+        self._ewma = Ewma(ewma_alpha) if "ewma" in names else None
+        self._min = SlidingExtreme(is_max=False) if "min" in names else None
+        self._max = SlidingExtreme(is_max=True) if "max" in names else None
+        self._median = SlidingMedian() if "median" in names else None
+        self._parts = [
+            part
+            for part in (self._moments, self._ewma, self._min, self._max, self._median)
+            if part is not None
+        ]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def values(self) -> List[float]:
+        return list(self._values)
+
+    def export_state(self) -> Dict[str, object]:
+        return {"values": list(self._values), "ewma": self._ewma.value if self._ewma else None}
+
+    def restore_state(self, state: Dict[str, object]) -> None:
+        """Rebuild the window from exported values (replaying them in order)."""
+        for value in state.get("values", [])[-self.window_size :]:
+            self.update(float(value))
+        if self._ewma is not None and state.get("ewma") is not None:
+            self._ewma.value = float(state["ewma"])
+
+    def update(self, value: float) -> Dict[str, float]:
+        if len(self._values) == self.window_size:
+            evicted = self._values.popleft()
+            evicted_seq = self._seq - self.window_size
+            for part in self._parts:
+                part.remove(evicted, evicted_seq)
+        self._values.append(value)
+        for part in self._parts:
+            part.add(value, self._seq)
+        self._seq += 1
+        return self.result()
+
+    def result(self) -> Dict[str, float]:
+        result: Dict[str, float] = {}
+        for name in self.names:
+            value = self._read(name)
+            if value is not None:
+                result[name] = value
+        return result
+
+    def _read(self, name: str) -> Optional[float]:
+        if name == "mean":
+            return self._moments.mean if self._moments.count else None
+        if name == "variance":
+            return self._moments.variance
+        if name == "stddev":
+            variance = self._moments.variance
+            return None if variance is None else math.sqrt(variance)
+        if name == "ewma":
+            return self._ewma.value
+        if name == "min":
+            return self._min.value
+        if name == "max":
+            return self._max.value
+        return self._median.value
@@ -0,0 +1,258 @@
+"""Rate-limited alert delivery to chat services (Telegram).
+
+Alerts are queued without blocking the MQTT thread, coalesced per chat over
+``coalesce_window_s`` into one digest message ("12 rooms OVERHEAT: ...")
+and sent through a per-chat token bucket, plus a global one, so a heat event
+across many rooms stays inside the chat service's flood limits. Sends that
+are refused with a retry-after (Telegram's 429, ``RetryAfter``) wait for the
+requested time and are retried; other failures back off exponentially.
+
+Everything runs on the event loop of the caller; ``submit`` may be called
+from any thread.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+
+from common.metrics import Histogram
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+# Telegram rejects longer messages.
+MAX_MESSAGE_CHARS = 4096
+# Alert-to-delivery latency bucket upper bounds in seconds.
+DELIVERY_BUCKETS_S = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+SendMessage = Callable[[str, str], Awaitable[Any]]
+
+
+@dataclass
+class DeliveryConfig:
+    # Alerts waiting across all chats; when full, drop_oldest drops that chat's oldest alert.
+    queue_size: int = 1000
+    drop_policy: str = DROP_OLDEST
+    # Alerts for a chat within this window after the first one go out as one digest.
+    coalesce_window_s: float = 2.0
+    # Rooms listed per alert type in a digest; the rest are counted.
+    max_digest_rooms: int = 20
+    # Telegram allows about one message per second per chat and 30 per second overall.
+    chat_rate_per_s: float = 1.0
+    chat_burst: int = 3
+    global_rate_per_s: float = 25.0
+    max_retries: int = 5
+    backoff_s: float = 1.0
+    max_backoff_s: float = 30.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Dict[str, Any]]) -> "DeliveryConfig":
+        config = cls(**(payload or {}))
+        if config.drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop_policy: {config.drop_policy}")
+        if config.queue_size < 1 or config.chat_rate_per_s <= 0 or config.global_rate_per_s <= 0:
+            raise ValueError("Delivery queue_size and rates must be positive")
+        return config
+
+
+class TokenBucket:
+    """Token bucket for one event loop; waiting callers reserve tokens in order."""
+
+    def __init__(self, rate_per_s: float, burst: float) -> None:
+        self._rate = rate_per_s
+        self._capacity = max(burst, 1.0)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take one token; returns the seconds to wait before using it."""
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        self._tokens -= 1.0
+        return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back the next token for at least ``seconds`` (after a flood-limit refusal)."""
+        self._tokens = min(self._tokens, 0.0) - seconds * self._rate
+
+
+def retry_after_s(exc: BaseException) -> Optional[float]:
+    """Seconds a flood-limit error asks to wait, or None for other errors."""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        return None
+    # python-telegram-bot reports an int, newer releases a timedelta.
+    return float(value.total_seconds() if hasattr(value, "total_seconds") else value)
+
+
+def format_digest(alerts: List[Mapping[str, Any]], max_rooms: int = 20) -> str:
+    """One message for the alerts of a window; a single alert keeps the plain format."""
+    if len(alerts) == 1:
+        alert = alerts[0]
+        return (
+            f"Alert {alert.get('type')} in {alert.get('room_id')}: "
+            f"{alert.get('temp_c')}°C (level {alert.get('level')})"
+        )
+    # Newest alert per room and type; types in order of first appearance.
+    by_type: Dict[str, Dict[str, Mapping[str, Any]]] = {}
+    for alert in alerts:
+        by_type.setdefault(str(alert.get("type")), {})[str(alert.get("room_id"))] = alert
+    lines = []
+    for alert_type, rooms in by_type.items():
+        listed = [f"{room_id} {alert.get('temp_c')}°C" for room_id, alert in list(rooms.items())[:max_rooms]]
+        if len(rooms) > max_rooms:
+            listed.append(f"and {len(rooms) - max_rooms} more")
+        noun = "room" if len(rooms) == 1 else "rooms"
+        lines.append(f"{len(rooms)} {noun} {alert_type}: {', '.join(listed)}")
+    return "\n".join(lines)
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_CHARS) -> List[str]:
+    """Split ``text`` at line breaks into messages of at most ``limit`` characters."""
+    parts: List[str] = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            parts.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+class AlertDelivery:
+    """Bounded alert queue plus one coalescing, rate-limited sender per chat.
+
+    Alerts wait in their chat's window until its sender takes them; the
+    queue bound covers every waiting alert across chats.
+    """
+
+    def __init__(self, config: DeliveryConfig, send_message: SendMessage) -> None:
+        self._logger = logging.getLogger("alert_delivery")
+        self._config = config
+        self._send_message = send_message
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Chat id -> (alert, monotonic time queued), oldest first.
+        self._pending: Dict[str, Deque[Tuple[Mapping[str, Any], float]]] = {}
+        self._waiting = 0
+        self._senders: Dict[str, asyncio.Task] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._global_bucket = TokenBucket(config.global_rate_per_s, config.global_rate_per_s)
+        self.latency = Histogram(DELIVERY_BUCKETS_S)
+        self._counters = {
+            "queued": 0,
+            "dropped": 0,
+            "delivered": 0,
+            "failed": 0,
+            "messages": 0,
+            "rate_limited": 0,
+            "retried": 0,
+        }
+
+    def start(self) -> None:
+        """Bind to the running event loop."""
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        """Wait until every waiting alert has been sent (or has failed)."""
+        await asyncio.sleep(0)
+        while self._senders:
+            await asyncio.gather(*list(self._senders.values()), return_exceptions=True)
+
+    def submit(self, chat_id: str, alert: Mapping[str, Any]) -> None:
+        """Queue an alert for ``chat_id``; safe to call from any thread."""
+        if self._loop is None:
+            raise RuntimeError("Alert delivery not started")
+        self._loop.call_soon_threadsafe(self.offer, chat_id, alert)
+
+    def offer(self, chat_id: str, alert: Mapping[str, Any]) -> bool:
+        """Queue an alert from the event loop; returns False when it was dropped."""
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            pending = self._pending[chat_id] = deque()
+        if self._waiting >= self._config.queue_size:
+            self._counters["dropped"] += 1
+            if self._config.drop_policy == DROP_NEWEST or not pending:
+                return False
+            pending.popleft()
+            self._waiting -= 1
+        pending.append((alert, time.monotonic()))
+        self._waiting += 1
+        self._counters["queued"] += 1
+        if chat_id not in self._senders:
+            self._senders[chat_id] = self._loop.create_task(self._run_sender(chat_id))
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        counters = dict(self._counters)
+        counters["queue_depth"] = self._waiting
+        return counters
+
+    async def _run_sender(self, chat_id: str) -> None:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._config.chat_rate_per_s, self._config.chat_burst)
+        try:
+            while self._pending.get(chat_id):
+                await asyncio.sleep(self._config.coalesce_window_s)
+                # Everything that arrived during the window (and while rate limited) is one digest.
+                batch = list(self._pending.pop(chat_id))
+                self._waiting -= len(batch)
+                text = format_digest([alert for alert, _ in batch], self._config.max_digest_rooms)
+                delivered = True
+                for part in split_message(text):
+                    delivered = await self._send(chat_id, part, bucket) and delivered
+                counter = "delivered" if delivered else "failed"
+                self._counters[counter] += len(batch)
+                if delivered:
+                    now = time.monotonic()
+                    for _, queued_at in batch:
+                        self.latency.observe(now - queued_at)
+        finally:
+            del self._senders[chat_id]
+
+    async def _send(self, chat_id: str, text: str, bucket: TokenBucket) -> bool:
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                await self._send_message(chat_id, text)
+            except Exception as exc:
+                if attempt >= self._config.max_retries:
+                    self._logger.warning("Alert message to %s failed after %s attempts: %s", chat_id, attempt + 1, exc)
+                    return False
+                attempt += 1
+                self._counters["retried"] += 1
+                wait_s = retry_after_s(exc)
+                if wait_s is not None:
+                    self._counters["rate_limited"] += 1
+                    # The next token of this chat waits out the flood limit.
+                    bucket.pause(wait_s)
+                    self._logger.info("Rate limited by the chat service; retry %s in %.1fs", attempt, wait_s)
+                else:
+                    delay = min(self._config.backoff_s * (2 ** (attempt - 1)), self._config.max_backoff_s)
+                    self._logger.info("Alert message failed (%s); retry %s in %.1fs", exc, attempt, delay)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            self._counters["messages"] += 1
+            return True
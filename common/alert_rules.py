@@ -0,0 +1,292 @@
+"""Table-driven alert rules evaluated over micro-batches with NumPy.
+
+Per-room thresholds and rule state live in column arrays indexed by a room
+slot. A batch of samples is evaluated with a handful of vectorized
+operations and only state transitions are returned, so the per-sample cost
+stays flat as the number of rooms and rule variants grows.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Fixed-width record of one room's rule state, used for compact snapshots.
+STATE_DTYPE = np.dtype(
+    [
+        ("in_alert", "?"),
+        ("last_alert_ts", "<i8"),
+        ("last_rate_ts", "<i8"),
+        ("above_since", "<i8"),
+        ("last_temp", "<f8"),
+        ("last_ts", "<i8"),
+    ]
+)
+
+OVERHEAT = "OVERHEAT"
+RECOVERED = "RECOVERED"
+RAPID_RISE = "RAPID_RISE"
+
+
+@dataclass
+class RoomRule:
+    high_threshold: float
+    low_threshold: float
+    cooldown_s: int
+    # 0 disables the rule: degrees per second that counts as a rapid rise.
+    rate_threshold_c_per_s: float = 0.0
+    # Seconds the temperature must stay above high_threshold before firing.
+    sustain_s: int = 0
+
+    @classmethod
+    def from_dict(cls, payload: Dict[str, Any], defaults: Optional["RoomRule"] = None) -> "RoomRule":
+        values = {} if defaults is None else {f.name: getattr(defaults, f.name) for f in fields(cls)}
+        values.update({f.name: payload[f.name] for f in fields(cls) if f.name in payload})
+        rule = cls(**values)
+        if rule.low_threshold > rule.high_threshold:
+            raise ValueError("low_threshold must not exceed high_threshold")
+        return rule
+
+
+@dataclass(slots=True)
+class Transition:
+    room_id: str
+    type: str
+    level: str
+    temp_c: float
+    ts: int
+    # Position of the triggering sample in the evaluated batch.
+    index: int = -1
+
+
+class AlertRuleEngine:
+    _RULE_COLUMNS = {
+        "high": np.float64,
+        "low": np.float64,
+        "cooldown": np.int64,
+        "rate": np.float64,
+        "sustain": np.int64,
+    }
+    _STATE_COLUMNS = {
+        "in_alert": np.bool_,
+        "last_alert_ts": np.int64,
+        "last_rate_ts": np.int64,
+        "above_since": np.int64,
+        "last_temp": np.float64,
+        "last_ts": np.int64,
+    }
+
+    def __init__(self, capacity: int = 64) -> None:
+        self._lock = threading.Lock()
+        self._room_ids: List[Optional[str]] = []
+        self._index: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._capacity = 0
+        self._cols: Dict[str, np.ndarray] = {}
+        self._grow(max(capacity, 1))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._index
+
+    def slot(self, room_id: str) -> int:
+        return self._index[room_id]
+
+    def set_rule(self, room_id: str, rule: RoomRule) -> int:
+        """Add a room (or update its rule) and return its slot."""
+        with self._lock:
+            slot = self._index.get(room_id)
+            if slot is None:
+                slot = self._allocate(room_id)
+            cols = self._cols
+            cols["high"][slot] = rule.high_threshold
+            cols["low"][slot] = rule.low_threshold
+            cols["cooldown"][slot] = rule.cooldown_s
+            cols["rate"][slot] = rule.rate_threshold_c_per_s
+            cols["sustain"][slot] = rule.sustain_s
+            return slot
+
+    def add_rooms(self, room_ids: Sequence[str], rule: RoomRule) -> None:
+        """Add many rooms sharing one rule with a single write per column."""
+        with self._lock:
+            slots = np.fromiter(
+                (self._allocate(room_id, reset=False) for room_id in room_ids if room_id not in self._index),
+                dtype=np.int64,
+            )
+            cols = self._cols
+            cols["high"][slots] = rule.high_threshold
+            cols["low"][slots] = rule.low_threshold
+            cols["cooldown"][slots] = rule.cooldown_s
+            cols["rate"][slots] = rule.rate_threshold_c_per_s
+            cols["sustain"][slots] = rule.sustain_s
+            self._reset_state(slots)
+
+    def remove_room(self, room_id: str) -> None:
+        with self._lock:
+            slot = self._index.pop(room_id, None)
+            if slot is None:
+                return
+            self._room_ids[slot] = None
+            self._reset_state(slot)
+            self._free.append(slot)
+
+    def export_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            slot = self._index.get(room_id)
+            if slot is None:
+                return None
+            state = {name: self._cols[name][slot].item() for name in self._STATE_COLUMNS}
+        if np.isnan(state["last_temp"]):
+            state["last_temp"] = None
+        return state
+
+    def import_room(self, room_id: str, state: Dict[str, Any]) -> None:
+        with self._lock:
+            slot = self._index.get(room_id)
+            if slot is None:
+                raise KeyError(room_id)
+            for name in self._STATE_COLUMNS:
+                value = state.get(name)
+                if name == "last_temp" and value is None:
+                    value = np.nan
+                if value is not None:
+                    self._cols[name][slot] = value
+
+    def export_states(self, room_ids: Sequence[str]) -> np.ndarray:
+        """Rule state of many rooms as one ``STATE_DTYPE`` record array."""
+        with self._lock:
+            slots = np.fromiter((self._index[room_id] for room_id in room_ids), dtype=np.int64, count=len(room_ids))
+            records = np.empty(len(room_ids), dtype=STATE_DTYPE)
+            for name in STATE_DTYPE.names:
+                records[name] = self._cols[name][slots]
+        return records
+
+    def import_states(self, room_ids: Sequence[str], records: np.ndarray) -> None:
+        with self._lock:
+            slots = np.fromiter((self._index[room_id] for room_id in room_ids), dtype=np.int64, count=len(room_ids))
+            for name in STATE_DTYPE.names:
+                self._cols[name][slots] = records[name]
+
+    def evaluate(self, slots: Sequence[int], temps: Sequence[float], ts: Sequence[int], now: Sequence[int]) -> List[Transition]:
+        """Evaluate a batch of samples (in arrival order) and return the transitions.
+
+        ``ts`` is the sample time used for rate-of-change rules; ``now`` is the
+        evaluation time used for latches, cooldowns and sustain windows.
+        """
+        slot_arr = np.asarray(slots, dtype=np.int64)
+        if slot_arr.size == 0:
+            return []
+        temp_arr = np.asarray(temps, dtype=np.float64)
+        ts_arr = np.asarray(ts, dtype=np.int64)
+        now_arr = np.asarray(now, dtype=np.int64)
+        with self._lock:
+            rounds = self._rounds(slot_arr)
+            transitions: List[Transition] = []
+            for rows in rounds:
+                transitions.extend(
+                    self._evaluate_round(slot_arr[rows], temp_arr[rows], ts_arr[rows], now_arr[rows], rows)
+                )
+        return transitions
+
+    @staticmethod
+    def _rounds(slot_arr: np.ndarray) -> List[np.ndarray]:
+        # A room may appear several times in one batch; split the batch into
+        # rounds in which every room appears at most once, preserving order.
+        order = np.argsort(slot_arr, kind="stable")
+        sorted_slots = slot_arr[order]
+        starts = np.r_[True, sorted_slots[1:] != sorted_slots[:-1]]
+        group_start = np.maximum.accumulate(np.where(starts, np.arange(sorted_slots.size), 0))
+        occurrence = np.empty_like(order)
+        occurrence[order] = np.arange(sorted_slots.size) - group_start
+        if occurrence.max() == 0:
+            return [np.arange(slot_arr.size)]
+        return [np.flatnonzero(occurrence == rank) for rank in range(int(occurrence.max()) + 1)]
+
+    def _evaluate_round(
+        self, idx: np.ndarray, temp: np.ndarray, ts: np.ndarray, now: np.ndarray, rows: np.ndarray
+    ) -> List[Transition]:
+        cols = self._cols
+        in_alert = cols["in_alert"][idx]
+        last_alert_ts = cols["last_alert_ts"][idx]
+        cooldown = cols["cooldown"][idx]
+
+        # Rate-of-change rule, with its own cooldown.
+        rate_limit = cols["rate"][idx]
+        last_temp = cols["last_temp"][idx]
+        dt = ts - cols["last_ts"][idx]
+        has_rate = (rate_limit > 0) & (dt > 0) & ~np.isnan(last_temp)
+        rate = np.where(has_rate, (temp - last_temp) / np.where(dt > 0, dt, 1), 0.0)
+        rapid = has_rate & (rate >= rate_limit) & (now - cols["last_rate_ts"][idx] >= cooldown)
+
+        # Sustained-duration tracking for the overheat rule.
+        above = temp >= cols["high"][idx]
+        above_since = cols["above_since"][idx]
+        above_since = np.where(above, np.where(above_since < 0, now, above_since), -1)
+        sustained = above & (now - above_since >= cols["sustain"][idx])
+
+        fire = ~in_alert & sustained & (now - last_alert_ts >= cooldown)
+        # Hysteresis: stay in alert until temperature drops to the low threshold.
+        recover = in_alert & (temp <= cols["low"][idx])
+        changed = fire | recover
+
+        cols["in_alert"][idx] = (in_alert | fire) & ~recover
+        cols["last_alert_ts"][idx] = np.where(changed, now, last_alert_ts)
+        cols["last_rate_ts"][idx] = np.where(rapid, now, cols["last_rate_ts"][idx])
+        cols["above_since"][idx] = above_since
+        cols["last_temp"][idx] = temp
+        cols["last_ts"][idx] = ts
+
+        transitions: List[Transition] = []
+        if not (changed.any() or rapid.any()):
+            return transitions
+        room_ids = self._room_ids
+        for row in np.flatnonzero(changed | rapid):
+            room_id = room_ids[idx[row]]
+            if room_id is None:
+                continue
+            sample_temp = float(temp[row])
+            sample_now = int(now[row])
+            index = int(rows[row])
+            if fire[row]:
+                transitions.append(Transition(room_id, OVERHEAT, "WARN", sample_temp, sample_now, index))
+            elif recover[row]:
+                transitions.append(Transition(room_id, RECOVERED, "INFO", sample_temp, sample_now, index))
+            if rapid[row]:
+                transitions.append(Transition(room_id, RAPID_RISE, "WARN", sample_temp, sample_now, index))
+        return transitions
+
+    def _allocate(self, room_id: str, reset: bool = True) -> int:
+        if self._free:
+            slot = self._free.pop()
+            self._room_ids[slot] = room_id
+        else:
+            slot = len(self._room_ids)
+            if slot >= self._capacity:
+                self._grow(self._capacity * 2)
+            self._room_ids.append(room_id)
+        self._index[room_id] = slot
+        if reset:
+            self._reset_state(slot)
+        return slot
+
+    def _reset_state(self, slot: int | np.ndarray) -> None:
+        cols = self._cols
+        cols["in_alert"][slot] = False
+        cols["last_alert_ts"][slot] = 0
+        cols["last_rate_ts"][slot] = 0
+        cols["above_since"][slot] = -1
+        cols["last_temp"][slot] = np.nan
+        cols["last_ts"][slot] = 0
+
+    def _grow(self, capacity: int) -> None:
+        for name, dtype in {**self._RULE_COLUMNS, **self._STATE_COLUMNS}.items():
+            column = np.zeros(capacity, dtype=dtype)
+            if name in self._cols:
+                column[: self._capacity] = self._cols[name]
+            self._cols[name] = column
+        self._capacity = capacity
@@ -0,0 +1,150 @@
+"""One broker connection shared by all services hosted in a process.
+
+Co-located services run on ``LoopbackTransport`` clients of one
+``LoopbackBroker``, so messages between them are delivered in-process as
+objects. ``MqttBridge`` is the only real MQTT connection: it subscribes to the
+union of the services' filters and forwards everything they publish. It uses
+MQTT 5 so that its subscriptions can set ``noLocal`` (the broker does not echo
+the bridge's own publishes back, which would deliver them twice) and
+``retainAsPublished`` (so retained updates keep the local retained cache in
+sync).
+
+MQTT allows one will per connection. The bridge's will marks the whole
+process offline on its own status topic; the per-service status topics get
+their OFFLINE will from the runner when a service stops or fails. If the
+process dies, nothing can publish those, so hosted services' retained
+status stays ONLINE. Their status payloads therefore carry ``"bridge"``,
+the bridge's client id: a hosted service is offline when
+``iot/services/{bridge}/status`` is OFFLINE, whatever its own topic says.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.subscribeoptions import SubscribeOptions
+
+from common.models import JsonCodec, decode_payload, get_codec
+from common.mqtt_client import MqttConfig
+from common.topics import TopicRouter, template_to_filter
+from common.transport import LoopbackBroker, LoopbackUpstream
+
+
+def _is_status_topic(topic: str) -> bool:
+    levels = topic.split("/")
+    return len(levels) == 4 and levels[:2] == ["iot", "services"] and levels[3] == "status"
+
+
+class MqttBridge(LoopbackUpstream):
+    def __init__(self, client_id: str, mqtt_config: MqttConfig, broker: LoopbackBroker) -> None:
+        self._logger = logging.getLogger(client_id)
+        self._config = mqtt_config
+        self._broker = broker
+        self._lock = threading.Lock()
+        self._filters: Dict[str, int] = {}
+        self._codec_router: TopicRouter[Any] = TopicRouter()
+        for template, codec_name in mqtt_config.codecs.items():
+            self._codec_router.add(template_to_filter(template), get_codec(codec_name))
+        self._codec_cache: Dict[str, Any] = {}
+        self._default_codec = JsonCodec()
+        self.forwarded = 0
+        self.received = 0
+        self._client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_message = self._on_message
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._client_id = client_id
+        self._status_topic = f"iot/services/{client_id}/status"
+        self._client.will_set(self._status_topic, self._status("OFFLINE"), qos=1, retain=True)
+
+    def start(self) -> None:
+        self._broker.upstream = self
+        self._client.connect(self._config.host, self._config.port, self._config.keepalive)
+        self._client.loop_start()
+
+    def stop(self) -> None:
+        self._broker.upstream = None
+        info = self._client.publish(self._status_topic, self._status("OFFLINE"), qos=1, retain=True)
+        info.wait_for_publish(timeout=5)
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def filter_added(self, topic_filter: str, qos: int) -> None:
+        with self._lock:
+            if self._filters.get(topic_filter, -1) >= qos:
+                return
+            self._filters[topic_filter] = qos
+        self._client.subscribe(topic_filter, options=self._options(qos))
+        self._logger.info("Bridging %s (qos=%s)", topic_filter, qos)
+
+    def filter_removed(self, topic_filter: str) -> None:
+        with self._lock:
+            if self._filters.pop(topic_filter, None) is None:
+                return
+        self._client.unsubscribe(topic_filter)
+
+    def forward(self, topic: str, payload: Any, qos: int, retain: bool) -> None:
+        if payload is None or payload == b"":
+            data: Any = b""
+        elif isinstance(payload, (bytes, bytearray)):
+            data = payload
+        else:
+            if isinstance(payload, dict) and _is_status_topic(topic):
+                # Hosted services share this connection's will; see the module docstring.
+                payload = {**payload, "bridge": self._client_id}
+            data = self._codec_for(topic).encode(payload)
+        self._client.publish(topic, data, qos=qos, retain=retain)
+        self.forwarded += 1
+
+    def _codec_for(self, topic: str) -> Any:
+        codec = self._codec_cache.get(topic)
+        if codec is None:
+            matches = self._codec_router.match(topic)
+            codec = matches[0] if matches else self._default_codec
+            self._codec_cache[topic] = codec
+        return codec
+
+    @staticmethod
+    def _options(qos: int) -> SubscribeOptions:
+        return SubscribeOptions(qos=min(qos, 2), noLocal=True, retainAsPublished=True)
+
+    @staticmethod
+    def _status(status: str) -> str:
+        return json.dumps({"status": status, "ts": int(time.time())})
+
+    def _on_message(self, client: mqtt.Client, userdata: object, msg: mqtt.MQTTMessage) -> None:
+        payload: Any = b""
+        if msg.payload:
+            try:
+                # Decoded once here, however many local services subscribe.
+                payload = decode_payload(msg.payload)
+            except ValueError as exc:
+                self._logger.warning("%s on topic %s", exc, msg.topic)
+                return
+        self.received += 1
+        self._broker.publish(msg.topic, payload, msg.qos, msg.retain, from_upstream=True)
+
+    def _on_connect(self, client: mqtt.Client, userdata: object, flags: Any, rc: Any, properties: Any = None) -> None:
+        if rc != 0:
+            self._logger.error("Failed to connect to MQTT broker: %s", rc)
+            return
+        self._logger.info("Connected to MQTT broker")
+        with self._lock:
+            filters = list(self._filters.items())
+        if filters:
+            # Clean start drops subscriptions on reconnect; restore them.
+            client.subscribe([(topic_filter, self._options(qos)) for topic_filter, qos in filters])
+        client.publish(self._status_topic, self._status("ONLINE"), qos=1, retain=True)
+
+    def _on_disconnect(self, client: mqtt.Client, userdata: object, rc: Any, properties: Any = None) -> None:
+        if rc == 0:
+            self._logger.info("Disconnected from MQTT broker")
+        else:
+            # The network loop reconnects on its own with the configured backoff.
+            self._logger.warning("Unexpected MQTT disconnect (rc=%s); reconnecting", rc)
@@ -2,19 +2,177 @@ from __future__ import annotations
 
 """Home Catalog REST client shared by all microservices."""
 
+import json
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
+
+# Extra time on top of a watch's server-side timeout before giving up on the request.
+WATCH_GRACE_S = 10.0
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 
 
 class HomeCatalogClient:
-    def __init__(self, base_url: str) -> None:
+    """Catalog client over one pooled session, with retries and a last-known-good cache.
+
+    Requests that fail with a connection error or a retryable status are
+    retried with jittered exponential backoff, so a restarting stack does not
+    hammer the catalog in lockstep. ``bootstrap`` results are cached on disk
+    under ``cache_dir`` and a service can start from the cache while the
+    catalog is still unreachable.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        cache_dir: str | Path | None = None,
+        session: Optional[requests.Session] = None,
+        retries: int = 5,
+        backoff_s: float = 0.5,
+        max_backoff_s: float = 10.0,
+        timeout_s: float = 5.0,
+    ) -> None:
         self.base_url = base_url.rstrip("/")
+        self._cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self._session = session
+        self._retries = retries
+        self._backoff_s = backoff_s
+        self._max_backoff_s = max_backoff_s
+        self._timeout_s = timeout_s
+        self._logger = logging.getLogger("home_catalog_client")
 
     def get_service_config(self, service_name: str) -> dict:
-        response = requests.get(f"{self.base_url}/config/{service_name}", timeout=10)
-        response.raise_for_status()
-        return response.json()
+        return self._get(f"/config/{service_name}").json()
+
+    def get_service_config_versioned(self, service_name: str) -> Tuple[dict, Optional[str]]:
+        """Return the service config together with its ETag."""
+        response = self._get(f"/config/{service_name}")
+        return response.json(), response.headers.get("ETag")
+
+    def watch_service_config(
+        self, service_name: str, etag: Optional[str], timeout_s: float = 30.0
+    ) -> Tuple[Optional[dict], Optional[str]]:
+        """Block until the config differs from ``etag`` or ``timeout_s`` passes.
+
+        Returns ``(config, new_etag)`` on a change and ``(None, etag)`` if the
+        config is unchanged.
+        """
+        headers = {"If-None-Match": etag} if etag else {}
+        # The watch loop has its own retry delay, so a single attempt here.
+        response = self._get(
+            f"/watch/{service_name}",
+            params={"timeout_s": timeout_s},
+            headers=headers,
+            timeout=timeout_s + WATCH_GRACE_S,
+            retries=0,
+        )
+        if response.status_code == 304:
+            return None, etag
+        return response.json(), response.headers.get("ETag")
 
     def get_mqtt_config(self) -> dict:
-        response = requests.get(f"{self.base_url}/mqtt", timeout=10)
-        response.raise_for_status()
-        return response.json()
+        return self._get("/mqtt").json()
+
+    def get_shard_assignment(self, service_name: str, replica: int) -> dict:
+        return self._get(f"/shards/{service_name}", params={"replica": replica}).json()
+
+    def bootstrap(
+        self, service_name: str, replica: Optional[int] = None, prefer_cache: bool = False
+    ) -> Tuple[dict, bool]:
+        """Return ``({"mqtt", "service", "etag", "shards"}, from_cache)``.
+
+        The catalog is asked first; the cache is the fallback when it cannot
+        be reached, and the caller reconciles with ``fetch_bootstrap`` later.
+        With a cached copy at hand the catalog gets a single attempt, so an
+        outage does not hold up startup. ``prefer_cache`` skips the catalog
+        whenever a cached copy exists.
+        """
+        cached = self._read_cache(service_name, replica)
+        if prefer_cache and cached is not None:
+            return cached, True
+        try:
+            return self.fetch_bootstrap(service_name, replica, retries=None if cached is None else 0), False
+        except requests.RequestException as exc:
+            if cached is None:
+                raise
+            self._logger.warning("Catalog unreachable (%s); starting %s from cached config", exc, service_name)
+            return cached, True
+
+    def fetch_bootstrap(self, service_name: str, replica: Optional[int] = None, retries: Optional[int] = None) -> dict:
+        """Fetch the bootstrap bundle from the catalog and refresh the on-disk cache."""
+        params = {} if replica is None else {"replica": replica}
+        payload = self._get(f"/bootstrap/{service_name}", params=params, retries=retries).json()
+        self._write_cache(service_name, replica, payload)
+        return payload
+
+    def _get(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+    ) -> requests.Response:
+        retries = self._retries if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                response = self._session.get(
+                    f"{self.base_url}{path}",
+                    params=params,
+                    headers=headers,
+                    timeout=timeout or self._timeout_s,
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error: requests.RequestException = exc
+            else:
+                if response.status_code not in _RETRY_STATUSES:
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"catalog returned {response.status_code}", response=response)
+            if attempt >= retries:
+                raise error
+            delay = min(self._backoff_s * (2**attempt), self._max_backoff_s)
+            attempt += 1
+            self._logger.info("Catalog request %s failed (%s); retry %s in %.1fs", path, error, attempt, delay)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _cache_path(self, service_name: str, replica: Optional[int]) -> Optional[Path]:
+        if self._cache_dir is None:
+            return None
+        suffix = "" if replica is None else f"-{replica}"
+        return self._cache_dir / f"{service_name}{suffix}.json"
+
+    def _read_cache(self, service_name: str, replica: Optional[int]) -> Optional[dict]:
+        path = self._cache_path(service_name, replica)
+        if path is None or not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            self._logger.warning("Ignoring unreadable config cache %s: %s", path, exc)
+            return None
+
+    def _write_cache(self, service_name: str, replica: Optional[int], payload: dict) -> None:
+        path = self._cache_path(service_name, replica)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".json.tmp")
+            tmp_path.write_text(json.dumps(payload), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as exc:  # pragma: no cover - the cache is best effort
+            self._logger.warning("Could not write config cache %s: %s", path, exc)
@@ -0,0 +1,59 @@
+"""Hot reload of a service's catalog config through the catalog's long-poll watch."""
+
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Mapping, Optional
+
+if TYPE_CHECKING:  # pragma: no cover - import cycle only needed for typing
+    from common.service_base import ServiceBase
+
+
+@dataclass
+class ConfigWatchConfig:
+    enabled: bool = False
+    # Server-side long-poll timeout; an idle watch costs one request per period.
+    timeout_s: float = 30.0
+    retry_s: float = 5.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Mapping[str, object]]) -> "ConfigWatchConfig":
+        return cls(**(payload or {}))
+
+
+class ConfigWatcher:
+    """Long-polls ``/watch/{service}`` and hands every new config to the service."""
+
+    def __init__(self, service: "ServiceBase", config: ConfigWatchConfig, etag: Optional[str]) -> None:
+        self._service = service
+        self._config = config
+        self._etag = etag
+        self._stop = threading.Event()
+        self._logger = logging.getLogger(f"{service.service_name}.config")
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="config-watcher", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                config, etag = self._service.home_catalog.watch_service_config(
+                    self._service.service_name, self._etag, self._config.timeout_s
+                )
+            except Exception as exc:  # pragma: no cover - catalog outages are retried
+                self._logger.warning("Config watch failed: %s", exc)
+                self._stop.wait(self._config.retry_s)
+                continue
+            if config is None or self._stop.is_set():
+                continue
+            self._logger.info("Config changed (%s -> %s)", self._etag, etag)
+            self._etag = etag
+            try:
+                self._service.apply_config(config)
+            except Exception:  # pragma: no cover - keep watching with the old config
+                self._logger.exception("Failed to apply new config")
@@ -0,0 +1,148 @@
+"""Keyed worker pool that moves message handling off the MQTT network thread.
+
+Each key (normally a room_id) is pinned to one worker, so messages for a room
+are handled in arrival order while different rooms run in parallel. Every
+worker owns a bounded queue; what happens when it is full is decided by the
+overflow policy.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+@dataclass
+class DispatchConfig:
+    enabled: bool = False
+    workers: int = 4
+    queue_size: int = 1000
+    overflow: str = OVERFLOW_BLOCK
+    # Topic level used as the ordering key; 1 is the room in "iot/{room_id}/...".
+    key_level: int = 1
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Dict[str, Any]]) -> "DispatchConfig":
+        config = cls(**(payload or {}))
+        if config.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown dispatch overflow policy: {config.overflow}")
+        if config.workers < 1 or config.queue_size < 1:
+            raise ValueError("Dispatch workers and queue_size must be positive")
+        return config
+
+
+Task = Tuple[Callable[..., None], Tuple[Any, ...]]
+
+
+class _Worker:
+    def __init__(self, name: str, queue_size: int, overflow: str) -> None:
+        self.queue: Deque[Task] = deque()
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.processed = 0
+        self.high_watermark = 0
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def put(self, task: Task) -> bool:
+        with self.cond:
+            if len(self.queue) >= self.queue_size:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.queue) >= self.queue_size and not self.stopping:
+                        self.cond.wait()
+            self.queue.append(task)
+            depth = len(self.queue)
+            if depth > self.high_watermark:
+                self.high_watermark = depth
+            self.cond.notify_all()
+        return True
+
+    def stop(self) -> None:
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+
+    def _run(self) -> None:
+        logger = logging.getLogger(self.thread.name)
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopping:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                func, args = self.queue.popleft()
+                # Wake a producer blocked on a full queue.
+                self.cond.notify_all()
+            try:
+                func(*args)
+            except Exception:  # pragma: no cover - a bad message must not kill the worker
+                logger.exception("Dispatched handler failed")
+            self.processed += 1
+
+
+class KeyedDispatcher:
+    def __init__(self, config: DispatchConfig, name: str = "dispatch") -> None:
+        self._config = config
+        self._workers: List[_Worker] = [
+            _Worker(f"{name}-{index}", config.queue_size, config.overflow)
+            for index in range(config.workers)
+        ]
+        self._started = False
+
+    @property
+    def config(self) -> DispatchConfig:
+        return self._config
+
+    def start(self) -> None:
+        if self._started:
+            return
+        for worker in self._workers:
+            worker.thread.start()
+        self._started = True
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Drain queued work and stop the workers."""
+        for worker in self._workers:
+            worker.stop()
+        if self._started:
+            for worker in self._workers:
+                worker.thread.join(timeout)
+        self._started = False
+
+    def key_for_topic(self, topic: str) -> str:
+        levels = topic.split("/")
+        if 0 <= self._config.key_level < len(levels):
+            return levels[self._config.key_level]
+        return topic
+
+    def submit(self, key: str, func: Callable[..., None], *args: Any) -> bool:
+        """Queue ``func(*args)`` on the worker owning ``key``; False if it was dropped."""
+        index = zlib.crc32(key.encode("utf-8")) % len(self._workers)
+        return self._workers[index].put((func, args))
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [len(worker.queue) for worker in self._workers]
+        return {
+            "queue_depths": depths,
+            "queue_depth": sum(depths),
+            "high_watermark": max(worker.high_watermark for worker in self._workers),
+            "processed": sum(worker.processed for worker in self._workers),
+            "dropped": sum(worker.dropped for worker in self._workers),
+        }
@@ -0,0 +1,388 @@
+"""Memory-mapped, columnar per-room time series with pre-computed rollups.
+
+Each series is split into time segments (``segment_s`` long). A segment is a
+set of column files under ``<room>/<series>/``, one file per column, mapped
+with ``numpy.memmap``. The ``ts`` column file starts with a small header
+(row count, out-of-order flag), so a segment is self-describing and reopened
+as-is after a restart. Columns grow by doubling when a segment fills up.
+
+Temperature samples also update 1-minute and 1-hour rollup series (min,
+max, sum, count per bucket) in place as they arrive, so range queries at
+those resolutions read a few hundred pre-aggregated rows instead of the raw
+samples.
+"""
+
+from __future__ import annotations
+
+import re
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+RAW = "raw"
+ROLLUPS = {"1m": 60, "1h": 3600}
+RESOLUTIONS = (RAW, *ROLLUPS)
+TEMPERATURE = "temperature"
+ALERTS = "alerts"
+
+ALERT_CODES = {"OVERHEAT": 1, "RECOVERED": 2, "RAPID_RISE": 3}
+LEVEL_CODES = {"INFO": 0, "WARN": 1, "CRITICAL": 2}
+STATE_CODES = {"OFF": 0, "ON": 1}
+
+_VALUE_COLUMNS = {"value": "<f8"}
+_ALERT_COLUMNS = {"code": "i1", "level": "i1", "value": "<f8"}
+_STATE_COLUMNS = {"code": "i1"}
+_ROLLUP_COLUMNS = {"min": "<f8", "max": "<f8", "sum": "<f8", "count": "<i8"}
+# Rollup segments hold this many buckets (a day of minutes, 60 days of hours).
+_ROLLUP_BUCKETS_PER_SEGMENT = 1440
+_INITIAL_ROWS = 1024
+# Header slots at the start of the ts file: row count, then 1 if rows are not in time order.
+_HEADER = 2
+_ROOM_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+class Segment:
+    """One time slice of a series: a memory-mapped file per column."""
+
+    def __init__(self, prefix: Path, columns: Mapping[str, str], capacity: int = _INITIAL_ROWS) -> None:
+        self._prefix = prefix
+        self._columns = dict(columns)
+        ts_path = self._path("ts")
+        if ts_path.exists():
+            capacity = ts_path.stat().st_size // 8 - _HEADER
+        else:
+            self._resize(capacity, create=True)
+        self._capacity = capacity
+        self._map()
+
+    @property
+    def count(self) -> int:
+        return int(self._ts_file[0])
+
+    @property
+    def ts(self) -> np.ndarray:
+        return self._ts_file[_HEADER : _HEADER + self.count]
+
+    @property
+    def ordered(self) -> bool:
+        return not self._ts_file[1]
+
+    def column(self, name: str) -> np.ndarray:
+        return self.cols[name][: self.count]
+
+    def append(self, ts: int, values: Mapping[str, float]) -> None:
+        count = self.count
+        if count == self._capacity:
+            self._grow()
+        for name, value in values.items():
+            self.cols[name][count] = value
+        if count and ts < self._ts_file[_HEADER + count - 1]:
+            self._ts_file[1] = 1
+        self._ts_file[_HEADER + count] = ts
+        # The row count is written last, so a torn append is simply not visible.
+        self._ts_file[0] = count + 1
+
+    def flush(self) -> None:
+        self._ts_file.flush()
+        for column in self.cols.values():
+            column.flush()
+
+    def delete(self) -> None:
+        self.close()
+        for name in ("ts", *self._columns):
+            self._path(name).unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self.flush()
+        self.cols = {}
+        del self._ts_file
+
+    def _path(self, column: str) -> Path:
+        return self._prefix.with_name(f"{self._prefix.name}.{column}")
+
+    def _map(self) -> None:
+        self._ts_file = np.memmap(self._path("ts"), dtype="<i8", mode="r+", shape=(self._capacity + _HEADER,))
+        self.cols: Dict[str, np.memmap] = {
+            name: np.memmap(self._path(name), dtype=dtype, mode="r+", shape=(self._capacity,))
+            for name, dtype in self._columns.items()
+        }
+
+    def _grow(self) -> None:
+        self.close()
+        self._capacity *= 2
+        self._resize(self._capacity, create=False)
+        self._map()
+
+    def _resize(self, capacity: int, create: bool) -> None:
+        self._prefix.parent.mkdir(parents=True, exist_ok=True)
+        for name, dtype in (("ts", "<i8"), *self._columns.items()):
+            rows = capacity + _HEADER if name == "ts" else capacity
+            path = self._path(name)
+            with open(path, "wb" if create else "r+b") as handle:
+                handle.truncate(rows * np.dtype(dtype).itemsize)
+
+
+class Series:
+    """Time-ordered rows of one kind for one room, split into segments."""
+
+    def __init__(self, directory: Path, columns: Mapping[str, str], segment_s: int) -> None:
+        self._directory = directory
+        self._columns = dict(columns)
+        self._segment_s = segment_s
+        self._segments: Dict[int, Segment] = {}
+        if directory.exists():
+            for path in directory.glob("*.ts"):
+                start = int(path.name.split(".", 1)[0])
+                self._segments[start] = Segment(directory / str(start), self._columns)
+        self._starts = sorted(self._segments)
+
+    def append(self, ts: int, values: Mapping[str, float]) -> None:
+        self._segment_for(ts).append(ts, values)
+
+    def last(self) -> Optional[Tuple[Segment, int]]:
+        """The newest segment with rows and the index of its last row."""
+        for start in reversed(self._starts):
+            segment = self._segments[start]
+            if segment.count:
+                return segment, segment.count - 1
+        return None
+
+    def find(self, ts: int) -> Optional[Tuple[Segment, int]]:
+        """Locate the row stamped exactly ``ts`` (rows within a segment are sorted)."""
+        segment = self._segments.get(ts - ts % self._segment_s)
+        if segment is None:
+            return None
+        stamps = segment.ts
+        row = int(np.searchsorted(stamps, ts))
+        if row < stamps.size and stamps[row] == ts:
+            return segment, row
+        return None
+
+    def read(self, start: int, end: int) -> Dict[str, np.ndarray]:
+        """Rows with ``start <= ts < end`` as one array per column (copies, safe to keep)."""
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in ("ts", *self._columns)}
+        first = start - start % self._segment_s
+        for segment_start in self._starts:
+            if segment_start < first or segment_start >= end:
+                continue
+            segment = self._segments[segment_start]
+            stamps = segment.ts
+            if segment.ordered:
+                rows = slice(int(np.searchsorted(stamps, start)), int(np.searchsorted(stamps, end)))
+            else:
+                rows = np.flatnonzero((stamps >= start) & (stamps < end))
+            parts["ts"].append(np.array(stamps[rows]))
+            for name in self._columns:
+                parts[name].append(np.array(segment.column(name)[rows]))
+        return {
+            name: np.concatenate(chunks) if chunks else np.empty(0, dtype=self._columns.get(name, "<i8"))
+            for name, chunks in parts.items()
+        }
+
+    def purge(self, before: int) -> int:
+        """Delete segments that end at or before ``before``; returns how many were removed."""
+        expired = [start for start in self._starts if start + self._segment_s <= before]
+        for start in expired:
+            self._segments.pop(start).delete()
+        self._starts = sorted(self._segments)
+        return len(expired)
+
+    def flush(self) -> None:
+        for segment in self._segments.values():
+            segment.flush()
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+        self._starts = []
+
+    def _segment_for(self, ts: int) -> Segment:
+        start = ts - ts % self._segment_s
+        segment = self._segments.get(start)
+        if segment is None:
+            segment = self._segments[start] = Segment(self._directory / str(start), self._columns)
+            self._starts = sorted(self._segments)
+        return segment
+
+
+class Rollup:
+    """Fixed-size time buckets of min/max/sum/count, updated in place per sample."""
+
+    def __init__(self, directory: Path, bucket_s: int) -> None:
+        self.bucket_s = bucket_s
+        self._series = Series(directory, _ROLLUP_COLUMNS, bucket_s * _ROLLUP_BUCKETS_PER_SEGMENT)
+        self.late_dropped = 0
+
+    def add(self, ts: int, value: float) -> None:
+        bucket = ts - ts % self.bucket_s
+        last = self._series.last()
+        if last is not None and int(last[0].ts[last[1]]) == bucket:
+            self._merge(*last, value)
+            return
+        if last is None or bucket > int(last[0].ts[last[1]]):
+            self._series.append(bucket, {"min": value, "max": value, "sum": value, "count": 1})
+            return
+        found = self._series.find(bucket)
+        if found is None:
+            # Older than the newest bucket and never seen: rows cannot be inserted mid-segment.
+            self.late_dropped += 1
+            return
+        self._merge(*found, value)
+
+    def read(self, start: int, end: int) -> Dict[str, np.ndarray]:
+        rows = self._series.read(start - start % self.bucket_s, end)
+        counts = rows.pop("count")
+        rows["mean"] = rows.pop("sum") / np.maximum(counts, 1)
+        rows["count"] = counts
+        return rows
+
+    def purge(self, before: int) -> int:
+        return self._series.purge(before)
+
+    def flush(self) -> None:
+        self._series.flush()
+
+    def close(self) -> None:
+        self._series.close()
+
+    @staticmethod
+    def _merge(segment: Segment, row: int, value: float) -> None:
+        cols = segment.cols
+        if value < cols["min"][row]:
+            cols["min"][row] = value
+        if value > cols["max"][row]:
+            cols["max"][row] = value
+        cols["sum"][row] += value
+        cols["count"][row] += 1
+
+
+class RoomHistory:
+    def __init__(self, directory: Path, segment_s: int, state_series: Iterable[str]) -> None:
+        self.lock = threading.Lock()
+        self.temperature = Series(directory / TEMPERATURE, _VALUE_COLUMNS, segment_s)
+        self.alerts = Series(directory / ALERTS, _ALERT_COLUMNS, segment_s)
+        self.states = {name: Series(directory / name, _STATE_COLUMNS, segment_s) for name in state_series}
+        self.rollups = {
+            name: Rollup(directory / f"{TEMPERATURE}.{name}", bucket_s) for name, bucket_s in ROLLUPS.items()
+        }
+
+    def series(self, name: str) -> Series:
+        if name == TEMPERATURE:
+            return self.temperature
+        if name == ALERTS:
+            return self.alerts
+        return self.states[name]
+
+
+class HistoryStore:
+    """Per-room history for temperature, alerts and actuator states."""
+
+    def __init__(
+        self,
+        directory: str | Path,
+        segment_s: int = 86400,
+        retention_s: Optional[Mapping[str, int]] = None,
+        state_series: Iterable[str] = (),
+    ) -> None:
+        self._directory = Path(directory)
+        self._segment_s = segment_s
+        self._retention_s = dict(retention_s or {})
+        self._state_series = tuple(state_series)
+        self._rooms: Dict[str, RoomHistory] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def series_names(self) -> Tuple[str, ...]:
+        return (TEMPERATURE, ALERTS, *self._state_series)
+
+    def record_temperature(self, room_id: str, ts: int, temp_c: float) -> None:
+        room = self._room(room_id)
+        with room.lock:
+            room.temperature.append(ts, {"value": temp_c})
+            for rollup in room.rollups.values():
+                rollup.add(ts, temp_c)
+
+    def record_alert(self, room_id: str, ts: int, alert_type: str, level: str, temp_c: float) -> None:
+        room = self._room(room_id)
+        with room.lock:
+            values = {"code": ALERT_CODES.get(alert_type, 0), "level": LEVEL_CODES.get(level, 0), "value": temp_c}
+            room.alerts.append(ts, values)
+
+    def record_state(self, room_id: str, series: str, ts: int, state: str) -> None:
+        room = self._room(room_id)
+        with room.lock:
+            room.states[series].append(ts, {"code": STATE_CODES.get(state, -1)})
+
+    def query(self, room_id: str, series: str, start: int, end: int, resolution: str = RAW) -> Dict[str, np.ndarray]:
+        if series not in self.series_names:
+            raise KeyError(series)
+        if resolution != RAW and series != TEMPERATURE:
+            raise ValueError(f"Rollups are only kept for {TEMPERATURE}")
+        room = self._room(room_id, create=False)
+        if room is None:
+            return {"ts": np.empty(0, dtype="<i8")}
+        with room.lock:
+            if resolution != RAW:
+                return room.rollups[resolution].read(start, end)
+            return room.series(series).read(start, end)
+
+    def purge(self, now: int) -> int:
+        """Apply retention per resolution; returns the number of segments removed."""
+        removed = 0
+        for room in list(self._rooms.values()):
+            with room.lock:
+                raw_s = self._retention_s.get(RAW)
+                if raw_s:
+                    for name in self.series_names:
+                        removed += room.series(name).purge(now - raw_s)
+                for name, rollup in room.rollups.items():
+                    keep_s = self._retention_s.get(name)
+                    if keep_s:
+                        removed += rollup.purge(now - keep_s)
+        return removed
+
+    def flush(self) -> None:
+        for room in list(self._rooms.values()):
+            with room.lock:
+                for name in self.series_names:
+                    room.series(name).flush()
+                for rollup in room.rollups.values():
+                    rollup.flush()
+
+    def drop_room(self, room_id: str, delete_files: bool = False) -> None:
+        with self._lock:
+            room = self._rooms.pop(room_id, None)
+        if room is not None:
+            with room.lock:
+                for name in self.series_names:
+                    room.series(name).close()
+                for rollup in room.rollups.values():
+                    rollup.close()
+        if delete_files and _ROOM_ID.match(room_id):
+            shutil.rmtree(self._directory / room_id, ignore_errors=True)
+
+    def rollup_late_dropped(self) -> int:
+        """Late samples left out of the rollups (their bucket was never seen); the raw series has them."""
+        with self._lock:
+            rooms = list(self._rooms.values())
+        return sum(rollup.late_dropped for room in rooms for rollup in room.rollups.values())
+
+    def _room(self, room_id: str, create: bool = True) -> Optional[RoomHistory]:
+        room = self._rooms.get(room_id)
+        if room is not None:
+            return room
+        if not _ROOM_ID.match(room_id):
+            raise ValueError(f"Invalid room id for history storage: {room_id!r}")
+        directory = self._directory / room_id
+        if not create and not directory.exists():
+            return None
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = RoomHistory(directory, self._segment_s, self._state_series)
+        return room
+
@@ -0,0 +1,108 @@
+"""Latest-value table with coalesced, diff-only frames for live viewers.
+
+Writers (MQTT callbacks) only overwrite a cell and mark its room as changed.
+A single frame loop runs at ``refresh_hz``: it serializes the changed rooms
+once and hands the same frame to every viewer, so the cost of a busy fleet
+depends on the refresh rate and the number of changed rooms, not on the
+telemetry rate. A viewer that falls behind gets a full snapshot instead of a
+backlog of diffs.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Set
+
+
+class LatestValueTable:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rooms: Dict[str, Dict[str, Any]] = {}
+        self._changed: Set[str] = set()
+        self.updates = 0
+
+    def update(self, room_id: str, kind: str, value: Any) -> None:
+        with self._lock:
+            self._rooms.setdefault(room_id, {})[kind] = value
+            self._changed.add(room_id)
+            self.updates += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {room_id: dict(cells) for room_id, cells in self._rooms.items()}
+
+    def take_changes(self) -> Dict[str, Dict[str, Any]]:
+        """Current cells of every room changed since the last call."""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            return {room_id: dict(self._rooms[room_id]) for room_id in changed}
+
+
+class _Viewer:
+    __slots__ = ("queue", "resync")
+
+    def __init__(self, max_pending: int) -> None:
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_pending)
+        self.resync = False
+
+
+class FrameBroadcaster:
+    """Fans coalesced diff frames out to SSE viewers from one asyncio loop."""
+
+    def __init__(self, table: LatestValueTable, refresh_hz: float = 2.0, max_pending_frames: int = 8) -> None:
+        if refresh_hz <= 0:
+            raise ValueError("refresh_hz must be positive")
+        self._table = table
+        self._interval_s = 1.0 / refresh_hz
+        self._max_pending = max_pending_frames
+        self._viewers: List[_Viewer] = []
+        self.frames_sent = 0
+
+    @property
+    def viewers(self) -> int:
+        return len(self._viewers)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval_s)
+            self.publish_changes()
+
+    def publish_changes(self) -> None:
+        changes = self._table.take_changes()
+        if not changes or not self._viewers:
+            return
+        frame = self._frame("diff", changes)
+        for viewer in self._viewers:
+            if viewer.resync:
+                continue
+            try:
+                viewer.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Drop the backlog; the viewer catches up with one snapshot.
+                viewer.resync = True
+        self.frames_sent += 1
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Server-sent events for one viewer: a snapshot, then diffs."""
+        viewer = _Viewer(self._max_pending)
+        self._viewers.append(viewer)
+        try:
+            yield self._frame("snapshot", self._table.snapshot())
+            while True:
+                if viewer.resync:
+                    while not viewer.queue.empty():
+                        viewer.queue.get_nowait()
+                    viewer.resync = False
+                    yield self._frame("snapshot", self._table.snapshot())
+                    continue
+                yield await viewer.queue.get()
+        finally:
+            self._viewers.remove(viewer)
+
+    @staticmethod
+    def _frame(event: str, rooms: Dict[str, Dict[str, Any]]) -> str:
+        data = json.dumps({"ts": int(time.time()), "rooms": rooms}, separators=(",", ":"))
+        return f"event: {event}\ndata: {data}\n\n"
@@ -0,0 +1,307 @@
+"""Runtime metrics for ``MqttServiceClient``: message rates, decode failures,
+handler latency histograms, publish counts and bytes, and queue depths.
+
+Instruments are created once per subscribed filter or published topic
+template (``iot/{room_id}/alerts``; topics outside the client's templates
+share one ``other`` instrument) and updated in place on the message path: an integer increment and, for handler
+latency, one bisect into preallocated buckets. Updates take no lock. Each
+instrument normally has a single writer (the network thread, or the dispatch
+worker that owns the room); if two threads ever update one instrument at the
+same instant an increment can be lost, which is acceptable for monitoring.
+
+A ``MetricsRegistry`` renders as Prometheus text (``serve_metrics`` exposes
+it on a local port) and as a JSON snapshot that ``MetricsReporter``
+publishes to ``iot/services/{client_id}/metrics``.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Handler latency bucket upper bounds in seconds (the last bucket is +Inf).
+LATENCY_BUCKETS_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRICS_TOPIC_TEMPLATE = "iot/services/{client_id}/metrics"
+# Publish metrics label for topics that match none of the client's templates.
+OTHER_TOPICS = "other"
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool = False
+    # Prometheus text on http://{host}:{port}/metrics; 0 serves nothing.
+    port: int = 0
+    host: str = "127.0.0.1"
+    # Seconds between snapshots on the metrics topic; 0 disables publishing.
+    publish_interval_s: float = 10.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Mapping[str, Any]]) -> "MetricsConfig":
+        config = cls(**(payload or {}))
+        if config.port < 0 or config.publish_interval_s < 0:
+            raise ValueError("Metrics port and publish_interval_s must not be negative")
+        return config
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS_S) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile (the largest bound for +Inf)."""
+        counts = list(self.counts)
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if count and seen >= rank:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return 0.0
+
+
+class TopicMetrics:
+    """Instruments of one subscribed filter."""
+
+    __slots__ = ("received", "decode_failures", "handler_seconds")
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.decode_failures = 0
+        self.handler_seconds = Histogram()
+
+
+class PublishMetrics:
+    __slots__ = ("messages", "bytes")
+
+    def __init__(self) -> None:
+        self.messages = 0
+        self.bytes = 0
+
+
+class MetricsRegistry:
+    def __init__(self, client_id: str) -> None:
+        self.client_id = client_id
+        self.topics: Dict[str, TopicMetrics] = {}
+        self.published: Dict[str, PublishMetrics] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        # Instruments are created from several threads; lookups stay lock-free.
+        self._lock = threading.Lock()
+        self._previous: Dict[str, int] = {}
+        self._previous_at = time.monotonic()
+
+    def topic(self, topic_filter: str) -> TopicMetrics:
+        metrics = self.topics.get(topic_filter)
+        if metrics is None:
+            with self._lock:
+                metrics = self.topics.setdefault(topic_filter, TopicMetrics())
+        return metrics
+
+    def publish(self, topic_template: str) -> PublishMetrics:
+        metrics = self.published.get(topic_template)
+        if metrics is None:
+            with self._lock:
+                metrics = self.published.setdefault(topic_template, PublishMetrics())
+        return metrics
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        """Report ``read()`` under ``name`` whenever metrics are collected."""
+        self._gauges[name] = read
+
+    def render_prometheus(self) -> str:
+        return render_prometheus([self])
+
+    def samples(self) -> List[Tuple[str, str, str, float]]:
+        """(name, type, labels, value) for every series, in Prometheus naming."""
+        service = f'service="{_label(self.client_id)}"'
+        samples: List[Tuple[str, str, str, float]] = []
+        for topic_filter, metrics in list(self.topics.items()):
+            labels = f'{service},topic="{_label(topic_filter)}"'
+            samples.append(("iot_messages_received_total", "counter", labels, metrics.received))
+            samples.append(("iot_decode_failures_total", "counter", labels, metrics.decode_failures))
+            histogram = metrics.handler_seconds
+            cumulative = 0
+            for index, count in enumerate(list(histogram.counts)):
+                cumulative += count
+                le = repr(histogram.bounds[index]) if index < len(histogram.bounds) else "+Inf"
+                samples.append(("iot_handler_seconds_bucket", "histogram", f'{labels},le="{le}"', cumulative))
+            samples.append(("iot_handler_seconds_sum", "histogram", labels, round(histogram.total, 6)))
+            samples.append(("iot_handler_seconds_count", "histogram", labels, cumulative))
+        for topic, metrics in list(self.published.items()):
+            labels = f'{service},topic="{_label(topic)}"'
+            samples.append(("iot_messages_published_total", "counter", labels, metrics.messages))
+            samples.append(("iot_published_bytes_total", "counter", labels, metrics.bytes))
+        for name, value in self._read_gauges().items():
+            samples.append((f"iot_{name}", "gauge", service, value))
+        return samples
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-friendly totals plus rates since the previous snapshot."""
+        now = time.monotonic()
+        elapsed = max(now - self._previous_at, 1e-9)
+        current: Dict[str, int] = {}
+
+        def rate(key: str, total: int) -> float:
+            current[key] = total
+            return round((total - self._previous.get(key, 0)) / elapsed, 2)
+
+        topics = {}
+        for topic_filter, metrics in list(self.topics.items()):
+            histogram = metrics.handler_seconds
+            count = histogram.count
+            topics[topic_filter] = {
+                "received": metrics.received,
+                "rate_per_s": rate(f"in:{topic_filter}", metrics.received),
+                "decode_failures": metrics.decode_failures,
+                "handler_ms": {
+                    "count": count,
+                    "mean": round(histogram.total / count * 1000.0, 3) if count else 0.0,
+                    "p50": histogram.quantile(0.5) * 1000.0,
+                    "p99": histogram.quantile(0.99) * 1000.0,
+                },
+            }
+        published = {
+            topic: {
+                "messages": metrics.messages,
+                "bytes": metrics.bytes,
+                "rate_per_s": rate(f"out:{topic}", metrics.messages),
+            }
+            for topic, metrics in list(self.published.items())
+        }
+        self._previous = current
+        self._previous_at = now
+        return {
+            "client_id": self.client_id,
+            "ts": int(time.time()),
+            "interval_s": round(elapsed, 3),
+            "topics": topics,
+            "published": published,
+            "gauges": self._read_gauges(),
+        }
+
+    def _read_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, read in list(self._gauges.items()):
+            try:
+                values[name] = read()
+            except Exception:  # pragma: no cover - a broken gauge must not hide the others
+                logging.getLogger(self.client_id).exception("Metrics gauge %s failed", name)
+        return values
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(registries: Iterable[MetricsRegistry]) -> str:
+    """Prometheus text exposition; each metric family is listed once across registries."""
+    families: Dict[str, Tuple[str, List[str]]] = {}
+    for registry in registries:
+        for name, kind, labels, value in registry.samples():
+            # Histogram series (_bucket, _sum, _count) share their family's TYPE line.
+            family = name.rsplit("_", 1)[0] if kind == "histogram" else name
+            families.setdefault(family, (kind, []))[1].append(f"{name}{{{labels}}} {value}")
+    lines: List[str] = []
+    for family, (kind, series) in families.items():
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(series)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves ``GET /metrics`` for every registry added to it."""
+
+    def __init__(self, host: str, port: int) -> None:
+        self._registries: Dict[str, MetricsRegistry] = {}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"metrics-{port}", daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def add(self, registry: MetricsRegistry) -> None:
+        self._registries[registry.client_id] = registry
+
+    def render(self) -> str:
+        return render_prometheus(list(self._registries.values()))
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802 - http.server naming
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = server.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                return None
+
+        return Handler
+
+
+# Services hosted in one process (services.runner) share one server per port.
+_servers: Dict[Tuple[str, int], MetricsServer] = {}
+_servers_lock = threading.Lock()
+
+
+def serve_metrics(registry: MetricsRegistry, host: str, port: int) -> MetricsServer:
+    with _servers_lock:
+        server = _servers.get((host, port))
+        if server is None:
+            server = _servers[(host, port)] = MetricsServer(host, port)
+    server.add(registry)
+    return server
+
+
+class MetricsReporter:
+    """Publishes the registry's snapshot to the client's metrics topic every interval."""
+
+    def __init__(self, registry: MetricsRegistry, publish: Callable[[str, dict], None], interval_s: float) -> None:
+        self._registry = registry
+        self._publish = publish
+        self._interval_s = interval_s
+        self._topic = METRICS_TOPIC_TEMPLATE.format(client_id=registry.client_id)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{registry.client_id}-metrics", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval_s):
+            try:
+                self._publish(self._topic, self._registry.snapshot())
+            except Exception:  # pragma: no cover - keep reporting after a failed publish
+                logging.getLogger(self._registry.client_id).exception("Failed to publish metrics")
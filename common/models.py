@@ -1,96 +1,457 @@
 from __future__ import annotations
 
-"""Shared data models for JSON payloads exchanged across services."""
+"""Shared data models and payload codecs for messages exchanged across services.
 
+Payloads are JSON by default. A compact binary layout is also available for
+the three core models; receivers auto-detect it, so JSON and binary producers
+can share a topic while a deployment is being migrated. Telemetry may also
+travel as a SenML pack (a JSON array of records, RFC 8428) carrying several
+samples in one message.
+"""
+
+import json
+import os
+import struct
+import sys
 from dataclasses import dataclass
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Type, TypeVar
+
+M = TypeVar("M")
+
+
+class PayloadError(ValueError):
+    """Decode failure whose message is only formatted when it is actually read.
+
+    Noisy topics can produce many bad payloads; rendering each one into a
+    string up front is wasted work when the error is only counted or dropped.
+    """
+
+    def __init__(self, model: str, payload: Any) -> None:
+        super().__init__(model, payload)
+        self.model = model
+        self.payload = payload
+
+    def __str__(self) -> str:
+        return f"Invalid {self.model} payload: {self.payload!r:.256}"
+
+
+def _as_int(value: Any) -> int:
+    return value if type(value) is int else int(value)
+
+
+def _as_float(value: Any) -> float:
+    return value if type(value) is float else float(value)
+
+
+def _as_str(value: Any) -> str:
+    return value if type(value) is str else str(value)
+
+
+def _as_trace(value: Any) -> Dict[str, Any] | None:
+    if value is None or type(value) is dict:
+        return value
+    raise TypeError("trace must be an object")
+
+
+def _from_raw(cls: Type[M], raw: bytes) -> M:
+    if raw[:1] == _MAGIC_BYTE:
+        return cls.from_bytes(raw)  # type: ignore[attr-defined]
+    try:
+        payload = json.loads(raw)
+    except ValueError as exc:
+        raise PayloadError(cls.__name__, raw) from exc
+    return cls.from_dict(payload)  # type: ignore[attr-defined]
+
 
+# Binary layout: magic byte, model tag, fixed-width numeric fields, then
+# length-prefixed ids and one-byte codes for the small closed vocabularies.
+# JSON always starts with "{" or "[", so the magic byte is unambiguous.
+BINARY_MAGIC = 0xA5
+_MAGIC_BYTE = bytes((BINARY_MAGIC,))
+_HEADER = struct.Struct("<BB")
+_TAG_TELEMETRY = 1
+_TAG_ALERT = 2
+_TAG_ACTUATOR = 3
+_TELEMETRY_STRUCT = struct.Struct("<qd")
+_ALERT_STRUCT = struct.Struct("<qd")
+_ACTUATOR_STRUCT = struct.Struct("<q")
+_UNITS: Tuple[str, ...] = ("C", "F", "K")
+_ALERT_TYPES: Tuple[str, ...] = ("OVERHEAT", "RECOVERED", "RAPID_RISE")
+_LEVELS: Tuple[str, ...] = ("INFO", "WARN", "CRITICAL")
+_STATES: Tuple[str, ...] = ("OFF", "ON")
+_LITERAL = 0xFF
+# Model units <-> SenML unit names (RFC 8428 registers "Cel" and "K").
+_SENML_UNITS = {"C": "Cel", "K": "K"}
+_MODEL_UNITS = {senml: unit for unit, senml in _SENML_UNITS.items()}
 
-@dataclass
+
+def _pack_str(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    if len(encoded) > 0xFF:
+        raise ValueError(f"Identifier too long for binary payload: {value[:32]}...")
+    return bytes((len(encoded),)) + encoded
+
+
+def _unpack_str(data: bytes, offset: int) -> Tuple[str, int]:
+    length = data[offset]
+    end = offset + 1 + length
+    if end > len(data):
+        raise IndexError("truncated string")
+    # Room and device ids repeat on every message; interning keeps one copy each.
+    return sys.intern(data[offset + 1 : end].decode("utf-8")), end
+
+
+def _pack_enum(value: str, table: Tuple[str, ...]) -> bytes:
+    try:
+        return bytes((table.index(value),))
+    except ValueError:
+        return bytes((_LITERAL,)) + _pack_str(value)
+
+
+def _unpack_enum(data: bytes, offset: int, table: Tuple[str, ...]) -> Tuple[str, int]:
+    code = data[offset]
+    if code == _LITERAL:
+        return _unpack_str(data, offset + 1)
+    return table[code], offset + 1
+
+
+@dataclass(slots=True)
 class TemperatureTelemetry:
     bn: str
     ts: int
     room_id: str
     temp_c: float
     unit: str = "C"
+    # Optional trace context (common/tracing.py); traced payloads are always JSON.
+    trace: Dict[str, Any] | None = None
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        payload = {
             "bn": self.bn,
             "ts": self.ts,
             "room_id": self.room_id,
             "temp_c": self.temp_c,
             "unit": self.unit,
         }
+        if self.trace is not None:
+            payload["trace"] = self.trace
+        return payload
 
     @classmethod
     def from_dict(cls, payload: Dict[str, Any]) -> "TemperatureTelemetry":
         try:
             return cls(
-                bn=str(payload["bn"]),
-                ts=int(payload["ts"]),
-                room_id=str(payload["room_id"]),
-                temp_c=float(payload["temp_c"]),
-                unit=str(payload.get("unit", "C")),
+                bn=_as_str(payload["bn"]),
+                ts=_as_int(payload["ts"]),
+                room_id=_as_str(payload["room_id"]),
+                temp_c=_as_float(payload["temp_c"]),
+                unit=_as_str(payload.get("unit", "C")),
+                trace=_as_trace(payload.get("trace")),
             )
-        except (KeyError, TypeError, ValueError) as exc:
-            raise ValueError(f"Invalid TemperatureTelemetry payload: {payload}") from exc
+        except (KeyError, TypeError, ValueError, AttributeError) as exc:
+            raise PayloadError("TemperatureTelemetry", payload) from exc
+
+    def to_bytes(self) -> bytes:
+        return (
+            _HEADER.pack(BINARY_MAGIC, _TAG_TELEMETRY)
+            + _TELEMETRY_STRUCT.pack(self.ts, self.temp_c)
+            + _pack_str(self.bn)
+            + _pack_str(self.room_id)
+            + _pack_enum(self.unit, _UNITS)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TemperatureTelemetry":
+        try:
+            if data[1] != _TAG_TELEMETRY:
+                raise ValueError("unexpected model tag")
+            ts, temp_c = _TELEMETRY_STRUCT.unpack_from(data, _HEADER.size)
+            bn, offset = _unpack_str(data, _HEADER.size + _TELEMETRY_STRUCT.size)
+            room_id, offset = _unpack_str(data, offset)
+            unit, _ = _unpack_enum(data, offset, _UNITS)
+        except (struct.error, UnicodeDecodeError, IndexError, ValueError) as exc:
+            raise PayloadError("TemperatureTelemetry", data) from exc
+        return cls(bn=bn, ts=ts, room_id=room_id, temp_c=temp_c, unit=unit)
+
+    @classmethod
+    def from_raw(cls, raw: bytes) -> "TemperatureTelemetry":
+        """Decode a JSON or binary payload straight into a model."""
+        return _from_raw(cls, raw)
+
+    @staticmethod
+    def to_pack(samples: Sequence["TemperatureTelemetry"]) -> List[Dict[str, Any]]:
+        """Encode samples of one room as a SenML pack.
+
+        The first record holds the base name (the longest prefix shared by the
+        device ids), base time and base unit; every record then carries only
+        its name suffix, time offset and value.
+        """
+        if not samples:
+            raise ValueError("Cannot pack zero samples")
+        first = samples[0]
+        base_name = os.path.commonprefix([sample.bn for sample in samples])
+        base_unit = first.unit
+        records: List[Dict[str, Any]] = []
+        for sample in samples:
+            record: Dict[str, Any] = {}
+            if sample.bn != base_name:
+                record["n"] = sample.bn[len(base_name) :]
+            if sample.ts != first.ts:
+                record["t"] = sample.ts - first.ts
+            if sample.unit != base_unit:
+                record["u"] = _SENML_UNITS.get(sample.unit, sample.unit)
+            record["v"] = sample.temp_c
+            if sample.trace is not None:
+                record["trace"] = sample.trace
+            records.append(record)
+        base = {"bn": base_name, "bt": first.ts, "bu": _SENML_UNITS.get(base_unit, base_unit), "room_id": first.room_id}
+        records[0] = {**base, **records[0]}
+        return records
+
+    @classmethod
+    def from_pack(cls, records: Any) -> List["TemperatureTelemetry"]:
+        """Decode a SenML pack; base fields apply to the records that follow them."""
+        samples: List[TemperatureTelemetry] = []
+        base_name, base_time, base_unit, room_id = "", 0, "C", None
+        try:
+            for record in records:
+                if "bn" in record:
+                    base_name = _as_str(record["bn"])
+                if "bt" in record:
+                    base_time = record["bt"]
+                if "bu" in record:
+                    base_unit = _MODEL_UNITS.get(record["bu"], record["bu"])
+                if "room_id" in record:
+                    room_id = _as_str(record["room_id"])
+                unit = record.get("u")
+                samples.append(
+                    cls(
+                        bn=base_name + _as_str(record.get("n", "")),
+                        ts=_as_int(base_time + record.get("t", 0)),
+                        room_id=room_id or "",
+                        temp_c=_as_float(record["v"]),
+                        unit=base_unit if unit is None else _as_str(_MODEL_UNITS.get(unit, unit)),
+                        trace=_as_trace(record.get("trace")),
+                    )
+                )
+        except (KeyError, TypeError, ValueError, AttributeError) as exc:
+            raise PayloadError("TemperatureTelemetry pack", records) from exc
+        if room_id is None or not samples:
+            raise PayloadError("TemperatureTelemetry pack", records)
+        return samples
+
+
+class TelemetryPack:
+    """Subscription model for telemetry topics that may carry SenML packs.
+
+    ``subscribe(..., model=TelemetryPack)`` hands handlers a list of
+    ``TemperatureTelemetry``: every record of a pack, or a single sample for
+    a plain payload, so one handler serves both producers.
+    """
 
+    @staticmethod
+    def from_raw(raw: bytes) -> List[TemperatureTelemetry]:
+        if raw[:1] == b"[":
+            try:
+                records = json.loads(raw)
+            except ValueError as exc:
+                raise PayloadError("TemperatureTelemetry pack", raw) from exc
+            return TemperatureTelemetry.from_pack(records)
+        return [TemperatureTelemetry.from_raw(raw)]
 
-@dataclass
+    @staticmethod
+    def from_dict(payload: Any) -> List[TemperatureTelemetry]:
+        if isinstance(payload, list):
+            return TemperatureTelemetry.from_pack(payload)
+        return [TemperatureTelemetry.from_dict(payload)]
+
+
+@dataclass(slots=True)
 class AlertEvent:
     ts: int
     room_id: str
     type: str
     level: str
     temp_c: float
+    trace: Dict[str, Any] | None = None
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        payload = {
             "ts": self.ts,
             "room_id": self.room_id,
             "type": self.type,
             "level": self.level,
             "temp_c": self.temp_c,
         }
+        if self.trace is not None:
+            payload["trace"] = self.trace
+        return payload
 
     @classmethod
     def from_dict(cls, payload: Dict[str, Any]) -> "AlertEvent":
         try:
             return cls(
-                ts=int(payload["ts"]),
-                room_id=str(payload["room_id"]),
-                type=str(payload["type"]),
-                level=str(payload["level"]),
-                temp_c=float(payload["temp_c"]),
+                ts=_as_int(payload["ts"]),
+                room_id=_as_str(payload["room_id"]),
+                type=_as_str(payload["type"]),
+                level=_as_str(payload["level"]),
+                temp_c=_as_float(payload["temp_c"]),
+                trace=_as_trace(payload.get("trace")),
             )
-        except (KeyError, TypeError, ValueError) as exc:
-            raise ValueError(f"Invalid AlertEvent payload: {payload}") from exc
+        except (KeyError, TypeError, ValueError, AttributeError) as exc:
+            raise PayloadError("AlertEvent", payload) from exc
+
+    def to_bytes(self) -> bytes:
+        return (
+            _HEADER.pack(BINARY_MAGIC, _TAG_ALERT)
+            + _ALERT_STRUCT.pack(self.ts, self.temp_c)
+            + _pack_str(self.room_id)
+            + _pack_enum(self.type, _ALERT_TYPES)
+            + _pack_enum(self.level, _LEVELS)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "AlertEvent":
+        try:
+            if data[1] != _TAG_ALERT:
+                raise ValueError("unexpected model tag")
+            ts, temp_c = _ALERT_STRUCT.unpack_from(data, _HEADER.size)
+            room_id, offset = _unpack_str(data, _HEADER.size + _ALERT_STRUCT.size)
+            alert_type, offset = _unpack_enum(data, offset, _ALERT_TYPES)
+            level, _ = _unpack_enum(data, offset, _LEVELS)
+        except (struct.error, UnicodeDecodeError, IndexError, ValueError) as exc:
+            raise PayloadError("AlertEvent", data) from exc
+        return cls(ts=ts, room_id=room_id, type=alert_type, level=level, temp_c=temp_c)
 
+    @classmethod
+    def from_raw(cls, raw: bytes) -> "AlertEvent":
+        """Decode a JSON or binary payload straight into a model."""
+        return _from_raw(cls, raw)
 
-@dataclass
+
+@dataclass(slots=True)
 class ActuatorState:
     ts: int
     device: str
     room_id: str
     state: str
+    trace: Dict[str, Any] | None = None
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        payload = {
             "ts": self.ts,
             "device": self.device,
             "room_id": self.room_id,
             "state": self.state,
         }
+        if self.trace is not None:
+            payload["trace"] = self.trace
+        return payload
 
     @classmethod
     def from_dict(cls, payload: Dict[str, Any]) -> "ActuatorState":
         try:
             return cls(
-                ts=int(payload["ts"]),
-                device=str(payload["device"]),
-                room_id=str(payload["room_id"]),
-                state=str(payload["state"]),
+                ts=_as_int(payload["ts"]),
+                device=_as_str(payload["device"]),
+                room_id=_as_str(payload["room_id"]),
+                state=_as_str(payload["state"]),
+                trace=_as_trace(payload.get("trace")),
             )
-        except (KeyError, TypeError, ValueError) as exc:
-            raise ValueError(f"Invalid ActuatorState payload: {payload}") from exc
+        except (KeyError, TypeError, ValueError, AttributeError) as exc:
+            raise PayloadError("ActuatorState", payload) from exc
+
+    def to_bytes(self) -> bytes:
+        return (
+            _HEADER.pack(BINARY_MAGIC, _TAG_ACTUATOR)
+            + _ACTUATOR_STRUCT.pack(self.ts)
+            + _pack_str(self.device)
+            + _pack_str(self.room_id)
+            + _pack_enum(self.state, _STATES)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ActuatorState":
+        try:
+            if data[1] != _TAG_ACTUATOR:
+                raise ValueError("unexpected model tag")
+            (ts,) = _ACTUATOR_STRUCT.unpack_from(data, _HEADER.size)
+            device, offset = _unpack_str(data, _HEADER.size + _ACTUATOR_STRUCT.size)
+            room_id, offset = _unpack_str(data, offset)
+            state, _ = _unpack_enum(data, offset, _STATES)
+        except (struct.error, UnicodeDecodeError, IndexError, ValueError) as exc:
+            raise PayloadError("ActuatorState", data) from exc
+        return cls(ts=ts, device=device, room_id=room_id, state=state)
+
+    @classmethod
+    def from_raw(cls, raw: bytes) -> "ActuatorState":
+        """Decode a JSON or binary payload straight into a model."""
+        return _from_raw(cls, raw)
+
+
+_TELEMETRY_KEYS = frozenset(("bn", "ts", "room_id", "temp_c", "unit"))
+_ALERT_KEYS = frozenset(("ts", "room_id", "type", "level", "temp_c"))
+_ACTUATOR_KEYS = frozenset(("ts", "device", "room_id", "state"))
+_BINARY_MODELS: Dict[int, Callable[[bytes], Any]] = {
+    _TAG_TELEMETRY: TemperatureTelemetry.from_bytes,
+    _TAG_ALERT: AlertEvent.from_bytes,
+    _TAG_ACTUATOR: ActuatorState.from_bytes,
+}
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, payload: Any) -> bytes:
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+class BinaryCodec:
+    """Compact encoding for the core models; anything else falls back to JSON.
+
+    Only payloads whose keys exactly match a model are encoded, so extra
+    fields (indicator reasons, aggregates, trace context, ...) are never
+    silently dropped.
+    """
+
+    name = "binary"
+
+    def __init__(self) -> None:
+        self._fallback = JsonCodec()
+
+    def encode(self, payload: Any) -> bytes:
+        if isinstance(payload, dict):
+            keys = payload.keys()
+            try:
+                if keys == _TELEMETRY_KEYS:
+                    return TemperatureTelemetry.from_dict(payload).to_bytes()
+                if keys == _ALERT_KEYS:
+                    return AlertEvent.from_dict(payload).to_bytes()
+                if keys == _ACTUATOR_KEYS:
+                    return ActuatorState.from_dict(payload).to_bytes()
+            except ValueError:
+                pass
+        return self._fallback.encode(payload)
+
+
+CODECS: Dict[str, Any] = {JsonCodec.name: JsonCodec(), BinaryCodec.name: BinaryCodec()}
+
+
+def get_codec(name: str) -> Any:
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown payload codec: {name}") from None
+
+
+def decode_payload(raw: bytes) -> Any:
+    """Decode a JSON or binary payload into plain JSON-compatible data."""
+    if raw[:1] == _MAGIC_BYTE:
+        if len(raw) < _HEADER.size or raw[1] not in _BINARY_MODELS:
+            # Truncated or unknown header: a decode failure like any other.
+            raise PayloadError("binary", raw)
+        return _BINARY_MODELS[raw[1]](raw).to_dict()
+    try:
+        return json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid JSON payload") from exc
@@ -1,14 +1,37 @@
 from __future__ import annotations
 
-"""Reusable MQTT client wrapper to keep service implementations consistent."""
+"""Reusable MQTT client wrapper to keep service implementations consistent.
 
+``MqttServiceClient`` runs handlers on the transport's network thread;
+``AsyncMqttServiceClient`` is the same client for asyncio services, with
+handlers on the event loop, ``async for`` message streams and awaitable
+publish acknowledgements.
+"""
+
+import asyncio
 import json
 import logging
 import time
-from dataclasses import dataclass
-from typing import Callable, Iterable
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from common.dispatch import DispatchConfig, KeyedDispatcher
+from common.metrics import METRICS_TOPIC_TEMPLATE, OTHER_TOPICS, MetricsRegistry, PublishMetrics, TopicMetrics
+from common.models import JsonCodec, PayloadError, decode_payload, get_codec
+from common.topics import TopicRouter, template_to_filter
+from common.transport import TRANSPORT_PAHO, AsyncioPahoTransport, Transport, create_transport
+
+MessageHandler = Callable[[str, Any], None]
+
+
+class _Route:
+    __slots__ = ("handler", "model", "metrics")
 
-import paho.mqtt.client as mqtt
+    def __init__(self, handler: MessageHandler, model: Optional[type], metrics: TopicMetrics) -> None:
+        self.handler = handler
+        self.model = model
+        self.metrics = metrics
 
 
 @dataclass
@@ -16,28 +39,49 @@ class MqttConfig:
     host: str
     port: int
     keepalive: int = 60
+    # Topic template -> payload codec name ("json" or "binary").
+    codecs: Dict[str, str] = field(default_factory=dict)
+    # "paho" for a real broker, "loopback" for the in-process broker.
+    transport: str = TRANSPORT_PAHO
 
 
 class MqttServiceClient:
-    def __init__(self, client_id: str, mqtt_config: MqttConfig) -> None:
+    def __init__(self, client_id: str, mqtt_config: MqttConfig, transport: Transport | None = None) -> None:
         self._logger = logging.getLogger(client_id)
-        self._client = mqtt.Client(client_id=client_id)
+        self._client = transport or create_transport(mqtt_config.transport, client_id)
         self._config = mqtt_config
         self._client.on_connect = self._on_connect
-        self._client.on_disconnect = self._on_disconnect
-        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._client.on_message = self._on_message
+        # Loopback transports carry payload objects; only sockets need codecs.
+        self._encode_payloads = not self._client.carries_objects
+        self._router: TopicRouter[_Route] = TopicRouter()
+        self._subscriptions: Dict[str, int] = {}
+        self._dispatcher: Optional[KeyedDispatcher] = None
+        self._codec_router: TopicRouter[Any] = TopicRouter()
+        for template, codec_name in mqtt_config.codecs.items():
+            self._codec_router.add(template_to_filter(template), get_codec(codec_name))
+        self._codec_cache: Dict[str, Any] = {}
+        self._default_codec = JsonCodec()
+        self.metrics = MetricsRegistry(client_id)
+        self.metrics.gauge("transport_queue_depth", self._client.queue_depth)
         self._status_topic = f"iot/services/{client_id}/status"
-        self._client.will_set(
-            self._status_topic,
-            payload=json.dumps({"status": "OFFLINE", "ts": int(time.time())}),
-            qos=1,
-            retain=True,
+        # Publish metrics are kept per topic template, so their series do not grow with rooms.
+        self._publish_templates: TopicRouter[str] = TopicRouter()
+        self._known_templates: set[str] = set()
+        self._publish_metrics: Dict[str, PublishMetrics] = {}
+        self.add_topic_templates(
+            [self._status_topic, METRICS_TOPIC_TEMPLATE.format(client_id=client_id), *mqtt_config.codecs]
         )
+        self._client.set_will(self._status_topic, self._status_payload("OFFLINE"), qos=1, retain=True)
 
     def connect(self) -> None:
         self._client.connect(self._config.host, self._config.port, self._config.keepalive)
 
+    def disconnect(self) -> None:
+        self._client.disconnect()
+
     def loop_forever(self) -> None:
+        """Serve the network loop; after ``loop_start`` this only waits for ``loop_stop``."""
         self._client.loop_forever()
 
     def loop_start(self) -> None:
@@ -45,46 +89,344 @@ class MqttServiceClient:
 
     def loop_stop(self) -> None:
         self._client.loop_stop()
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
 
-    def subscribe(self, topics: Iterable[object], handler: Callable[[str, dict], None]) -> None:
-        def on_message(client: mqtt.Client, userdata: object, msg: mqtt.MQTTMessage) -> None:
-            try:
-                payload = json.loads(msg.payload.decode("utf-8"))
-                handler(msg.topic, payload)
-            except json.JSONDecodeError:
-                self._logger.warning("Invalid JSON payload on topic %s", msg.topic)
-
-        self._client.on_message = on_message
-        for topic in topics:
-            if isinstance(topic, tuple):
-                topic_name, qos = topic
-            else:
-                topic_name, qos = topic, 0
-            self._client.subscribe(topic_name, qos=qos)
+    def enable_dispatch(self, config: DispatchConfig) -> None:
+        """Run handlers on a keyed worker pool instead of paho's network thread."""
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        self._dispatcher = KeyedDispatcher(config, name=f"{self._logger.name}-dispatch")
+        self._dispatcher.start()
+        self.metrics.gauge("dispatch_queue_depth", lambda: self.dispatch_stats().get("queue_depth", 0))
+        self._logger.info(
+            "Dispatching handlers on %s workers (queue_size=%s, overflow=%s)",
+            config.workers,
+            config.queue_size,
+            config.overflow,
+        )
+
+    def dispatch_stats(self) -> Dict[str, Any]:
+        if self._dispatcher is None:
+            return {}
+        return self._dispatcher.stats()
+
+    def subscribe(
+        self,
+        topics: Iterable[object],
+        handler: MessageHandler,
+        model: Optional[type] = None,
+    ) -> None:
+        """Route messages matching ``topics`` to ``handler``.
+
+        Calls accumulate: every handler whose filter matches a topic receives
+        the message, so services can register one handler per topic kind.
+        With ``model`` (e.g. ``TemperatureTelemetry``) the handler receives a
+        model decoded straight from the raw bytes instead of a dict; payloads
+        that fail to decode are logged and skipped.
+        """
+        for topic_name, qos in _normalize_topics(topics):
+            self._router.add(topic_name, _Route(handler, model, self.metrics.topic(topic_name)))
+            if self._subscriptions.get(topic_name, -1) >= qos:
+                continue
+            self._subscriptions[topic_name] = qos
+            self._client.subscribe([(topic_name, qos)])
             self._logger.info("Subscribed to %s (qos=%s)", topic_name, qos)
 
-    def publish_json(self, topic: str, payload: dict, qos: int = 0, retain: bool = False) -> None:
-        message = json.dumps(payload, separators=(",", ":"))
-        self._client.publish(topic, message, qos=qos, retain=retain)
+    def unsubscribe(self, topics: Iterable[object], handler: MessageHandler | None = None) -> None:
+        """Drop ``handler`` (or all handlers) for ``topics``; unsubscribes once a filter has none left."""
+        predicate = None if handler is None else (lambda route: route.handler == handler)
+        for topic_name, _ in _normalize_topics(topics):
+            self._router.remove(topic_name, predicate)
+            if self._router.has_filter(topic_name) or topic_name not in self._subscriptions:
+                continue
+            del self._subscriptions[topic_name]
+            self._client.unsubscribe(topic_name)
+            self._logger.info("Unsubscribed from %s", topic_name)
+
+    def publish_json(self, topic: str, payload: dict | list, qos: int = 0, retain: bool = False) -> None:
+        """Publish ``payload`` using the codec configured for the topic (JSON by default)."""
+        message = self._codec_for(topic).encode(payload) if self._encode_payloads else payload
+        self._publish(topic, message, qos, retain)
+
+    def clear_retained(self, topic: str) -> None:
+        self._publish(topic, b"", 1, True)
+
+    def _publish(self, topic: str, message: Any, qos: int, retain: bool) -> Optional[int]:
+        mid = self._client.publish(topic, message, qos=qos, retain=retain)
+        metrics = self._publish_metrics.get(topic)
+        if metrics is None:
+            metrics = self._publish_metrics_for(topic)
+        metrics.messages += 1
+        if isinstance(message, (bytes, bytearray, str)):
+            # Loopback payloads are objects and have no wire size.
+            metrics.bytes += len(message)
+        return mid
+
+    def add_topic_templates(self, templates: Iterable[str]) -> None:
+        """Templates that label publish metrics; topics matching none count under ``other``."""
+        for template in templates:
+            if template not in self._known_templates:
+                self._publish_templates.add(template_to_filter(template), template)
+                self._known_templates.add(template)
+        self._publish_metrics = {}
+
+    def _publish_metrics_for(self, topic: str) -> PublishMetrics:
+        templates = self._publish_templates.match(topic)
+        metrics = self._publish_metrics[topic] = self.metrics.publish(templates[0] if templates else OTHER_TOPICS)
+        return metrics
 
-    def _on_connect(self, client: mqtt.Client, userdata: object, flags: dict, rc: int) -> None:
+    def _codec_for(self, topic: str) -> Any:
+        codec = self._codec_cache.get(topic)
+        if codec is None:
+            matches = self._codec_router.match(topic)
+            codec = matches[0] if matches else self._default_codec
+            self._codec_cache[topic] = codec
+        return codec
+
+    def _status_payload(self, status: str) -> Any:
+        payload = {"status": status, "ts": int(time.time())}
+        return json.dumps(payload) if self._encode_payloads else payload
+
+    def _on_message(self, topic: str, raw: Any) -> None:
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            self._deliver(topic, raw)
+            return
+        if not dispatcher.submit(dispatcher.key_for_topic(topic), self._deliver, topic, raw):
+            self._logger.debug("Dispatch queue full; dropped message on %s", topic)
+
+    def _deliver(self, topic: str, raw: Any) -> None:
+        routes = self._router.match(topic)
+        if not routes or not raw:
+            # Empty payloads only clear retained messages.
+            return
+        if not isinstance(raw, (bytes, bytearray)):
+            self._deliver_object(topic, raw, routes)
+            return
+        payload: Any = None
+        decoded: Dict[type, Any] = {}
+        for route in routes:
+            metrics = route.metrics
+            metrics.received += 1
+            try:
+                if route.model is None:
+                    if payload is None:
+                        payload = decode_payload(raw)
+                    message = payload
+                else:
+                    message = decoded.get(route.model)
+                    if message is None:
+                        message = decoded[route.model] = route.model.from_raw(raw)
+            except ValueError as exc:
+                self._logger.warning("%s on topic %s", exc, topic)
+                metrics.decode_failures += 1
+                if not isinstance(exc, PayloadError):
+                    return
+                continue
+            self._call(route, topic, message)
+
+    def _deliver_object(self, topic: str, payload: Any, routes: List[_Route]) -> None:
+        """Loopback delivery: the published object, converted only for routes that ask for a model."""
+        converted: Dict[type, Any] = {}
+        for route in routes:
+            route.metrics.received += 1
+            message = payload
+            if route.model is not None and not isinstance(payload, route.model):
+                message = converted.get(route.model)
+                if message is None:
+                    try:
+                        message = converted[route.model] = route.model.from_dict(payload)
+                    except PayloadError as exc:
+                        self._logger.warning("%s on topic %s", exc, topic)
+                        route.metrics.decode_failures += 1
+                        continue
+            self._call(route, topic, message)
+
+    def _call(self, route: _Route, topic: str, message: Any) -> None:
+        started = perf_counter()
+        try:
+            route.handler(topic, message)
+        except Exception:  # pragma: no cover - keep one handler from starving the others
+            self._logger.exception("Handler failed for topic %s", topic)
+        route.metrics.handler_seconds.observe(perf_counter() - started)
+
+    def _on_connect(self, rc: int) -> None:
         if rc == 0:
             self._logger.info("Connected to MQTT broker")
-            client.publish(
-                self._status_topic,
-                json.dumps({"status": "ONLINE", "ts": int(time.time())}),
-                qos=1,
-                retain=True,
-            )
+            if self._subscriptions:
+                # Clean sessions drop subscriptions on reconnect; restore them.
+                self._client.subscribe(list(self._subscriptions.items()))
+            self._publish(self._status_topic, self._status_payload("ONLINE"), 1, True)
         else:
             self._logger.error("Failed to connect to MQTT broker: %s", rc)
 
-    def _on_disconnect(self, client: mqtt.Client, userdata: object, rc: int) -> None:
-        if rc == 0:
-            self._logger.info("Disconnected from MQTT broker: %s", rc)
+
+def _normalize_topics(topics: Iterable[object]) -> List[Tuple[str, int]]:
+    normalized = []
+    for topic in topics:
+        if isinstance(topic, tuple):
+            topic_name, qos = topic
+        else:
+            topic_name, qos = topic, 0
+        normalized.append((topic_name, qos))
+    return normalized
+
+
+class MessageStream:
+    """Messages of one subscription as an async iterator of ``(topic, payload)``.
+
+    Filled on the event loop by ``AsyncMqttServiceClient``; when the consumer
+    falls ``queue_size`` messages behind, new messages are dropped and counted.
+    Closing unsubscribes and ends the iteration once queued messages are read.
+    """
+
+    _CLOSED = object()
+
+    def __init__(
+        self,
+        client: "AsyncMqttServiceClient",
+        topics: List[Tuple[str, int]],
+        model: Optional[type],
+        queue_size: int,
+    ) -> None:
+        self._client = client
+        self._topics = topics
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._closed = False
+        self.dropped = 0
+        client.subscribe(topics, self._put, model=model)
+
+    def _put(self, topic: str, payload: Any) -> None:
+        try:
+            self._queue.put_nowait((topic, payload))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._client.unsubscribe(self._topics, self._put)
+        while True:
+            try:
+                self._queue.put_nowait(self._CLOSED)
+                return
+            except asyncio.QueueFull:
+                # Make room for the end marker; the oldest message is lost.
+                self._queue.get_nowait()
+                self.dropped += 1
+
+    def __aiter__(self) -> "MessageStream":
+        return self
+
+    async def __anext__(self) -> Tuple[str, Any]:
+        item = await self._queue.get()
+        if item is self._CLOSED:
+            self._queue.put_nowait(item)
+            raise StopAsyncIteration
+        return item
+
+    async def __aenter__(self) -> "MessageStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class AsyncMqttServiceClient(MqttServiceClient):
+    """``MqttServiceClient`` for asyncio services.
+
+    With the paho transport the connection is driven by the running loop
+    (``AsyncioPahoTransport``): handlers, message streams and acknowledgements
+    all run on the loop thread, with no network thread and no per-message
+    thread hop. Other transports (the loopback broker, a runner's shared
+    connection) keep their own delivery thread and hand each message to the
+    loop. Status topic and last-will behave as in ``MqttServiceClient``.
+    Handler dispatch pools are not supported.
+    """
+
+    def __init__(self, client_id: str, mqtt_config: MqttConfig, transport: Transport | None = None) -> None:
+        if transport is None and mqtt_config.transport == TRANSPORT_PAHO:
+            transport = AsyncioPahoTransport(client_id)
+        super().__init__(client_id, mqtt_config, transport)
+        self._client.on_publish = self._on_publish
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connected: Optional[asyncio.Future] = None
+        # Message id -> future resolved by the transport's on_publish.
+        self._acks: Dict[int, asyncio.Future] = {}
+
+    async def connect(self, timeout_s: float = 10.0) -> None:
+        """Connect from the running loop and wait for the broker's CONNACK."""
+        loop = self._loop = asyncio.get_running_loop()
+        if not self._client.runs_on_loop:
+            # Callbacks arrive on the transport's thread; futures may only be touched on the loop.
+            self._client.on_message = lambda topic, raw: loop.call_soon_threadsafe(self._on_message, topic, raw)
+            self._client.on_publish = lambda mid: loop.call_soon_threadsafe(self._on_publish, mid)
+            self._client.loop_start()
+        self._connected = loop.create_future()
+        self._client.connect(self._config.host, self._config.port, self._config.keepalive)
+        await asyncio.wait_for(asyncio.shield(self._connected), timeout_s)
+
+    def disconnect(self) -> None:
+        self._client.disconnect()
+        if not self._client.runs_on_loop:
+            self._client.loop_stop()
+        for ack in self._acks.values():
+            if not ack.done():
+                ack.set_exception(ConnectionError("MQTT client disconnected"))
+        self._acks.clear()
+
+    def loop_start(self) -> None:
+        """Nothing to start: the connection runs on the event loop."""
+        return None
+
+    def loop_stop(self) -> None:
+        return None
+
+    def loop_forever(self) -> None:
+        raise RuntimeError("AsyncMqttServiceClient runs on the event loop; await the service's own tasks instead")
+
+    def enable_dispatch(self, config: DispatchConfig) -> None:
+        raise RuntimeError("Handler dispatch pools are not supported by AsyncMqttServiceClient")
+
+    def messages(
+        self, topics: Iterable[object], model: Optional[type] = None, queue_size: int = 1000
+    ) -> MessageStream:
+        """Subscribe ``topics`` and iterate their messages with ``async for``."""
+        return MessageStream(self, _normalize_topics(topics), model, queue_size)
+
+    async def publish(self, topic: str, payload: dict | list, qos: int = 0, retain: bool = False) -> None:
+        """Publish like ``publish_json`` and wait until the message is sent (QoS 0) or acknowledged (QoS 1/2)."""
+        message = self._codec_for(topic).encode(payload) if self._encode_payloads else payload
+        mid = self._publish(topic, message, qos, retain)
+        if mid is None:
             return
-        self._logger.warning("Unexpected MQTT disconnect (rc=%s); attempting reconnect", rc)
+        # Acks are handled on the loop, so the ack cannot arrive before this.
+        ack = self._acks[mid] = self._loop.create_future()
         try:
-            client.reconnect()
-        except Exception as exc:  # pragma: no cover - best-effort reconnect
-            self._logger.warning("MQTT reconnect attempt failed: %s", exc)
+            await ack
+        finally:
+            # Callers that give up (wait_for timeouts) must not leave the waiter behind.
+            self._acks.pop(mid, None)
+
+    def _on_publish(self, mid: int) -> None:
+        # Messages sent with publish_json have no waiter.
+        ack = self._acks.pop(mid, None)
+        if ack is not None and not ack.done():
+            ack.set_result(None)
+
+    def _on_connect(self, rc: int) -> None:
+        super()._on_connect(rc)
+        if self._client.runs_on_loop:
+            self._resolve_connected(rc)
+        elif self._loop is not None:
+            self._loop.call_soon_threadsafe(self._resolve_connected, rc)
+
+    def _resolve_connected(self, rc: int) -> None:
+        connected = self._connected
+        if connected is not None and not connected.done():
+            if rc == 0:
+                connected.set_result(None)
+            else:
+                connected.set_exception(ConnectionError(f"MQTT broker refused the connection: {rc}"))
@@ -0,0 +1,124 @@
+"""Room sharding for stateful services that run as several replicas.
+
+Rooms are spread over replicas with a consistent-hash ring, so changing the
+replica count only moves the rooms whose owner actually changes. The Home
+Catalog computes assignments; replicas poll it and rebalance when the
+assignment epoch changes.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:  # pragma: no cover - import cycle only needed for typing
+    from common.service_base import ServiceBase
+
+
+def stable_hash(key: str) -> int:
+    """Process-independent 64-bit hash (``hash()`` is salted per interpreter)."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], vnodes: int = 64) -> None:
+        points: List[Tuple[int, str]] = sorted(
+            (stable_hash(f"{node}#{index}"), node) for node in nodes for index in range(vnodes)
+        )
+        if not points:
+            raise ValueError("HashRing needs at least one node")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def replica_name(index: int) -> str:
+    return f"replica-{index}"
+
+
+def assign_rooms(rooms: Iterable[str], replicas: int, vnodes: int = 64) -> Dict[int, List[str]]:
+    ring = HashRing([replica_name(index) for index in range(replicas)], vnodes)
+    owners = {replica_name(index): index for index in range(replicas)}
+    assignment: Dict[int, List[str]] = {index: [] for index in range(replicas)}
+    for room_id in rooms:
+        assignment[owners[ring.owner(room_id)]].append(room_id)
+    return assignment
+
+
+def assignment_epoch(rooms: Iterable[str], replicas: int) -> str:
+    digest = hashlib.blake2b(json.dumps([sorted(rooms), replicas]).encode("utf-8"), digest_size=6)
+    return digest.hexdigest()
+
+
+@dataclass
+class PartitionConfig:
+    enabled: bool = False
+    replicas: int = 1
+    vnodes: int = 64
+    poll_s: float = 10.0
+    handoff_topic_template: str = "iot/services/{service_name}/handoff/{room_id}"
+    # A newly owned room waits up to poll_s + handoff_margin_s for its handoff (the old owner
+    # only notices the move on its next poll) before processing starts on empty state.
+    handoff_margin_s: float = 5.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Dict[str, object]]) -> "PartitionConfig":
+        config = cls(**(payload or {}))
+        if config.replicas < 1:
+            raise ValueError("partitioning.replicas must be at least 1")
+        return config
+
+    @property
+    def handoff_wait_s(self) -> float:
+        return self.poll_s + self.handoff_margin_s
+
+
+class ShardWatcher:
+    """Polls the catalog for this replica's rooms and rebalances on change."""
+
+    def __init__(self, service: "ServiceBase", replica: int, config: PartitionConfig, epoch: str) -> None:
+        self._service = service
+        self._replica = replica
+        self._config = config
+        self._epoch = epoch
+        self._stop = threading.Event()
+        self._logger = logging.getLogger(f"{service.service_name}.shards")
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="shard-watcher", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._config.poll_s):
+            try:
+                self.refresh()
+            except Exception as exc:  # pragma: no cover - catalog outages are retried
+                self._logger.warning("Shard assignment poll failed: %s", exc)
+
+    def refresh(self) -> None:
+        """Fetch this replica's assignment now and rebalance if its epoch moved."""
+        assignment = self._service.home_catalog.get_shard_assignment(self._service.service_name, self._replica)
+        if assignment["epoch"] == self._epoch:
+            return
+        self._logger.info(
+            "Shard assignment changed (%s -> %s, replicas=%s)",
+            self._epoch,
+            assignment["epoch"],
+            assignment["replicas"],
+        )
+        self._epoch = assignment["epoch"]
+        self._service.rebalance_rooms(assignment["rooms"])
@@ -0,0 +1,141 @@
+"""Report-by-exception and adaptive sampling for temperature publishers.
+
+A reading is published only when it moved at least ``deadband_c`` from the
+last published value of its device, or when the device has been silent for
+``max_silence_s`` (a heartbeat, so consumers can tell a steady room from a
+dead sensor). With adaptive sampling the time to the next reading shrinks
+towards ``min_sampling_s`` as the reading approaches the alert high
+threshold, and grows by ``backoff`` up to ``max_sampling_s`` while readings
+stay inside the deadband.
+
+Settings and state are column arrays indexed by device, so a whole simulated
+fleet is decided with a few NumPy operations per tick.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class ReportingRule:
+    # 0 publishes every reading (the heartbeat then never matters).
+    deadband_c: float = 0.0
+    # Seconds without a publish after which the next reading is sent anyway.
+    max_silence_s: float = 60.0
+    adaptive: bool = False
+    min_sampling_s: float = 1.0
+    max_sampling_s: float = 60.0
+    # Distance below the high threshold at which sampling starts to speed up.
+    approach_c: float = 1.0
+    # Interval multiplier for each reading that stays inside the deadband.
+    backoff: float = 2.0
+
+    @classmethod
+    def from_dict(cls, payload: Mapping[str, Any], defaults: Optional["ReportingRule"] = None) -> "ReportingRule":
+        values = {} if defaults is None else {f.name: getattr(defaults, f.name) for f in fields(cls)}
+        values.update({f.name: payload[f.name] for f in fields(cls) if f.name in payload})
+        rule = cls(**values)
+        if rule.deadband_c < 0 or rule.max_silence_s <= 0:
+            raise ValueError("deadband_c must not be negative and max_silence_s must be positive")
+        if not 0 < rule.min_sampling_s <= rule.max_sampling_s or rule.approach_c <= 0 or rule.backoff < 1:
+            raise ValueError("Invalid adaptive sampling settings")
+        return rule
+
+
+@dataclass
+class ReportingConfig:
+    enabled: bool = False
+    default: ReportingRule = field(default_factory=ReportingRule)
+    # Device id -> overrides of the default rule.
+    devices: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # Threshold adaptive sampling approaches; None reads it from the alert strategy's config.
+    high_threshold: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Mapping[str, Any]]) -> "ReportingConfig":
+        """Rule fields sit at the top level next to ``enabled``, ``devices`` and ``high_threshold``."""
+        payload = dict(payload or {})
+        return cls(
+            enabled=bool(payload.pop("enabled", False)),
+            devices=dict(payload.pop("devices", None) or {}),
+            high_threshold=payload.pop("high_threshold", None),
+            default=ReportingRule.from_dict(payload),
+        )
+
+    def rule_for(self, device_id: str) -> ReportingRule:
+        overrides = self.devices.get(device_id)
+        return self.default if overrides is None else ReportingRule.from_dict(overrides, self.default)
+
+
+class ExceptionReporter:
+    """Per-device deadband, heartbeat and sampling-interval state."""
+
+    def __init__(
+        self,
+        rules: Sequence[ReportingRule],
+        base_interval_s: float,
+        high_thresholds: Sequence[float],
+    ) -> None:
+        def column(name: str) -> np.ndarray:
+            return np.array([getattr(rule, name) for rule in rules], dtype=np.float64)
+
+        self.base_interval_s = base_interval_s
+        self._deadband = column("deadband_c")
+        self._max_silence = column("max_silence_s")
+        self._adaptive = np.array([rule.adaptive for rule in rules], dtype=bool)
+        self._min_s = np.minimum(column("min_sampling_s"), base_interval_s)
+        self._max_s = np.maximum(column("max_sampling_s"), base_interval_s)
+        self._approach = column("approach_c")
+        self._backoff = column("backoff")
+        # NaN where the threshold is unknown: only the stability backoff applies.
+        self._high = np.asarray(high_thresholds, dtype=np.float64)
+        size = len(rules)
+        self._last_value = np.full(size, np.nan)
+        self._last_sent = np.full(size, -np.inf)
+        self.intervals = np.full(size, base_interval_s)
+        self._next_due = np.zeros(size)
+        self.sampled = 0
+        self.published = 0
+
+    @property
+    def fastest_interval_s(self) -> float:
+        """Shortest interval any device can reach; callers tick at least this often."""
+        return float(np.where(self._adaptive, self._min_s, self.base_interval_s).min())
+
+    def due(self, now: float) -> np.ndarray:
+        """Indices of the devices whose next reading is due."""
+        return np.flatnonzero(self._next_due <= now)
+
+    def report(self, indices: np.ndarray, values: np.ndarray, now: float) -> np.ndarray:
+        """Record readings of ``indices``; returns the mask of readings to publish."""
+        last = self._last_value[indices]
+        changed = np.isnan(last) | (np.abs(values - last) >= self._deadband[indices])
+        publish = changed | (now - self._last_sent[indices] >= self._max_silence[indices])
+        sent = indices[publish]
+        self._last_value[sent] = values[publish]
+        self._last_sent[sent] = now
+
+        adaptive = self._adaptive[indices]
+        if adaptive.any():
+            margin = self._high[indices] - values
+            approach = self._approach[indices]
+            near = margin <= approach  # False where the threshold is unknown
+            min_s = self._min_s[indices]
+            closeness = np.clip(np.nan_to_num(margin / approach, nan=1.0), 0.0, 1.0)
+            near_interval = min_s + (self.base_interval_s - min_s) * closeness
+            stable_interval = np.minimum(self.intervals[indices] * self._backoff[indices], self._max_s[indices])
+            interval = np.where(near, near_interval, np.where(changed, self.base_interval_s, stable_interval))
+            self.intervals[indices] = np.where(adaptive, interval, self.base_interval_s)
+        self._next_due[indices] = now + self.intervals[indices]
+
+        self.sampled += len(indices)
+        self.published += int(publish.sum())
+        return publish
+
+    def suppression_ratio(self) -> float:
+        """Share of readings that were not published."""
+        return round(1.0 - self.published / self.sampled, 4) if self.sampled else 0.0
@@ -3,7 +3,18 @@ from __future__ import annotations
 import os
 
 DEFAULT_HOME_CATALOG_URL = "http://localhost:8000"
+DEFAULT_CATALOG_CACHE_DIR = "state/catalog_cache"
 
 
 def get_home_catalog_url() -> str:
     return os.getenv("HOME_CATALOG_URL", DEFAULT_HOME_CATALOG_URL)
+
+
+def get_service_replica() -> int:
+    """Replica index of this process when a service runs partitioned."""
+    return int(os.getenv("SERVICE_REPLICA", "0"))
+
+
+def get_catalog_cache_dir() -> str | None:
+    """Directory for the last-known-good catalog config; an empty value disables the cache."""
+    return os.getenv("HOME_CATALOG_CACHE_DIR", DEFAULT_CATALOG_CACHE_DIR) or None
@@ -5,19 +5,54 @@ from __future__ import annotations
 Services inherit this to share lifecycle behavior and reduce duplication.
 """
 
+import atexit
+import json
 import logging
+import signal
+import threading
+import time
+from typing import Callable, Iterable, Mapping
+
+import requests
 
 from common.config_client import HomeCatalogClient
-from common.mqtt_client import MqttConfig, MqttServiceClient
+from common.config_watch import ConfigWatchConfig, ConfigWatcher
+from common.dispatch import DispatchConfig
+from common.metrics import MetricsConfig, MetricsReporter, serve_metrics
+from common.mqtt_client import MessageHandler, MqttConfig, MqttServiceClient
+from common.partitioning import PartitionConfig, ShardWatcher
+from common.runtime import get_catalog_cache_dir, get_service_replica
+from common.snapshot import SnapshotConfig, StateCheckpointer
+from common.topics import topic_templates_of
+from common.transport import Transport
+
+RECONCILE_RETRY_S = 30.0
 
 
 class ServiceBase:
+    # Asyncio services use AsyncMqttServiceClient and ``await self.mqtt.connect()``.
+    mqtt_client_class: type[MqttServiceClient] = MqttServiceClient
+
     def __init__(self, service_name: str, home_catalog_url: str) -> None:
         self.service_name = service_name
-        self.home_catalog = HomeCatalogClient(home_catalog_url)
+        self.home_catalog = HomeCatalogClient(home_catalog_url, cache_dir=get_catalog_cache_dir())
         self._logger = logging.getLogger(service_name)
         self._mqtt_client: MqttServiceClient | None = None
         self._service_config: dict | None = None
+        self._rooms: set[str] = set()
+        self._partition_config = PartitionConfig()
+        self._shard_watcher: ShardWatcher | None = None
+        self._checkpointer: StateCheckpointer | None = None
+        self._config_watcher: ConfigWatcher | None = None
+        self._metrics_reporter: MetricsReporter | None = None
+        # Rooms change from the main thread, the shard watcher and the config watcher.
+        self._rooms_lock = threading.RLock()
+        self._started = False
+        self._pending_config: dict | None = None
+        # Room id -> handoff handler of rooms taken over but not yet subscribed.
+        self._awaiting_handoff: dict[str, MessageHandler] = {}
+        # Set by a multi-service runner to put this service on a shared connection.
+        self.transport_factory: Callable[[str], Transport] | None = None
 
     @property
     def service_config(self) -> dict:
@@ -31,16 +66,315 @@ class ServiceBase:
             raise RuntimeError("MQTT client not initialized")
         return self._mqtt_client
 
+    @property
+    def rooms(self) -> list[str]:
+        return sorted(self._rooms)
+
     def load_config(self) -> None:
-        mqtt_config = self.home_catalog.get_mqtt_config()
-        self._service_config = self.home_catalog.get_service_config(self.service_name)
-        self._mqtt_client = MqttServiceClient(
-            client_id=self.service_name,
+        """Load broker and service config in one catalog round trip.
+
+        When a last-known-good copy is cached on disk the service starts from
+        it immediately and reconciles with the catalog in the background.
+        """
+        replica = get_service_replica()
+        bootstrap, from_cache = self.home_catalog.bootstrap(self.service_name, replica)
+        mqtt_config = bootstrap["mqtt"]
+        self._service_config = dict(bootstrap["service"])
+        watch_config = ConfigWatchConfig.from_dict(self._service_config.get("config_watch"))
+        if watch_config.enabled:
+            self._config_watcher = ConfigWatcher(self, watch_config, bootstrap.get("etag"))
+        client_id = self.service_name
+        self._partition_config = PartitionConfig.from_dict(self._service_config.get("partitioning"))
+        if self._partition_config.enabled:
+            # Each replica only sees the rooms the catalog assigned to it and
+            # needs its own client id so replicas do not evict each other.
+            assignment = bootstrap.get("shards") or self.home_catalog.get_shard_assignment(self.service_name, replica)
+            self._service_config["rooms"] = assignment["rooms"]
+            client_id = f"{self.service_name}-{replica}"
+            self._shard_watcher = ShardWatcher(self, replica, self._partition_config, assignment["epoch"])
+            self._logger.info(
+                "Replica %s/%s owns %s room(s)", replica, assignment["replicas"], len(assignment["rooms"])
+            )
+        snapshot_config = SnapshotConfig.from_dict(self._service_config.get("snapshot"))
+        if snapshot_config.enabled:
+            self._checkpointer = StateCheckpointer(self, snapshot_config, name=client_id)
+        self._mqtt_client = self.mqtt_client_class(
+            client_id=client_id,
             mqtt_config=MqttConfig(**mqtt_config),
+            transport=None if self.transport_factory is None else self.transport_factory(client_id),
         )
+        self._add_topic_templates(self._service_config)
+        dispatch_config = DispatchConfig.from_dict(self._service_config.get("dispatch"))
+        if dispatch_config.enabled:
+            self._mqtt_client.enable_dispatch(dispatch_config)
+        self._start_metrics(MetricsConfig.from_dict(self._service_config.get("metrics")))
+        if from_cache:
+            self._logger.info("Started from cached config; reconciling with the catalog")
+            threading.Thread(
+                target=self._reconcile_config, args=(bootstrap, replica), name="config-reconcile", daemon=True
+            ).start()
+
+    def _add_topic_templates(self, config: dict) -> None:
+        # Publish metrics are labelled by these templates rather than by concrete topics.
+        templates = topic_templates_of(config)
+        if self._partition_config.enabled:
+            templates.add(self._partition_config.handoff_topic_template)
+        self.mqtt.add_topic_templates(templates)
+
+    def _start_metrics(self, config: MetricsConfig) -> None:
+        if not config.enabled:
+            return
+        registry = self.mqtt.metrics
+        if config.port:
+            server = serve_metrics(registry, config.host, config.port)
+            self._logger.info("Serving metrics on http://%s:%s/metrics", config.host, server.port)
+        if config.publish_interval_s:
+            self._metrics_reporter = MetricsReporter(registry, self.mqtt.publish_json, config.publish_interval_s)
+            self._metrics_reporter.start()
+
+    def _reconcile_config(self, cached: dict, replica: int) -> None:
+        while True:
+            try:
+                fresh = self.home_catalog.fetch_bootstrap(self.service_name, replica)
+                break
+            except requests.RequestException as exc:
+                self._logger.warning("Catalog still unreachable (%s); running on cached config", exc)
+                time.sleep(RECONCILE_RETRY_S)
+        if fresh["mqtt"] != cached["mqtt"]:
+            self._logger.warning("Broker settings changed since the cached config; restart to apply them")
+        if fresh["service"] == cached["service"]:
+            return
+        with self._rooms_lock:
+            self._pending_config = dict(fresh["service"])
+        self._apply_pending_config()
+
+    def _apply_pending_config(self) -> None:
+        # Config is only applied once the service has finished its own start-up.
+        with self._rooms_lock:
+            if not self._started or self._pending_config is None:
+                return
+            config, self._pending_config = self._pending_config, None
+            self.apply_config(config)
 
     def connect_mqtt(self) -> None:
         self.mqtt.connect()
 
     def start(self) -> None:
         raise NotImplementedError
+
+    # Settings that are only read at startup; changing them needs a restart.
+    RESTART_ONLY_KEYS = ("partitioning", "snapshot", "dispatch", "config_watch", "metrics")
+
+    def apply_config(self, config: dict) -> None:
+        """Apply a changed catalog config in place (driven by the config watcher)."""
+        old = self.service_config
+        stale = [key for key in self.RESTART_ONLY_KEYS if old.get(key) != config.get(key)]
+        if stale:
+            self._logger.warning("Changes to %s take effect after a restart", ", ".join(stale))
+            for key in stale:
+                config[key] = old.get(key)
+        if self._partition_config.enabled:
+            # Partitioned rooms come from the shard assignment, not the raw list.
+            config["rooms"] = old.get("rooms", [])
+        self._service_config = config
+        self._add_topic_templates(config)
+        self.reload_config(old, config)
+        if not self._manages_rooms:
+            return
+        if self._shard_watcher is not None:
+            self._shard_watcher.refresh()
+        else:
+            self.rebalance_rooms(config.get("rooms", []))
+
+    @property
+    def _manages_rooms(self) -> bool:
+        return type(self).subscribe_room is not ServiceBase.subscribe_room
+
+    def reload_config(self, old: dict, new: dict) -> None:
+        """Hook for services to pick up changed settings; rooms are rebalanced afterwards."""
+        return None
+
+    # Room lifecycle. Services with per-room subscriptions or state override
+    # the hooks below; rebalance_rooms() drives them when ownership changes.
+
+    def subscribe_room(self, room_id: str) -> None:
+        raise NotImplementedError
+
+    def unsubscribe_room(self, room_id: str) -> None:
+        raise NotImplementedError
+
+    def export_room_state(self, room_id: str) -> dict | None:
+        return None
+
+    def import_room_state(self, room_id: str, state: dict) -> None:
+        return None
+
+    def drop_room_state(self, room_id: str) -> None:
+        return None
+
+    def encode_room_state(self, state: dict) -> bytes:
+        return json.dumps(state, separators=(",", ":")).encode("utf-8")
+
+    def decode_room_state(self, blob: bytes) -> dict:
+        return json.loads(blob)
+
+    def export_rooms_state(self, room_ids: Iterable[str]) -> dict[str, bytes]:
+        """Encoded state of many rooms; services with columnar state override this in bulk."""
+        exported = {}
+        for room_id in room_ids:
+            state = self.export_room_state(room_id)
+            if state is not None:
+                exported[room_id] = self.encode_room_state(state)
+        return exported
+
+    def restore_rooms_state(self, states: Mapping[str, bytes]) -> None:
+        for room_id, blob in states.items():
+            self.import_room_state(room_id, self.decode_room_state(blob))
+
+    def mark_room_dirty(self, room_id: str) -> None:
+        """Record that a room's state changed so the next checkpoint saves it."""
+        if self._checkpointer is not None:
+            self._checkpointer.mark_dirty(room_id)
+
+    def start_rooms(self, rooms: Iterable[str]) -> None:
+        """Take ownership of the initial rooms and start following shard changes.
+
+        With snapshots enabled, saved state for these rooms is restored before
+        any subscription is made, so no message is processed on empty state.
+        """
+        rooms = list(rooms)
+        if self._checkpointer is not None:
+            started = time.monotonic()
+            owned = set(rooms)
+            saved = self._checkpointer.store.load()
+            self.restore_rooms_state({room_id: blob for room_id, blob in saved.items() if room_id in owned})
+            self._logger.info(
+                "Restored state for %s room(s) in %.3fs", len(owned & saved.keys()), time.monotonic() - started
+            )
+        self.rebalance_rooms(rooms)
+        if self._checkpointer is not None:
+            self._checkpointer.start()
+            # A clean shutdown leaves a full snapshot and an empty journal.
+            atexit.register(self._checkpointer.stop)
+            self._stop_checkpointer_on_sigterm()
+        if self._shard_watcher is not None:
+            self._shard_watcher.start()
+        self.mark_started()
+
+    def _stop_checkpointer_on_sigterm(self) -> None:
+        # atexit does not run on SIGTERM (docker stop). Signal handlers can only be set
+        # from the main thread; the runner handles SIGTERM itself and exits normally.
+        if threading.current_thread() is not threading.main_thread():
+            return
+        checkpointer = self._checkpointer
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum: int, frame: object) -> None:
+            checkpointer.stop()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+    def mark_started(self) -> None:
+        """Let catalog config changes be applied from now on.
+
+        ``start_rooms`` calls this; services without rooms call it themselves
+        once their start-up has read the config.
+        """
+        if self._config_watcher is not None:
+            self._config_watcher.start()
+        with self._rooms_lock:
+            self._started = True
+        self._apply_pending_config()
+
+    def rebalance_rooms(self, rooms: Iterable[str]) -> None:
+        target = set(rooms)
+        with self._rooms_lock:
+            for room_id in sorted(self._rooms - target):
+                self._hand_off_room(room_id)
+            taken = sorted(target - self._rooms)
+            for room_id in taken:
+                self._take_over_room(room_id)
+            waiting = [
+                (room_id, self._awaiting_handoff[room_id]) for room_id in taken if room_id in self._awaiting_handoff
+            ]
+        if waiting:
+            timer = threading.Timer(self._partition_config.handoff_wait_s, self._expire_handoffs, args=(waiting,))
+            timer.daemon = True
+            timer.start()
+
+    def _assignment_epoch(self) -> str | None:
+        return None if self._shard_watcher is None else self._shard_watcher.epoch
+
+    def _handoff_topic(self, room_id: str) -> str:
+        return self._partition_config.handoff_topic_template.format(
+            service_name=self.service_name, room_id=room_id
+        )
+
+    def _hand_off_room(self, room_id: str) -> None:
+        if self._awaiting_handoff.pop(room_id, None) is None:
+            self.unsubscribe_room(room_id)
+        self._rooms.discard(room_id)
+        if self._checkpointer is not None:
+            self._checkpointer.mark_deleted(room_id)
+        if not self._partition_config.enabled:
+            self.drop_room_state(room_id)
+            return
+        handoff_topic = self._handoff_topic(room_id)
+        self.mqtt.unsubscribe([handoff_topic])
+        state = self.export_room_state(room_id)
+        self.drop_room_state(room_id)
+        # Retained, so the new owner receives it whenever it subscribes. Sent without
+        # state too, so the new owner does not wait out handoff_wait_s. The epoch
+        # tells the new owner which assignment this handoff belongs to.
+        self.mqtt.publish_json(
+            handoff_topic,
+            {"room_id": room_id, "ts": int(time.time()), "epoch": self._assignment_epoch(), "state": state},
+            qos=1,
+            retain=True,
+        )
+        self._logger.info("Handed off room %s", room_id)
+
+    def _take_over_room(self, room_id: str) -> None:
+        self._rooms.add(room_id)
+        if not self._partition_config.enabled:
+            self.subscribe_room(room_id)
+            return
+        # The room's input is only subscribed once its handed-off state is in (or
+        # handoff_wait_s has passed), so no message is processed on empty state
+        # and later overwritten by the import.
+        handoff_topic = self._handoff_topic(room_id)
+
+        def on_handoff(topic: str, payload: dict) -> None:
+            with self._rooms_lock:
+                if self._awaiting_handoff.get(room_id) is not on_handoff:
+                    return
+                if payload.get("epoch") != self._assignment_epoch():
+                    # Left over from an earlier move of the room; wait for this one's.
+                    self._logger.info("Ignoring handoff of room %s from another assignment", room_id)
+                    return
+                self.mqtt.clear_retained(handoff_topic)
+                if isinstance(payload.get("state"), dict):
+                    self.import_room_state(room_id, payload["state"])
+                    self._logger.info("Restored handed-off state for room %s", room_id)
+                self._finish_take_over(room_id)
+
+        self._awaiting_handoff[room_id] = on_handoff
+        self.mqtt.subscribe([(handoff_topic, 1)], on_handoff)
+
+    def _expire_handoffs(self, waiting: list[tuple[str, MessageHandler]]) -> None:
+        with self._rooms_lock:
+            for room_id, handler in waiting:
+                if self._awaiting_handoff.get(room_id) is handler:
+                    self._logger.warning("No handoff for room %s; starting it without one", room_id)
+                    # A stale handoff must not be imported by a later owner of the room.
+                    self.mqtt.clear_retained(self._handoff_topic(room_id))
+                    self._finish_take_over(room_id)
+
+    def _finish_take_over(self, room_id: str) -> None:
+        handler = self._awaiting_handoff.pop(room_id)
+        self.mqtt.unsubscribe([self._handoff_topic(room_id)], handler)
+        self.subscribe_room(room_id)
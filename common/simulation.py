@@ -0,0 +1,136 @@
+"""Vectorized temperature fleet for load generation.
+
+Every device follows a per-room daily-style sine profile plus Gaussian noise.
+Rooms start overheat episodes at random (a Poisson process per room); an
+episode ramps the room towards ``peak_c``, holds it there and ramps back, so
+the processed mean really crosses the alert thresholds and later clears them.
+All devices of the fleet are sampled with one NumPy expression per tick.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+@dataclass
+class OverheatConfig:
+    # Expected episodes per room and hour; 0 disables episodes.
+    episodes_per_hour: float = 0.0
+    peak_c: float = 28.5
+    ramp_s: float = 30.0
+    hold_s: float = 60.0
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any] | None) -> "OverheatConfig":
+        data = data or {}
+        return cls(
+            episodes_per_hour=float(data.get("episodes_per_hour", 0.0)),
+            peak_c=float(data.get("peak_c", 28.5)),
+            ramp_s=float(data.get("ramp_s", 30.0)),
+            hold_s=float(data.get("hold_s", 60.0)),
+        )
+
+    @property
+    def duration_s(self) -> float:
+        return 2 * self.ramp_s + self.hold_s
+
+
+@dataclass
+class SimulationConfig:
+    enabled: bool = False
+    rooms: int = 10
+    devices_per_room: int = 1
+    # Samples per device and second.
+    rate_hz: float = 1.0
+    room_prefix: str = "sim"
+    base_c: float = 24.0
+    amplitude_c: float = 1.0
+    period_s: float = 600.0
+    noise_c: float = 0.2
+    seed: int = 7
+    overheat: OverheatConfig = field(default_factory=OverheatConfig)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any] | None) -> "SimulationConfig":
+        data = data or {}
+        config = cls(
+            enabled=bool(data.get("enabled", False)),
+            rooms=int(data.get("rooms", 10)),
+            devices_per_room=int(data.get("devices_per_room", 1)),
+            rate_hz=float(data.get("rate_hz", 1.0)),
+            room_prefix=str(data.get("room_prefix", "sim")),
+            base_c=float(data.get("base_c", 24.0)),
+            amplitude_c=float(data.get("amplitude_c", 1.0)),
+            period_s=float(data.get("period_s", 600.0)),
+            noise_c=float(data.get("noise_c", 0.2)),
+            seed=int(data.get("seed", 7)),
+            overheat=OverheatConfig.from_dict(data.get("overheat")),
+        )
+        if config.rooms < 1 or config.devices_per_room < 1:
+            raise ValueError("simulation needs at least one room and one device per room")
+        if config.rate_hz <= 0 or config.period_s <= 0:
+            raise ValueError("simulation rate_hz and period_s must be positive")
+        return config
+
+
+class FleetSimulator:
+    """``rooms x devices_per_room`` sensors sampled together on each tick."""
+
+    def __init__(self, config: SimulationConfig) -> None:
+        self.config = config
+        width = len(str(config.rooms))
+        self.room_ids: List[str] = [f"{config.room_prefix}-{index:0{max(width, 4)}d}" for index in range(config.rooms)]
+        self.device_ids: List[str] = [
+            f"{room_id}-dev-{device}" for room_id in self.room_ids for device in range(config.devices_per_room)
+        ]
+        # Device i belongs to room device_rooms[i].
+        self.device_rooms = np.repeat(np.arange(config.rooms), config.devices_per_room)
+        self._rng = np.random.default_rng(config.seed)
+        self._phase = self._rng.uniform(0.0, 2 * np.pi, config.rooms)
+        self._episode_start = np.full(config.rooms, np.nan)
+        self._last_t: float | None = None
+        self.episodes_started = 0
+
+    @property
+    def interval_s(self) -> float:
+        return 1.0 / self.config.rate_hz
+
+    def baseline(self, t: float) -> np.ndarray:
+        cfg = self.config
+        return cfg.base_c + cfg.amplitude_c * np.sin(2 * np.pi * t / cfg.period_s + self._phase)
+
+    def start_episode(self, room_index: int, t: float) -> None:
+        """Force an overheat episode (benchmarks use this to guarantee alerts)."""
+        if np.isnan(self._episode_start[room_index]):
+            self._episode_start[room_index] = t
+            self.episodes_started += 1
+
+    def overheating(self) -> np.ndarray:
+        return ~np.isnan(self._episode_start)
+
+    def sample(self, t: float) -> np.ndarray:
+        """Temperatures of every device at time ``t`` (seconds), rounded to 0.01 °C."""
+        cfg = self.config
+        overheat = cfg.overheat
+        dt = self.interval_s if self._last_t is None else max(t - self._last_t, 0.0)
+        self._last_t = t
+        if overheat.episodes_per_hour > 0:
+            idle = np.isnan(self._episode_start)
+            starting = idle & (self._rng.random(cfg.rooms) < overheat.episodes_per_hour * dt / 3600.0)
+            self._episode_start[starting] = t
+            self.episodes_started += int(starting.sum())
+        elapsed = t - self._episode_start
+        finished = elapsed >= overheat.duration_s
+        self._episode_start[finished] = np.nan
+        elapsed[finished] = np.nan
+        # Trapezoid envelope: 0 -> 1 over ramp_s, hold, 1 -> 0 over ramp_s.
+        ramp = max(overheat.ramp_s, 1e-9)
+        envelope = np.clip(np.minimum(elapsed, overheat.duration_s - elapsed) / ramp, 0.0, 1.0)
+        envelope = np.nan_to_num(envelope, nan=0.0)
+        room_temp = self.baseline(t)
+        room_temp += np.maximum(overheat.peak_c - room_temp, 0.0) * envelope
+        temps = room_temp[self.device_rooms] + self._rng.normal(0.0, cfg.noise_c, len(self.device_rooms))
+        return np.round(temps, 2)
@@ -0,0 +1,217 @@
+"""Crash-safe per-room state checkpoints: a compact snapshot plus an append-only journal.
+
+``<name>.snap`` holds every room's state and is only ever replaced
+atomically (temp file, fsync, rename). Between snapshots, changed rooms are
+appended to ``<name>.journal``; each record carries a CRC so a torn write
+at the tail is detected and ignored. Restoring reads the snapshot through
+``mmap`` and replays only the journal delta on top of it.
+"""
+
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Mapping, Optional, Set
+
+if TYPE_CHECKING:  # pragma: no cover - import cycle only needed for typing
+    from common.service_base import ServiceBase
+
+_SNAPSHOT_MAGIC = b"IOTSNAP1"
+_COUNT = struct.Struct("<I")
+_RECORD = struct.Struct("<HI")  # key length, blob length
+_JOURNAL_RECORD = struct.Struct("<BHII")  # op, key length, blob length, crc32
+_CRC = struct.Struct("<I")
+_OP_PUT = 1
+_OP_DELETE = 2
+
+
+@dataclass
+class SnapshotConfig:
+    enabled: bool = False
+    directory: str = "state"
+    interval_s: float = 5.0
+    # Rewrite the full snapshot (and truncate the journal) every N checkpoints.
+    compact_every: int = 60
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Mapping[str, object]]) -> "SnapshotConfig":
+        return cls(**(payload or {}))
+
+
+class SnapshotStore:
+    def __init__(self, directory: str | Path, name: str) -> None:
+        self._directory = Path(directory)
+        self._snapshot_path = self._directory / f"{name}.snap"
+        self._journal_path = self._directory / f"{name}.journal"
+        self._logger = logging.getLogger(f"{name}.snapshot")
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, bytes]:
+        """Return the latest state per room: the snapshot with the journal replayed on top."""
+        with self._lock:
+            states = self._read_snapshot()
+            self._replay_journal(states)
+        return states
+
+    def append(self, puts: Mapping[str, bytes], deletes: Iterable[str] = ()) -> None:
+        """Durably append changed and removed rooms to the journal."""
+        chunks = []
+        for key, blob in puts.items():
+            chunks.append(self._journal_record(_OP_PUT, key, blob))
+        for key in deletes:
+            chunks.append(self._journal_record(_OP_DELETE, key, b""))
+        if not chunks:
+            return
+        with self._lock:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            with open(self._journal_path, "ab") as handle:
+                handle.write(b"".join(chunks))
+                handle.flush()
+                os.fsync(handle.fileno())
+
+    def write_snapshot(self, states: Mapping[str, bytes]) -> None:
+        """Atomically replace the snapshot with ``states`` and reset the journal."""
+        body = bytearray(_COUNT.pack(len(states)))
+        for key, blob in states.items():
+            encoded = key.encode("utf-8")
+            body += _RECORD.pack(len(encoded), len(blob))
+            body += encoded
+            body += blob
+        with self._lock:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._snapshot_path.with_suffix(".snap.tmp")
+            with open(tmp_path, "wb") as handle:
+                handle.write(_SNAPSHOT_MAGIC)
+                handle.write(body)
+                handle.write(_CRC.pack(zlib.crc32(body)))
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(tmp_path, self._snapshot_path)
+            _fsync_directory(self._directory)
+            # Everything in the journal is now covered by the snapshot.
+            with open(self._journal_path, "wb") as handle:
+                os.fsync(handle.fileno())
+
+    def _read_snapshot(self) -> Dict[str, bytes]:
+        states: Dict[str, bytes] = {}
+        if not self._snapshot_path.exists() or self._snapshot_path.stat().st_size == 0:
+            return states
+        with open(self._snapshot_path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header = len(_SNAPSHOT_MAGIC)
+            end = len(data) - _CRC.size
+            if data[:header] != _SNAPSHOT_MAGIC or end < header + _COUNT.size:
+                self._logger.warning("Ignoring unreadable snapshot %s", self._snapshot_path)
+                return states
+            view = memoryview(data)
+            try:
+                (expected_crc,) = _CRC.unpack_from(data, end)
+                if zlib.crc32(view[header:end]) != expected_crc:
+                    self._logger.warning("Ignoring corrupt snapshot %s", self._snapshot_path)
+                    return states
+                (count,) = _COUNT.unpack_from(data, header)
+                offset = header + _COUNT.size
+                unpack = _RECORD.unpack_from
+                record_size = _RECORD.size
+                for _ in range(count):
+                    key_len, blob_len = unpack(data, offset)
+                    offset += record_size
+                    key = str(view[offset : offset + key_len], "utf-8")
+                    offset += key_len
+                    states[key] = data[offset : offset + blob_len]
+                    offset += blob_len
+            finally:
+                view.release()
+        return states
+
+    def _replay_journal(self, states: Dict[str, bytes]) -> None:
+        if not self._journal_path.exists():
+            return
+        data = self._journal_path.read_bytes()
+        offset = 0
+        while offset + _JOURNAL_RECORD.size <= len(data):
+            op, key_len, blob_len, crc = _JOURNAL_RECORD.unpack_from(data, offset)
+            start = offset + _JOURNAL_RECORD.size
+            end = start + key_len + blob_len
+            if end > len(data) or zlib.crc32(data[start:end]) != crc:
+                self._logger.warning("Journal %s truncated at byte %s; ignoring the tail", self._journal_path, offset)
+                return
+            key = data[start : start + key_len].decode("utf-8")
+            if op == _OP_PUT:
+                states[key] = data[start + key_len : end]
+            else:
+                states.pop(key, None)
+            offset = end
+
+    @staticmethod
+    def _journal_record(op: int, key: str, blob: bytes) -> bytes:
+        encoded = key.encode("utf-8")
+        payload = encoded + blob
+        return _JOURNAL_RECORD.pack(op, len(encoded), len(blob), zlib.crc32(payload)) + payload
+
+
+class StateCheckpointer:
+    """Periodically journals rooms a service marked dirty and compacts into snapshots."""
+
+    def __init__(self, service: "ServiceBase", config: SnapshotConfig, name: str) -> None:
+        self._service = service
+        self._config = config
+        self.store = SnapshotStore(config.directory, name)
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._checkpoints = 0
+        self._stop = threading.Event()
+        self._logger = logging.getLogger(f"{service.service_name}.snapshot")
+
+    def mark_dirty(self, room_id: str) -> None:
+        self._dirty.add(room_id)
+
+    def mark_deleted(self, room_id: str) -> None:
+        self._dirty.discard(room_id)
+        self._deleted.add(room_id)
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="state-checkpoint", daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the timer and write a final full snapshot (once)."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.checkpoint(full=True)
+
+    def checkpoint(self, full: bool = False) -> None:
+        # Swap the sets first; rooms dirtied meanwhile land in the next checkpoint.
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted, set()
+        self._checkpoints += 1
+        if full or self._checkpoints % max(self._config.compact_every, 1) == 0:
+            self.store.write_snapshot(self._service.export_rooms_state(self._service.rooms))
+        elif dirty or deleted:
+            self.store.append(self._service.export_rooms_state(sorted(dirty)), deleted)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._config.interval_s):
+            try:
+                self.checkpoint()
+            except OSError as exc:  # pragma: no cover - disk problems must not stop the service
+                self._logger.warning("State checkpoint failed: %s", exc)
+
+
+def _fsync_directory(directory: Path) -> None:
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:  # pragma: no cover - not supported on every platform
+        return
+    try:
+        os.fsync(fd)
+    except OSError:  # pragma: no cover
+        pass
+    finally:
+        os.close(fd)
+
@@ -0,0 +1,132 @@
+"""Topic-trie router that maps MQTT topic filters to handlers.
+
+Filters are stored level by level, so matching a topic costs time
+proportional to its depth rather than to the number of subscriptions.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Generic, List, Mapping, Optional, Set, TypeVar
+
+H = TypeVar("H")
+
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+
+
+def validate_filter(topic_filter: str) -> None:
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if MULTI_LEVEL in level and (level != MULTI_LEVEL or index != len(levels) - 1):
+            raise ValueError(f"Invalid topic filter: {topic_filter}")
+        if SINGLE_LEVEL in level and level != SINGLE_LEVEL:
+            raise ValueError(f"Invalid topic filter: {topic_filter}")
+
+
+class _Node(Generic[H]):
+    __slots__ = ("children", "handlers")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _Node[H]] = {}
+        self.handlers: List[H] = []
+
+
+class TopicRouter(Generic[H]):
+    def __init__(self) -> None:
+        self._root: _Node[H] = _Node()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, topic_filter: str, handler: H) -> None:
+        validate_filter(topic_filter)
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.handlers.append(handler)
+        self._size += 1
+
+    def remove(self, topic_filter: str, predicate: Optional[Callable[[H], bool]] = None) -> int:
+        """Remove handlers for a filter that match ``predicate`` (all when omitted).
+
+        Returns how many handlers were removed.
+        """
+        path: List[tuple[_Node[H], str]] = []
+        node = self._root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                return 0
+            path.append((node, level))
+            node = child
+        before = len(node.handlers)
+        if predicate is None:
+            node.handlers.clear()
+        else:
+            node.handlers = [item for item in node.handlers if not predicate(item)]
+        removed = before - len(node.handlers)
+        self._size -= removed
+        # Prune empty branches so stale rooms do not linger in the trie.
+        for parent, level in reversed(path):
+            child = parent.children[level]
+            if child.handlers or child.children:
+                break
+            del parent.children[level]
+        return removed
+
+    def has_filter(self, topic_filter: str) -> bool:
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.get(level)
+            if node is None:
+                return False
+        return bool(node.handlers)
+
+    def match(self, topic: str) -> List[H]:
+        levels = topic.split("/")
+        matched: List[H] = []
+        # Per the MQTT spec, wildcards in the first level never match "$" topics.
+        self._collect(self._root, levels, 0, matched, not topic.startswith("$"))
+        return matched
+
+    def _collect(self, node: _Node[H], levels: List[str], index: int, out: List[H], wildcards: bool) -> None:
+        children = node.children
+        if wildcards:
+            multi = children.get(MULTI_LEVEL)
+            if multi is not None:
+                out.extend(multi.handlers)
+        if index == len(levels):
+            out.extend(node.handlers)
+            return
+        exact = children.get(levels[index])
+        if exact is not None:
+            self._collect(exact, levels, index + 1, out, True)
+        if wildcards:
+            single = children.get(SINGLE_LEVEL)
+            if single is not None:
+                self._collect(single, levels, index + 1, out, True)
+
+
+def topic_templates_of(config: Mapping[str, Any]) -> Set[str]:
+    """Topic templates of a service config, including lists, maps and nested sections."""
+    templates: Set[str] = set()
+    for key, value in config.items():
+        if isinstance(value, Mapping):
+            if key.endswith("topic_templates"):
+                templates.update(template for template in value.values() if isinstance(template, str))
+            else:
+                templates |= topic_templates_of(value)
+        elif key.endswith("topic_template") and isinstance(value, str):
+            templates.add(value)
+        elif key.endswith("topic_templates") and isinstance(value, list):
+            templates.update(template for template in value if isinstance(template, str))
+    return templates
+
+
+def template_to_filter(template: str) -> str:
+    """Turn a catalog topic template such as ``iot/{room_id}/alerts`` into ``iot/+/alerts``."""
+    return "/".join(
+        SINGLE_LEVEL if level.startswith("{") and level.endswith("}") else level
+        for level in template.split("/")
+    )
@@ -0,0 +1,156 @@
+"""Trace context carried in payloads from the sensor to the actuators.
+
+A traced payload has a ``trace`` key::
+
+    {"id": "5f0c9a3e1b2d4c6a", "origin_ns": 1700000000123456789,
+     "hops": [["rpi_temperature_publisher", 1700000000123456789],
+              ["postprocess_time_shift", 1700000000124012345], ...]}
+
+The publisher starts a trace for a sampled fraction of its readings and every
+stage that republishes derived data appends itself with ``add_hop``. Payload
+``ts`` fields keep their existing meaning; the trace holds the nanosecond
+times. Hops are wall-clock (``time.time_ns()``), so latencies across hosts
+are only as good as their clock sync.
+
+``TraceCollector`` turns observed traces into per-hop and end-to-end latency
+distributions.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Set
+
+import numpy as np
+
+TRACE_KEY = "trace"
+
+
+@dataclass
+class TraceConfig:
+    enabled: bool = False
+    # Fraction of readings that start a trace.
+    sample_rate: float = 1.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Mapping[str, Any]]) -> "TraceConfig":
+        config = cls(**(payload or {}))
+        if not 0.0 <= config.sample_rate <= 1.0:
+            raise ValueError("Trace sample_rate must be between 0 and 1")
+        return config
+
+    def sample(self) -> bool:
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+
+def start_trace(stage: str, origin_ns: int | None = None) -> Dict[str, Any]:
+    origin_ns = time.time_ns() if origin_ns is None else origin_ns
+    return {"id": os.urandom(8).hex(), "origin_ns": origin_ns, "hops": [[stage, origin_ns]]}
+
+
+def add_hop(trace: Mapping[str, Any], stage: str) -> Dict[str, Any]:
+    """A copy of ``trace`` with ``stage`` appended (payloads may be shared in-process)."""
+    return {"id": trace["id"], "origin_ns": trace["origin_ns"], "hops": [*trace["hops"], [stage, time.time_ns()]]}
+
+
+def carry_trace(payload: Mapping[str, Any], stage: str) -> Optional[Dict[str, Any]]:
+    """The next hop of the payload's trace, or None when it is not traced."""
+    trace = payload.get(TRACE_KEY)
+    return add_hop(trace, stage) if isinstance(trace, dict) else None
+
+
+class _Series:
+    """Latest ``capacity`` latencies in a preallocated ring."""
+
+    __slots__ = ("values", "count")
+
+    def __init__(self, capacity: int) -> None:
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.count = 0
+
+    def add(self, value_ms: float) -> None:
+        self.values[self.count % len(self.values)] = value_ms
+        self.count += 1
+
+    def summary(self) -> Dict[str, Any]:
+        window = self.values[: min(self.count, len(self.values))]
+        if not len(window):
+            return {"count": 0}
+        p50, p90, p99 = np.percentile(window, (50, 90, 99))
+        return {
+            "count": self.count,
+            "p50_ms": round(float(p50), 3),
+            "p90_ms": round(float(p90), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(window.max()), 3),
+        }
+
+
+class TraceCollector:
+    """Per-hop and end-to-end latency distributions from observed traces.
+
+    ``observe(label, trace)`` records the time from the trace origin to now
+    under ``label`` (normally the topic kind the payload arrived on) and the
+    time between consecutive hops under ``"a -> b"``. Each series keeps its
+    latest ``capacity`` values.
+    """
+
+    def __init__(self, capacity: int = 10000) -> None:
+        self._capacity = capacity
+        self._end_to_end: Dict[str, _Series] = {}
+        self._hops: Dict[str, _Series] = {}
+        # Hops already recorded per trace id: the same hop arrives on several topics.
+        self._seen: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.observed = 0
+        self.invalid = 0
+
+    def observe(self, label: str, trace: Any, now_ns: int | None = None) -> bool:
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        try:
+            origin_ns = int(trace["origin_ns"])
+            hops = [(str(stage), int(ts)) for stage, ts in trace["hops"]]
+            trace_id = str(trace["id"])
+        except (KeyError, TypeError, ValueError):
+            self.invalid += 1
+            return False
+        with self._lock:
+            self.observed += 1
+            self._series(self._end_to_end, label).add((now_ns - origin_ns) / 1e6)
+            seen = self._seen.get(trace_id)
+            if seen is None:
+                seen = self._seen[trace_id] = set()
+                if len(self._seen) > self._capacity:
+                    # Forget the oldest traces; at worst a late hop of theirs is counted twice.
+                    for stale in list(self._seen)[: len(self._seen) // 2]:
+                        del self._seen[stale]
+            for (stage, ts), (next_stage, next_ts) in zip(hops, hops[1:]):
+                hop = f"{stage} -> {next_stage}"
+                if hop not in seen:
+                    seen.add(hop)
+                    self._series(self._hops, hop).add((next_ts - ts) / 1e6)
+        return True
+
+    def count(self, label: str) -> int:
+        series = self._end_to_end.get(label)
+        return 0 if series is None else series.count
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "traces": self.observed,
+                "invalid": self.invalid,
+                "end_to_end": {label: series.summary() for label, series in sorted(self._end_to_end.items())},
+                "hops": {label: series.summary() for label, series in sorted(self._hops.items())},
+            }
+
+    def _series(self, table: Dict[str, _Series], label: str) -> _Series:
+        series = table.get(label)
+        if series is None:
+            series = table[label] = _Series(self._capacity)
+        return series
+
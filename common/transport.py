@@ -0,0 +1,571 @@
+"""Connections behind ``MqttServiceClient``.
+
+``PahoTransport`` talks to a real broker. ``LoopbackTransport`` connects to a
+``LoopbackBroker`` in the same process: topic matching with ``+``/``#``,
+retained messages, last-will and QoS delivery rules behave like a broker,
+but payload objects are handed to receivers as published, without encoding
+or decoding. The catalog's ``mqtt.transport`` selects one per process, so
+services run on either without changes. ``AsyncioPahoTransport`` is the
+paho connection driven by a running asyncio loop instead of a network thread
+(``AsyncMqttServiceClient`` uses it).
+
+Loopback receivers share the published object; handlers must treat payloads
+as read-only (services already build a fresh dict for every publish).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import paho.mqtt.client as mqtt
+
+from common.topics import TopicRouter
+
+TRANSPORT_PAHO = "paho"
+TRANSPORT_LOOPBACK = "loopback"
+TRANSPORTS = (TRANSPORT_PAHO, TRANSPORT_LOOPBACK)
+
+Will = Tuple[str, Any, int, bool]
+
+
+class Transport:
+    """One client connection; callbacks run on the transport's network thread.
+
+    ``on_connect(rc)`` receives the CONNACK code (0 is success),
+    ``on_message(topic, payload)`` each delivered message and
+    ``on_publish(mid)`` the id ``publish`` returned once that message was
+    sent (QoS 0) or acknowledged (QoS 1/2).
+    """
+
+    # True when payloads travel as Python objects instead of bytes.
+    carries_objects = False
+    # True when callbacks run on the asyncio loop that connected the transport.
+    runs_on_loop = False
+
+    def __init__(self, client_id: str) -> None:
+        self.client_id = client_id
+        self.on_connect: Callable[[int], None] = lambda rc: None
+        self.on_message: Callable[[str, Any], None] = lambda topic, payload: None
+        self.on_publish: Callable[[int], None] = lambda mid: None
+
+    def set_will(self, topic: str, payload: Any, qos: int, retain: bool) -> None:
+        raise NotImplementedError
+
+    def connect(self, host: str, port: int, keepalive: int) -> None:
+        raise NotImplementedError
+
+    def disconnect(self) -> None:
+        raise NotImplementedError
+
+    def loop_start(self) -> None:
+        raise NotImplementedError
+
+    def loop_stop(self) -> None:
+        raise NotImplementedError
+
+    def loop_forever(self) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, topics: List[Tuple[str, int]]) -> None:
+        raise NotImplementedError
+
+    def unsubscribe(self, topic_filter: str) -> None:
+        raise NotImplementedError
+
+    def publish(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> Optional[int]:
+        """Send a message; returns the id ``on_publish`` will report, or None when there is nothing to wait for."""
+        raise NotImplementedError
+
+    def queue_depth(self) -> int:
+        """Messages received but not yet handed to ``on_message``."""
+        return 0
+
+
+def create_transport(name: str, client_id: str) -> Transport:
+    if name == TRANSPORT_PAHO:
+        return PahoTransport(client_id)
+    if name == TRANSPORT_LOOPBACK:
+        return LoopbackTransport(client_id)
+    raise ValueError(f"Unknown MQTT transport: {name} (expected one of {TRANSPORTS})")
+
+
+class PahoTransport(Transport):
+    def __init__(self, client_id: str) -> None:
+        super().__init__(client_id)
+        self._logger = logging.getLogger(client_id)
+        self._client = mqtt.Client(client_id=client_id)
+        self._client.on_connect = self._handle_connect
+        self._client.on_disconnect = self._handle_disconnect
+        self._client.on_message = self._handle_message
+        self._client.on_publish = self._handle_publish
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._background_loop: Optional[threading.Event] = None
+
+    def set_will(self, topic: str, payload: Any, qos: int, retain: bool) -> None:
+        self._client.will_set(topic, payload=payload, qos=qos, retain=retain)
+
+    def connect(self, host: str, port: int, keepalive: int) -> None:
+        self._client.connect(host, port, keepalive)
+
+    def disconnect(self) -> None:
+        self._client.disconnect()
+
+    def loop_forever(self) -> None:
+        """Block serving the network loop.
+
+        Services start the background loop early (to publish while setting
+        up) and end ``start()`` here; a second reader on the same socket would
+        interleave packets, so in that case this only waits for ``loop_stop``.
+        """
+        if self._background_loop is not None:
+            self._background_loop.wait()
+            return
+        self._client.loop_forever()
+
+    def loop_start(self) -> None:
+        self._background_loop = threading.Event()
+        self._client.loop_start()
+
+    def loop_stop(self) -> None:
+        self._client.loop_stop()
+        if self._background_loop is not None:
+            self._background_loop.set()
+            self._background_loop = None
+
+    def subscribe(self, topics: List[Tuple[str, int]]) -> None:
+        self._client.subscribe(topics)
+
+    def unsubscribe(self, topic_filter: str) -> None:
+        self._client.unsubscribe(topic_filter)
+
+    def publish(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> Optional[int]:
+        info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        # Without a connection QoS 0 messages are discarded; QoS 1/2 ones are sent on reconnect.
+        return info.mid if info.rc == mqtt.MQTT_ERR_SUCCESS or qos > 0 else None
+
+    def _handle_connect(self, client: mqtt.Client, userdata: object, flags: dict, rc: int) -> None:
+        self.on_connect(rc)
+
+    def _handle_message(self, client: mqtt.Client, userdata: object, msg: mqtt.MQTTMessage) -> None:
+        self.on_message(msg.topic, msg.payload)
+
+    def _handle_publish(self, client: mqtt.Client, userdata: object, mid: int) -> None:
+        self.on_publish(mid)
+
+    def _handle_disconnect(self, client: mqtt.Client, userdata: object, rc: int) -> None:
+        if rc == 0:
+            self._logger.info("Disconnected from MQTT broker: %s", rc)
+            return
+        self._logger.warning("Unexpected MQTT disconnect (rc=%s); attempting reconnect", rc)
+        try:
+            client.reconnect()
+        except Exception as exc:  # pragma: no cover - best-effort reconnect
+            self._logger.warning("MQTT reconnect attempt failed: %s", exc)
+
+
+class AsyncioPahoTransport(PahoTransport):
+    """Paho driven by the running asyncio loop instead of a network thread.
+
+    Socket readiness callbacks (``add_reader``/``add_writer``) read and write
+    packets, and a task runs paho's housekeeping (keepalive pings, timeouts)
+    every second, so every callback runs on the loop thread. ``connect`` must
+    be called from the loop; it blocks for the TCP connect only. Calls from
+    other threads (metrics reporters, watchers) are handed to the loop.
+    """
+
+    runs_on_loop = True
+
+    def __init__(self, client_id: str, reconnect_max_delay_s: float = 30.0) -> None:
+        super().__init__(client_id)
+        self._client.on_socket_open = self._socket_open
+        self._client.on_socket_close = self._socket_close
+        self._client.on_socket_register_write = self._socket_register_write
+        self._client.on_socket_unregister_write = self._socket_unregister_write
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._misc_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._reconnect_delay_s = 1.0
+        self._reconnect_max_delay_s = reconnect_max_delay_s
+
+    def connect(self, host: str, port: int, keepalive: int) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._closing = False
+        self._client.connect(host, port, keepalive)
+
+    def disconnect(self) -> None:
+        self._closing = True
+        self._on_loop(self._client.disconnect)
+
+    def loop_start(self) -> None:
+        return None
+
+    def loop_stop(self) -> None:
+        return None
+
+    def loop_forever(self) -> None:
+        raise RuntimeError("AsyncioPahoTransport runs on the asyncio loop; there is no loop to block on")
+
+    def subscribe(self, topics: List[Tuple[str, int]]) -> None:
+        self._on_loop(self._client.subscribe, topics)
+
+    def unsubscribe(self, topic_filter: str) -> None:
+        self._on_loop(self._client.unsubscribe, topic_filter)
+
+    def publish(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> Optional[int]:
+        if self._on_loop_thread():
+            return super().publish(topic, payload, qos, retain)
+        # Fire and forget from other threads: the mid is only known on the loop.
+        self._loop.call_soon_threadsafe(super().publish, topic, payload, qos, retain)
+        return None
+
+    def _on_loop_thread(self) -> bool:
+        return self._loop is None or threading.get_ident() == self._loop_thread
+
+    def _on_loop(self, func: Callable[..., Any], *args: Any) -> None:
+        if self._on_loop_thread():
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _socket_open(self, client: mqtt.Client, userdata: object, sock: Any) -> None:
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _socket_close(self, client: mqtt.Client, userdata: object, sock: Any) -> None:
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _socket_register_write(self, client: mqtt.Client, userdata: object, sock: Any) -> None:
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _socket_unregister_write(self, client: mqtt.Client, userdata: object, sock: Any) -> None:
+        self._loop.remove_writer(sock)
+
+    async def _misc_loop(self) -> None:
+        while self._client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1.0)
+
+    def _handle_connect(self, client: mqtt.Client, userdata: object, flags: dict, rc: int) -> None:
+        if rc == 0:
+            self._reconnect_delay_s = 1.0
+        super()._handle_connect(client, userdata, flags, rc)
+
+    def _handle_disconnect(self, client: mqtt.Client, userdata: object, rc: int) -> None:
+        if rc == 0 or self._closing:
+            self._logger.info("Disconnected from MQTT broker: %s", rc)
+            return
+        self._logger.warning("Unexpected MQTT disconnect (rc=%s); reconnecting in %.0fs", rc, self._reconnect_delay_s)
+        self._loop.call_later(self._reconnect_delay_s, self._reconnect)
+
+    def _reconnect(self) -> None:
+        if self._closing:
+            return
+        try:
+            self._client.reconnect()
+        except OSError as exc:
+            self._reconnect_delay_s = min(self._reconnect_delay_s * 2, self._reconnect_max_delay_s)
+            self._logger.warning("MQTT reconnect failed (%s); retrying in %.0fs", exc, self._reconnect_delay_s)
+            self._loop.call_later(self._reconnect_delay_s, self._reconnect)
+
+
+class LoopbackUpstream:
+    """Connects a ``LoopbackBroker`` to an outside broker (see ``common/bridge.py``).
+
+    The broker reports the union of its clients' filters and every message
+    its clients publish; messages from outside come back in through
+    ``LoopbackBroker.publish(..., from_upstream=True)``.
+    """
+
+    def filter_added(self, topic_filter: str, qos: int) -> None:
+        pass
+
+    def filter_removed(self, topic_filter: str) -> None:
+        pass
+
+    def forward(self, topic: str, payload: Any, qos: int, retain: bool) -> None:
+        pass
+
+
+class _LoopbackSubscription:
+    __slots__ = ("transport", "qos")
+
+    def __init__(self, transport: "LoopbackTransport", qos: int) -> None:
+        self.transport = transport
+        self.qos = qos
+
+
+class LoopbackBroker:
+    """In-process broker shared by the ``LoopbackTransport`` clients of a process.
+
+    By default every client gets a bounded inbound queue drained by its own
+    thread, like a network loop: a QoS 0 message is dropped when the queue is
+    full and QoS 1/2 publishers wait for room. ``synchronous=True`` instead
+    runs receivers inline in the publishing thread, which makes a pipeline
+    fully deterministic and measures only the handlers' own cost.
+    """
+
+    _default: Optional["LoopbackBroker"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, queue_size: int = 10000, synchronous: bool = False) -> None:
+        if queue_size < 1:
+            raise ValueError("queue_size must be positive")
+        self.queue_size = queue_size
+        self.synchronous = synchronous
+        self.messages_in = 0
+        self.messages_out = 0
+        self.dropped = 0
+        self._lock = threading.RLock()
+        self._router: TopicRouter[_LoopbackSubscription] = TopicRouter()
+        self._retained: Dict[str, Tuple[Any, int]] = {}
+        self._clients: Dict[str, LoopbackTransport] = {}
+        self._filters: Dict[int, Set[str]] = {}
+        self.upstream: Optional[LoopbackUpstream] = None
+
+    @classmethod
+    def default(cls) -> "LoopbackBroker":
+        """The process-wide broker that transports created from config attach to."""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @classmethod
+    def set_default(cls, broker: Optional["LoopbackBroker"]) -> None:
+        with cls._default_lock:
+            cls._default = broker
+
+    @property
+    def subscriptions(self) -> int:
+        return len(self._router)
+
+    def attach(self, transport: "LoopbackTransport") -> None:
+        with self._lock:
+            previous = self._clients.get(transport.client_id)
+            self._clients[transport.client_id] = transport
+        if previous is not None and previous is not transport:
+            # Same client id: the new connection takes over, as on a real broker.
+            self._drop(previous)
+
+    def detach(self, transport: "LoopbackTransport") -> None:
+        """Clean disconnect: subscriptions go, the will is discarded."""
+        with self._lock:
+            filters = self._filters.pop(id(transport), set())
+            for topic_filter in filters:
+                self._router.remove(topic_filter, lambda item: item.transport is transport)
+            if self._clients.get(transport.client_id) is transport:
+                del self._clients[transport.client_id]
+            released = [topic_filter for topic_filter in filters if not self._router.has_filter(topic_filter)]
+        self._release_filters(released)
+
+    def drop_client(self, client_id: str) -> bool:
+        """Simulate a lost connection: the client is detached and its will published."""
+        with self._lock:
+            transport = self._clients.get(client_id)
+        if transport is None:
+            return False
+        self._drop(transport)
+        return True
+
+    def _drop(self, transport: "LoopbackTransport") -> None:
+        self.detach(transport)
+        will = transport.disconnected()
+        if will is not None:
+            self.publish(*will)
+
+    def subscribe(self, transport: "LoopbackTransport", topics: List[Tuple[str, int]]) -> None:
+        retained: List[Tuple[str, Any, int]] = []
+        with self._lock:
+            for topic_filter, qos in topics:
+                self._router.remove(topic_filter, lambda item: item.transport is transport)
+                self._router.add(topic_filter, _LoopbackSubscription(transport, qos))
+                self._filters.setdefault(id(transport), set()).add(topic_filter)
+                matcher: TopicRouter[bool] = TopicRouter()
+                matcher.add(topic_filter, True)
+                for topic, (payload, retained_qos) in self._retained.items():
+                    if matcher.match(topic):
+                        retained.append((topic, payload, min(qos, retained_qos)))
+        upstream = self.upstream
+        if upstream is not None:
+            for topic_filter, qos in topics:
+                upstream.filter_added(topic_filter, qos)
+        for topic, payload, qos in retained:
+            transport.deliver(topic, payload, qos)
+
+    def unsubscribe(self, transport: "LoopbackTransport", topic_filter: str) -> None:
+        with self._lock:
+            self._router.remove(topic_filter, lambda item: item.transport is transport)
+            self._filters.get(id(transport), set()).discard(topic_filter)
+            released = [] if self._router.has_filter(topic_filter) else [topic_filter]
+        self._release_filters(released)
+
+    def _release_filters(self, filters: Iterable[str]) -> None:
+        """Tell the upstream about filters no local client subscribes to any more."""
+        upstream = self.upstream
+        if upstream is not None:
+            for topic_filter in filters:
+                upstream.filter_removed(topic_filter)
+
+    def publish(
+        self, topic: str, payload: Any, qos: int = 0, retain: bool = False, from_upstream: bool = False
+    ) -> None:
+        targets: Dict[int, Tuple[LoopbackTransport, int]] = {}
+        with self._lock:
+            self.messages_in += 1
+            if retain:
+                if payload is None or payload == b"":
+                    self._retained.pop(topic, None)
+                else:
+                    self._retained[topic] = (payload, qos)
+            for subscription in self._router.match(topic):
+                # Overlapping filters of one client deliver once, at the highest QoS.
+                key = id(subscription.transport)
+                granted = min(qos, subscription.qos)
+                if key not in targets or targets[key][1] < granted:
+                    targets[key] = (subscription.transport, granted)
+        upstream = self.upstream
+        if upstream is not None and not from_upstream:
+            upstream.forward(topic, payload, qos, retain)
+        for transport, granted in targets.values():
+            if transport.deliver(topic, payload, granted):
+                self.messages_out += 1
+            else:
+                self.dropped += 1
+
+    def wait_idle(self, timeout_s: float = 10.0) -> bool:
+        """Wait until every queued message has been handled (asynchronous mode)."""
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            published = self.messages_in
+            with self._lock:
+                clients = list(self._clients.values())
+            # A quiet pass is only trusted if nothing was published during it.
+            if all(client.idle() for client in clients) and published == self.messages_in:
+                return True
+            time.sleep(0.001)
+        return False
+
+
+class LoopbackTransport(Transport):
+    carries_objects = True
+
+    def __init__(self, client_id: str, broker: Optional[LoopbackBroker] = None) -> None:
+        super().__init__(client_id)
+        self._broker = broker or LoopbackBroker.default()
+        self._will: Optional[Will] = None
+        self._connected = False
+        self._queue: Deque[Tuple[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def set_will(self, topic: str, payload: Any, qos: int, retain: bool) -> None:
+        self._will = (topic, payload, qos, retain)
+
+    def connect(self, host: str, port: int, keepalive: int) -> None:
+        # Host and port are ignored: the broker lives in this process.
+        self._broker.attach(self)
+        self._connected = True
+        self.on_connect(0)
+
+    def disconnect(self) -> None:
+        if self._connected:
+            self._connected = False
+            self._broker.detach(self)
+
+    def disconnected(self) -> Optional[Will]:
+        """Called by the broker when the connection is lost; returns the will to publish."""
+        self._connected = False
+        return self._will
+
+    def loop_start(self) -> None:
+        if self._broker.synchronous or self._running:
+            return
+        self._running = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.client_id}-loopback", daemon=True)
+        self._thread.start()
+
+    def loop_stop(self) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self._stopped.set()
+
+    def loop_forever(self) -> None:
+        if self._running or self._broker.synchronous:
+            self._stopped.wait()
+            return
+        self._running = True
+        self._stopped.clear()
+        self._run()
+
+    def subscribe(self, topics: List[Tuple[str, int]]) -> None:
+        self._broker.subscribe(self, topics)
+
+    def unsubscribe(self, topic_filter: str) -> None:
+        self._broker.unsubscribe(self, topic_filter)
+
+    def publish(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> Optional[int]:
+        # The broker has taken the message once this returns: nothing to acknowledge later.
+        self._broker.publish(topic, payload, qos, retain)
+        return None
+
+    def deliver(self, topic: str, payload: Any, qos: int) -> bool:
+        """Hand one message to this client; False when a QoS 0 message was dropped."""
+        if self._broker.synchronous:
+            self.on_message(topic, payload)
+            return True
+        with self._cond:
+            if len(self._queue) >= self._broker.queue_size:
+                if qos == 0:
+                    return False
+                # Never block the delivery thread on its own queue.
+                while (
+                    len(self._queue) >= self._broker.queue_size
+                    and self._running
+                    and self._thread is not threading.current_thread()
+                ):
+                    self._cond.wait()
+            self._queue.append((topic, payload))
+            self._cond.notify_all()
+        return True
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def idle(self) -> bool:
+        with self._cond:
+            return not self._queue and not self._busy
+
+    def _run(self) -> None:
+        queue = self._queue
+        while True:
+            with self._cond:
+                while not queue and self._running:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                topic, payload = queue.popleft()
+                self._busy = True
+                self._cond.notify_all()
+            try:
+                self.on_message(topic, payload)
+            finally:
+                with self._cond:
+                    self._busy = False
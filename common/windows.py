@@ -0,0 +1,171 @@
+"""Event-time tumbling/hopping windows keyed on the payload timestamp.
+
+Each room tracks its own watermark (the highest event time seen minus the
+allowed lateness). A window is emitted exactly once, when the watermark
+passes its end; samples that only belong to already-emitted windows are
+counted as late and dropped. Tumbling windows are hopping windows whose hop
+equals their length.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from common.aggregates import Moments
+
+
+@dataclass(slots=True)
+class ClosedWindow:
+    room_id: str
+    bn: str
+    start: int
+    end: int
+    count: int
+    mean: float
+    min: float
+    max: float
+    variance: float
+
+    def value(self, name: str) -> float:
+        if name == "stddev":
+            return math.sqrt(self.variance)
+        if name not in ("mean", "min", "max", "variance", "count"):
+            raise ValueError(f"Aggregate not available for event-time windows: {name}")
+        return getattr(self, name)
+
+
+class _OpenWindow:
+    __slots__ = ("moments", "min", "max", "bn")
+
+    def __init__(self, bn: str) -> None:
+        self.moments = Moments()
+        self.min = math.inf
+        self.max = -math.inf
+        self.bn = bn
+
+    def add(self, value: float, bn: str) -> None:
+        self.moments.add(value, 0)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.bn = bn
+
+
+class _RoomState:
+    __slots__ = ("max_ts", "last_seen", "windows")
+
+    def __init__(self) -> None:
+        self.max_ts: Optional[int] = None
+        self.last_seen = 0.0
+        self.windows: Dict[int, _OpenWindow] = {}
+
+
+class EventTimeWindower:
+    def __init__(self, window_s: int, hop_s: Optional[int] = None, allowed_lateness_s: int = 0) -> None:
+        hop_s = window_s if hop_s is None else hop_s
+        if window_s <= 0 or hop_s <= 0 or hop_s > window_s:
+            raise ValueError("Event-time windows need 0 < hop_s <= window_s")
+        self.window_s = window_s
+        self.hop_s = hop_s
+        self.allowed_lateness_s = allowed_lateness_s
+        self.late_samples = 0
+        self._rooms: Dict[str, _RoomState] = {}
+        self._lock = threading.Lock()
+
+    def watermark(self, room_id: str) -> Optional[int]:
+        room = self._rooms.get(room_id)
+        if room is None or room.max_ts is None:
+            return None
+        return room.max_ts - self.allowed_lateness_s
+
+    def add(self, room_id: str, ts: int, value: float, bn: str, now: float = 0.0) -> List[ClosedWindow]:
+        """Assign a sample to its windows and return any windows it closes."""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = _RoomState()
+            room.last_seen = now
+            watermark = None if room.max_ts is None else room.max_ts - self.allowed_lateness_s
+            assigned = False
+            start = ts - ts % self.hop_s
+            while start > ts - self.window_s:
+                if watermark is None or start + self.window_s > watermark:
+                    window = room.windows.get(start)
+                    if window is None:
+                        window = room.windows[start] = _OpenWindow(bn)
+                    window.add(value, bn)
+                    assigned = True
+                start -= self.hop_s
+            if not assigned:
+                self.late_samples += 1
+            if room.max_ts is None or ts > room.max_ts:
+                room.max_ts = ts
+            return self._close(room_id, room, room.max_ts - self.allowed_lateness_s)
+
+    def export_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return None
+            return {
+                "max_ts": room.max_ts,
+                "windows": [
+                    [start, *window.moments.state(), window.min, window.max, window.bn]
+                    for start, window in room.windows.items()
+                ],
+            }
+
+    def import_room(self, room_id: str, state: Dict[str, Any], now: float = 0.0) -> None:
+        with self._lock:
+            room = self._rooms.setdefault(room_id, _RoomState())
+            room.last_seen = now
+            if state.get("max_ts") is not None:
+                room.max_ts = max(room.max_ts or state["max_ts"], state["max_ts"])
+            for start, count, mean, m2, low, high, bn in state.get("windows", []):
+                window = _OpenWindow(bn)
+                window.moments.restore(count, mean, m2)
+                window.min, window.max = low, high
+                room.windows[start] = window
+
+    def drop_room(self, room_id: str) -> None:
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def flush_idle(self, now: float, idle_s: float) -> List[ClosedWindow]:
+        """Close every open window of rooms that have been silent for ``idle_s``."""
+        closed: List[ClosedWindow] = []
+        with self._lock:
+            for room_id, room in self._rooms.items():
+                if room.windows and now - room.last_seen >= idle_s:
+                    closed.extend(self._close(room_id, room, None))
+        return closed
+
+    def _close(self, room_id: str, room: _RoomState, watermark: Optional[int]) -> List[ClosedWindow]:
+        ready = sorted(
+            start for start in room.windows if watermark is None or start + self.window_s <= watermark
+        )
+        closed = []
+        for start in ready:
+            window = room.windows.pop(start)
+            closed.append(
+                ClosedWindow(
+                    room_id=room_id,
+                    bn=window.bn,
+                    start=start,
+                    end=start + self.window_s,
+                    count=window.moments.count,
+                    mean=window.moments.mean,
+                    min=window.min,
+                    max=window.max,
+                    variance=window.moments.variance or 0.0,
+                )
+            )
+        if watermark is None and closed:
+            # Forced flushes advance the watermark so stragglers for the
+            # flushed windows are treated as late rather than re-opened.
+            room.max_ts = max(room.max_ts or 0, closed[-1].end + self.allowed_lateness_s)
+        return closed
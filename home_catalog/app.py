@@ -1,19 +1,81 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
+import secrets
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from pydantic import BaseModel, Field
 
+from common.partitioning import PartitionConfig, assign_rooms, assignment_epoch
+from home_catalog.registry import RegistryError, ServiceRegistry
+
 DEFAULT_CONFIG_PATH = Path(__file__).resolve().parents[1] / "config" / "home_catalog.json"
 CONFIG_PATH = Path(
     os.getenv("HOME_CATALOG_CONFIG", str(DEFAULT_CONFIG_PATH))
 ).resolve()
+# API registrations and edits survive restarts here; the config file stays untouched.
+STATE_PATH = Path(os.getenv("HOME_CATALOG_STATE", "state/home_catalog_registry.json")).resolve()
+
+_registry_instance: ServiceRegistry | None = None
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    yield
+    # Write out registrations still waiting for the next write-behind batch.
+    if _registry_instance is not None:
+        _registry_instance.flush()
+
+
+app = FastAPI(title="Home Catalog", version="1.0.0", lifespan=lifespan)
+MQTT_VERSION_KEY = "$mqtt"
+MAX_WATCH_TIMEOUT_S = 300.0
+
+
+class ConfigVersions:
+    """Per-service config version counters with long-poll waiters.
+
+    Only touched from the event loop (every endpoint that changes config is
+    ``async``), so plain asyncio events are enough to wake watchers.
+    """
+
+    def __init__(self) -> None:
+        # ETags embed a boot id so a restarted catalog never matches stale tags.
+        self._boot_id = secrets.token_hex(4)
+        self._versions: dict[str, int] = {}
+        self._changed: dict[str, asyncio.Event] = {}
+
+    def etag(self, *keys: str) -> str:
+        versions = ".".join(str(self._versions.get(key, 1)) for key in keys)
+        return f'"{self._boot_id}.{versions}"'
 
-app = FastAPI(title="Home Catalog", version="1.0.0")
-_catalog_cache: dict | None = None
+    def bump(self, key: str) -> None:
+        self._versions[key] = self._versions.get(key, 1) + 1
+        event = self._changed.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def wait_for_change(self, key: str, etag: str, timeout_s: float) -> bool:
+        deadline = time.monotonic() + timeout_s
+        while self.etag(key) == etag:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            event = self._changed.setdefault(key, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+_versions = ConfigVersions()
 
 
 class ServiceRegistration(BaseModel):
@@ -21,14 +83,27 @@ class ServiceRegistration(BaseModel):
     config: dict
 
 
-def _load_config() -> dict:
-    global _catalog_cache
-    if _catalog_cache is not None:
-        return _catalog_cache
+class ServiceBatch(BaseModel):
+    services: list[ServiceRegistration]
+
+
+class ServiceNames(BaseModel):
+    names: list[str]
+
+
+class ShardScale(BaseModel):
+    replicas: int = Field(..., ge=1)
+
+
+def _registry() -> ServiceRegistry:
+    global _registry_instance
+    if _registry_instance is not None:
+        return _registry_instance
     if not CONFIG_PATH.exists():
         raise FileNotFoundError(f"Missing config file: {CONFIG_PATH}")
-    _catalog_cache = json.loads(CONFIG_PATH.read_text(encoding="utf-8"))
-    return _catalog_cache
+    catalog = json.loads(CONFIG_PATH.read_text(encoding="utf-8"))
+    _registry_instance = ServiceRegistry(catalog, STATE_PATH)
+    return _registry_instance
 
 
 @app.get("/health")
@@ -36,34 +111,158 @@ def health() -> dict:
     return {"status": "ok"}
 
 
+def _conditional(
+    keys: str | tuple[str, ...], body: dict, response: Response, if_none_match: str | None
+) -> dict | Response:
+    etag = _versions.etag(*((keys,) if isinstance(keys, str) else keys))
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return body
+
+
 @app.get("/mqtt")
-def mqtt_config() -> dict:
-    return _load_config()["mqtt"]
+def mqtt_config(response: Response, if_none_match: str | None = Header(default=None)) -> dict:
+    return _conditional(MQTT_VERSION_KEY, _registry().catalog["mqtt"], response, if_none_match)
+
+
+def _service_entry(service_name: str) -> dict:
+    try:
+        return _registry().get(service_name)
+    except RegistryError:
+        raise HTTPException(status_code=404, detail="service not registered") from None
 
 
 @app.get("/config/{service_name}")
-def service_config(service_name: str) -> dict:
-    config = _load_config().get("services", {})
-    if service_name not in config:
-        raise HTTPException(status_code=404, detail="service not registered")
-    return config[service_name]
+def service_config(
+    service_name: str, response: Response, if_none_match: str | None = Header(default=None)
+) -> dict:
+    return _conditional(service_name, _service_entry(service_name), response, if_none_match)
+
+
+@app.get("/bootstrap/{service_name}")
+def bootstrap(
+    service_name: str,
+    response: Response,
+    replica: int | None = None,
+    if_none_match: str | None = Header(default=None),
+) -> dict:
+    """Everything a service needs to start in one round trip: broker, service config and shard."""
+    config = _service_entry(service_name)
+    body = {
+        "mqtt": _registry().catalog["mqtt"],
+        "service": config,
+        "etag": _versions.etag(service_name),
+        "shards": None,
+    }
+    if PartitionConfig.from_dict(config.get("partitioning")).enabled:
+        body["shards"] = shard_assignment(service_name, replica or 0)
+    return _conditional((service_name, MQTT_VERSION_KEY), body, response, if_none_match)
+
+
+@app.put("/config/{service_name}")
+async def update_service_config(service_name: str, config: dict) -> dict:
+    _service_entry(service_name)
+    _registry().update(service_name, config)
+    _versions.bump(service_name)
+    return {"status": "updated", "service": service_name, "etag": _versions.etag(service_name)}
+
+
+@app.get("/watch/{service_name}")
+async def watch_service_config(
+    service_name: str,
+    response: Response,
+    timeout_s: float = 30.0,
+    if_none_match: str | None = Header(default=None),
+) -> dict:
+    """Long-poll: answer once the config no longer matches ``If-None-Match``, else 304 after ``timeout_s``."""
+    _service_entry(service_name)
+    if if_none_match is not None:
+        timeout_s = min(max(timeout_s, 0.0), MAX_WATCH_TIMEOUT_S)
+        await _versions.wait_for_change(service_name, if_none_match, timeout_s)
+    return _conditional(service_name, _service_entry(service_name), response, if_none_match)
 
 
 @app.get("/services")
-def list_services() -> dict:
-    config = _load_config().get("services", {})
-    return {"services": sorted(config.keys())}
+def list_services(
+    room: str | None = None,
+    topic: str | None = None,
+    device: str | None = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int | None = Query(default=None, ge=1, le=10000),
+) -> dict:
+    """Service names, optionally filtered by room, topic (concrete or template) or device id."""
+    total, names = _registry().query(room=room, topic=topic, device=device, offset=offset, limit=limit)
+    return {"services": names, "total": total, "offset": offset, "limit": limit}
 
 
 @app.post("/register")
-def register_service(registration: ServiceRegistration) -> dict:
-    config = _load_config().setdefault("services", {})
-    if registration.name in config:
-        raise HTTPException(status_code=409, detail="service already registered")
-    config[registration.name] = registration.config
+async def register_service(registration: ServiceRegistration) -> dict:
+    try:
+        _registry().register(registration.name, registration.config)
+    except RegistryError:
+        raise HTTPException(status_code=409, detail="service already registered") from None
+    _versions.bump(registration.name)
     return {"status": "registered", "service": registration.name}
 
 
+@app.post("/register/batch")
+async def register_services(batch: ServiceBatch) -> dict:
+    """Register many services atomically: a single name conflict rejects the whole batch."""
+    configs = {registration.name: registration.config for registration in batch.services}
+    if len(configs) != len(batch.services):
+        raise HTTPException(status_code=422, detail="duplicate service names in batch")
+    try:
+        _registry().register_many(configs)
+    except RegistryError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from None
+    for name in configs:
+        _versions.bump(name)
+    return {"status": "registered", "count": len(configs)}
+
+
+@app.delete("/services/{service_name}")
+async def unregister_service(service_name: str) -> dict:
+    if not _registry().unregister_many([service_name]):
+        raise HTTPException(status_code=404, detail="service not registered")
+    _versions.bump(service_name)
+    return {"status": "unregistered", "service": service_name}
+
+
+@app.post("/unregister/batch")
+async def unregister_services(batch: ServiceNames) -> dict:
+    removed = _registry().unregister_many(batch.names)
+    for name in removed:
+        _versions.bump(name)
+    return {"status": "unregistered", "services": removed}
+
+
+@app.get("/shards/{service_name}")
+def shard_assignment(service_name: str, replica: int = 0) -> dict:
+    config = _service_entry(service_name)
+    partitioning = PartitionConfig.from_dict(config.get("partitioning"))
+    if not 0 <= replica < partitioning.replicas:
+        raise HTTPException(status_code=404, detail="replica out of range")
+    rooms = config.get("rooms", [])
+    assignment = assign_rooms(rooms, partitioning.replicas, partitioning.vnodes)
+    return {
+        "service": service_name,
+        "replica": replica,
+        "replicas": partitioning.replicas,
+        "epoch": assignment_epoch(rooms, partitioning.replicas),
+        "rooms": assignment[replica],
+    }
+
+
+@app.post("/shards/{service_name}/scale")
+async def scale_service(service_name: str, scale: ShardScale) -> dict:
+    config = dict(_service_entry(service_name))
+    config["partitioning"] = {**config.get("partitioning", {}), "replicas": scale.replicas}
+    _registry().update(service_name, config)
+    _versions.bump(service_name)
+    return {"service": service_name, "replicas": scale.replicas}
+
+
 if __name__ == "__main__":
     import uvicorn
 
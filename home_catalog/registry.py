@@ -0,0 +1,249 @@
+"""Indexed service registry with write-behind persistence.
+
+The catalog file stays the read-only baseline. Services registered, updated
+or removed through the API are kept as an overlay that is written to a
+separate state file in batches (temp file, fsync, rename), so restarts keep
+registrations while edits to the catalog file still apply to the rest.
+Secondary indexes answer "which services cover room X / topic T / device D"
+without walking every service config.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from common.topics import TopicRouter, template_to_filter
+
+_TOPIC_SUFFIXES = ("_topic_template", "_topic")
+_TOPIC_LIST_SUFFIXES = ("topic_templates",)
+
+
+class RegistryError(Exception):
+    """Raised for conflicting or unknown service names."""
+
+
+def _rooms_of(config: Mapping[str, object]) -> Set[str]:
+    rooms = set(config.get("rooms", []) or [])
+    if isinstance(config.get("room_id"), str):
+        rooms.add(config["room_id"])
+    return rooms
+
+
+def _devices_of(config: Mapping[str, object]) -> Set[str]:
+    devices = set()
+    for key, value in config.items():
+        if key == "device_id" and isinstance(value, str):
+            devices.add(value)
+        elif key == "devices" and isinstance(value, Mapping):
+            # Room -> device id maps, such as the actuator gateway's per-kind devices.
+            devices.update(device_id for device_id in value.values() if isinstance(device_id, str))
+        elif isinstance(value, Mapping):
+            devices |= _devices_of(value)
+    return devices
+
+
+def _topic_filters_of(config: Mapping[str, object]) -> Set[str]:
+    filters = set()
+    for key, value in config.items():
+        if key.endswith(_TOPIC_SUFFIXES) and isinstance(value, str):
+            templates = [value]
+        elif key.endswith(_TOPIC_LIST_SUFFIXES) and isinstance(value, (list, Mapping)):
+            # topic_templates lists (thingspeak, dashboard) and state_topic_templates maps (history).
+            items = value.values() if isinstance(value, Mapping) else value
+            templates = [item for item in items if isinstance(item, str)]
+        elif isinstance(value, Mapping):
+            # Nested sections such as the actuator gateway's per-kind topics.
+            filters |= _topic_filters_of(value)
+            continue
+        else:
+            continue
+        for template in templates:
+            try:
+                filters.add(template_to_filter(template))
+            except ValueError:
+                continue
+    return filters
+
+
+class ServiceRegistry:
+    def __init__(self, catalog: dict, state_path: Path, flush_interval_s: float = 1.0) -> None:
+        self._catalog = catalog
+        self._services: Dict[str, dict] = catalog.setdefault("services", {})
+        self._state_path = state_path
+        self._flush_interval_s = flush_interval_s
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._logger = logging.getLogger("home_catalog.registry")
+        # Overlay persisted to the state file: API-registered configs and removals.
+        self._overlay: Dict[str, dict] = {}
+        self._removed: Set[str] = set()
+        self._dirty = threading.Event()
+        self._by_room: Dict[str, Set[str]] = {}
+        self._by_device: Dict[str, str] = {}
+        self._topics: TopicRouter[str] = TopicRouter()
+        self._sorted_names: Optional[List[str]] = None
+        self._load_state()
+        for name, config in self._services.items():
+            self._index(name, config)
+        threading.Thread(target=self._flush_loop, name="registry-flush", daemon=True).start()
+
+    @property
+    def catalog(self) -> dict:
+        return self._catalog
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._services
+
+    def __len__(self) -> int:
+        return len(self._services)
+
+    def get(self, name: str) -> dict:
+        try:
+            return self._services[name]
+        except KeyError:
+            raise RegistryError(f"service not registered: {name}") from None
+
+    def register(self, name: str, config: dict) -> None:
+        self.register_many({name: config})
+
+    def register_many(self, configs: Mapping[str, dict]) -> None:
+        """Register several services at once; nothing is registered if any name exists."""
+        with self._lock:
+            existing = sorted(name for name in configs if name in self._services)
+            if existing:
+                raise RegistryError(f"service already registered: {', '.join(existing)}")
+            for name, config in configs.items():
+                self._put(name, config)
+        self._dirty.set()
+
+    def update(self, name: str, config: dict) -> None:
+        with self._lock:
+            self.get(name)
+            self._unindex(name, self._services[name])
+            self._put(name, config)
+        self._dirty.set()
+
+    def unregister_many(self, names: Iterable[str]) -> List[str]:
+        """Remove the named services and return the ones that were registered."""
+        removed = []
+        with self._lock:
+            for name in names:
+                config = self._services.pop(name, None)
+                if config is None:
+                    continue
+                self._unindex(name, config)
+                self._overlay.pop(name, None)
+                self._removed.add(name)
+                removed.append(name)
+            self._sorted_names = None
+        if removed:
+            self._dirty.set()
+        return removed
+
+    def query(
+        self,
+        room: Optional[str] = None,
+        topic: Optional[str] = None,
+        device: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, List[str]]:
+        """Sorted service names matching every given filter, paginated; returns ``(total, page)``."""
+        with self._lock:
+            if room is None and topic is None and device is None:
+                names = self._names()
+            else:
+                candidates: Optional[Set[str]] = None
+                if room is not None:
+                    candidates = set(self._by_room.get(room, ()))
+                if topic is not None:
+                    matched = set(self._topics.match(template_to_filter(topic)))
+                    candidates = matched if candidates is None else candidates & matched
+                if device is not None:
+                    owner = self._by_device.get(device)
+                    matched = {owner} if owner is not None else set()
+                    candidates = matched if candidates is None else candidates & matched
+                names = sorted(candidates)
+        end = None if limit is None else offset + limit
+        return len(names), names[offset:end]
+
+    def flush(self) -> None:
+        """Write the overlay now if anything changed since the last write."""
+        with self._flush_lock:
+            if not self._dirty.is_set():
+                return
+            with self._lock:
+                self._dirty.clear()
+                state = {"services": dict(self._overlay), "removed": sorted(self._removed)}
+            body = json.dumps(state, separators=(",", ":")).encode("utf-8")
+            self._state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._state_path.with_suffix(self._state_path.suffix + ".tmp")
+            with open(tmp_path, "wb") as handle:
+                handle.write(body)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(tmp_path, self._state_path)
+
+    def _put(self, name: str, config: dict) -> None:
+        self._services[name] = config
+        self._overlay[name] = config
+        self._removed.discard(name)
+        self._index(name, config)
+        self._sorted_names = None
+
+    def _names(self) -> List[str]:
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self._services)
+        return self._sorted_names
+
+    def _index(self, name: str, config: dict) -> None:
+        for room_id in _rooms_of(config):
+            self._by_room.setdefault(room_id, set()).add(name)
+        for topic_filter in _topic_filters_of(config):
+            self._topics.add(topic_filter, name)
+        for device_id in _devices_of(config):
+            self._by_device[device_id] = name
+
+    def _unindex(self, name: str, config: dict) -> None:
+        for room_id in _rooms_of(config):
+            owners = self._by_room.get(room_id)
+            if owners is not None:
+                owners.discard(name)
+                if not owners:
+                    del self._by_room[room_id]
+        for topic_filter in _topic_filters_of(config):
+            self._topics.remove(topic_filter, lambda owner: owner == name)
+        for device_id in _devices_of(config):
+            if self._by_device.get(device_id) == name:
+                del self._by_device[device_id]
+
+    def _load_state(self) -> None:
+        if not self._state_path.exists():
+            return
+        try:
+            state = json.loads(self._state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            self._logger.warning("Ignoring unreadable registry state %s: %s", self._state_path, exc)
+            return
+        self._overlay = dict(state.get("services", {}))
+        self._removed = set(state.get("removed", []))
+        for name in self._removed:
+            self._services.pop(name, None)
+        self._services.update(self._overlay)
+
+    def _flush_loop(self) -> None:
+        while True:
+            self._dirty.wait()
+            # Batch every change made during the interval into one write.
+            time.sleep(self._flush_interval_s)
+            try:
+                self.flush()
+            except OSError as exc:  # pragma: no cover - retried on the next change
+                self._logger.warning("Registry flush failed: %s", exc)
+                self._dirty.set()
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict
+
+from common.actuators import ActuatorKind, CommandCoalescer, DeviceState
+from common.models import ActuatorState
+from common.runtime import get_home_catalog_url
+from common.service_base import ServiceBase
+from common.tracing import carry_trace
+
+
+class ActuatorGateway(ServiceBase):
+    """Drive the actuators of many rooms from one process.
+
+    Each actuator kind is one wildcard command subscription; commands for
+    rooms this gateway does not own are ignored. Catalog entries without an
+    ``actuators`` map describe a single device (``room_id``, ``device_id`` and
+    the two topic templates), as the per-room connectors always did; those
+    subscribe to their own room's command topic only.
+    """
+
+    def __init__(self, home_catalog_url: str, service_name: str = "actuator_gateway") -> None:
+        super().__init__(service_name, home_catalog_url)
+        self._logger = logging.getLogger(service_name)
+        self._kinds: Dict[str, ActuatorKind] = {}
+        # Kind -> room id -> device.
+        self._devices: Dict[str, Dict[str, DeviceState]] = {}
+        self._coalescer: CommandCoalescer | None = None
+
+    def start(self) -> None:
+        self.load_config()
+        self.connect_mqtt()
+        self.mqtt.loop_start()
+
+        cfg = self.service_config
+        self._kinds = self._load_kinds(cfg)
+        self._devices = {name: {} for name in self._kinds}
+        self._coalescer = CommandCoalescer(cfg.get("coalesce_ms", 0) / 1000.0, self._apply_command)
+        self._coalescer.start()
+        metrics = self.mqtt.metrics
+        metrics.gauge("actuator_devices", lambda: sum(len(devices) for devices in self._devices.values()))
+        metrics.gauge("actuator_commands_coalesced", lambda: self._coalescer.coalesced)
+
+        self.start_rooms(self._rooms_of(cfg))
+        for kind in self._kinds.values():
+            topic = self._command_topic(cfg, kind)
+            self.mqtt.subscribe([(topic, 1)], self._command_handler(kind))
+            self._logger.info("%s listening on %s", kind.name, topic)
+        self.mqtt.loop_forever()
+
+    def _load_kinds(self, cfg: dict) -> Dict[str, ActuatorKind]:
+        actuators = cfg.get("actuators")
+        if actuators is None:
+            legacy = {
+                "command_topic_template": cfg["command_topic_template"],
+                "state_topic_template": cfg["state_topic_template"],
+                "devices": {cfg["room_id"]: cfg["device_id"]},
+            }
+            return {self.service_name: ActuatorKind.from_dict(self.service_name, legacy)}
+        return {name: ActuatorKind.from_dict(name, payload) for name, payload in actuators.items()}
+
+    @staticmethod
+    def _command_topic(cfg: dict, kind: ActuatorKind) -> str:
+        if "actuators" in cfg:
+            return kind.command_filter
+        # A single-device process only needs its own room's commands.
+        return kind.command_topic_template.format(room_id=cfg["room_id"])
+
+    @staticmethod
+    def _rooms_of(cfg: dict) -> list[str]:
+        return cfg["rooms"] if "actuators" in cfg else [cfg["room_id"]]
+
+    def reload_config(self, old: dict, new: dict) -> None:
+        if "actuators" not in new:
+            # Single-device entries have no room list for the base class to rebalance.
+            new["rooms"] = self._rooms_of(new)
+        kinds = self._load_kinds(new)
+        if kinds.keys() != self._kinds.keys() or any(
+            self._command_topic(new, kinds[name]) != self._command_topic(old, kind)
+            for name, kind in self._kinds.items()
+        ):
+            self._logger.warning("Changes to actuator kinds or command topics take effect after a restart")
+            return
+        with self._rooms_lock:
+            self._kinds = kinds
+            # Devices of kept rooms pick up renamed ids and topics; their state stays.
+            for name, kind in kinds.items():
+                for room_id, device in self._devices[name].items():
+                    device.device_id = kind.device_for(room_id)
+                    device.state_topic = kind.state_topic_template.format(room_id=room_id)
+
+    def subscribe_room(self, room_id: str) -> None:
+        # Commands arrive on the kinds' wildcard subscriptions; owning a room only adds its devices.
+        for name, kind in self._kinds.items():
+            self._devices[name][room_id] = DeviceState(
+                name, kind.device_for(room_id), room_id, kind.state_topic_template.format(room_id=room_id)
+            )
+
+    def unsubscribe_room(self, room_id: str) -> None:
+        for devices in self._devices.values():
+            device = devices.pop(room_id, None)
+            if device is not None and self._coalescer is not None:
+                self._coalescer.discard(device)
+
+    def _command_handler(self, kind: ActuatorKind):
+        devices = self._devices[kind.name]
+        room_level = kind.room_level
+
+        def handle_command(topic: str, payload: dict) -> None:
+            levels = topic.split("/")
+            device = devices.get(levels[room_level]) if room_level < len(levels) else None
+            if device is not None:
+                self._coalescer.submit(device, payload)
+
+        return handle_command
+
+    def _apply_command(self, device: DeviceState, command: Dict[str, Any]) -> None:
+        desired_state = command.get("state", "OFF")
+        if desired_state == device.state:
+            return
+        device.state = desired_state
+        device.transitions += 1
+        self._logger.info(
+            "%s %s set to %s (reason=%s)", device.kind, device.device_id, desired_state, command.get("reason", "N/A")
+        )
+        state_payload = ActuatorState(
+            ts=int(time.time()),
+            device=device.device_id,
+            room_id=device.room_id,
+            state=desired_state,
+            trace=carry_trace(command, self.service_name),
+        ).to_dict()
+        self.mqtt.publish_json(device.state_topic, state_payload, qos=1, retain=True)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    service = ActuatorGateway(home_catalog_url=get_home_catalog_url())
+    service.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
 import logging
+import threading
 import time
+from typing import Iterable, Mapping
 
-from common.models import AlertEvent, TemperatureTelemetry
+import numpy as np
+
+from common.alert_rules import OVERHEAT, RAPID_RISE, STATE_DTYPE, AlertRuleEngine, RoomRule, Transition
+from common.models import AlertEvent, TelemetryPack, TemperatureTelemetry
 from common.runtime import get_home_catalog_url
 from common.service_base import ServiceBase
+from common.tracing import add_hop
 
 
 class AlertStrategy(ServiceBase):
@@ -14,8 +20,23 @@ class AlertStrategy(ServiceBase):
     def __init__(self, home_catalog_url: str) -> None:
         super().__init__("alert_strategy", home_catalog_url)
         self._logger = logging.getLogger("alert_strategy")
-        self._in_alert: dict[str, bool] = {}
-        self._last_alert_ts: dict[str, int] = {}
+        self._engine = AlertRuleEngine()
+        self._default_rule: RoomRule | None = None
+        self._room_rules: dict[str, dict] = {}
+        self._room_topics: dict[str, tuple[str, str]] = {}
+        self._input_template = ""
+        self._alert_template = ""
+        self._indicator_template = ""
+        self._batch_max_size = 1
+        self._batch_lock = threading.Lock()
+        # Held from taking a batch until its transitions are published, so batches of
+        # the batch timer and the MQTT thread are evaluated in arrival order.
+        self._flush_lock = threading.Lock()
+        self._pending: tuple[list[int], list[float], list[int], list[int]] = ([], [], [], [])
+        # Trace context of each pending sample (None when untraced), in batch order.
+        self._pending_traces: list[dict | None] = []
+        # Rooms with samples in the pending batch; marked dirty once the batch is evaluated.
+        self._pending_rooms: set[str] = set()
 
     def start(self) -> None:
         self.load_config()
@@ -23,87 +44,161 @@ class AlertStrategy(ServiceBase):
         self.mqtt.loop_start()
 
         cfg = self.service_config
-        input_template = cfg["input_topic_template"]
-        alert_template = cfg["alert_topic_template"]
-        indicator_template = cfg["indicator_topic_template"]
-        high_threshold = cfg["high_threshold"]
-        low_threshold = cfg["low_threshold"]
-        cooldown_s = cfg["cooldown_s"]
-        rooms = cfg["rooms"]
-
-        def handle_message(topic: str, payload: dict) -> None:
-            try:
-                telemetry = TemperatureTelemetry.from_dict(payload)
-            except ValueError as exc:
-                self._logger.warning("%s", exc)
-                return
-
-            now = int(time.time())
-            in_alert = self._in_alert.get(telemetry.room_id, False)
-            last_alert_ts = self._last_alert_ts.get(telemetry.room_id, 0)
-            if in_alert:
-                # Remain in alert until temperature drops below the low threshold.
-                if telemetry.temp_c <= low_threshold:
-                    self._in_alert[telemetry.room_id] = False
-                    self._last_alert_ts[telemetry.room_id] = now
-                    alert_topic = alert_template.format(room_id=telemetry.room_id)
-                    indicator_topic = indicator_template.format(room_id=telemetry.room_id)
-                    self._publish_alert(
-                        telemetry.room_id,
-                        telemetry.temp_c,
-                        "RECOVERED",
-                        "INFO",
-                        alert_topic,
-                    )
-                    self.mqtt.publish_json(
-                        indicator_topic,
-                        {
-                            "state": "OFF",
-                            "room_id": telemetry.room_id,
-                            "ts": now,
-                            "reason": "RECOVERED",
-                        },
-                        qos=1,
-                    )
-                return
-
-            # Trigger an alert state and publish an indicator command when the
-            # high threshold is exceeded and cooldown permits.
-            if telemetry.temp_c >= high_threshold and now - last_alert_ts >= cooldown_s:
-                self._in_alert[telemetry.room_id] = True
-                self._last_alert_ts[telemetry.room_id] = now
-                alert_topic = alert_template.format(room_id=telemetry.room_id)
-                indicator_topic = indicator_template.format(room_id=telemetry.room_id)
-                self._publish_alert(
-                    telemetry.room_id,
-                    telemetry.temp_c,
-                    "OVERHEAT",
-                    "WARN",
-                    alert_topic,
-                )
-                self.mqtt.publish_json(
-                    indicator_topic,
-                    {
-                        "state": "ON",
-                        "room_id": telemetry.room_id,
-                        "ts": now,
-                        "reason": "OVERHEAT",
-                    },
-                    qos=1,
-                )
-
-        input_topics = [(input_template.format(room_id=room_id), 0) for room_id in rooms]
-        self.mqtt.subscribe(input_topics, handle_message)
-        self._logger.info("Alert strategy subscribed to %s", input_template)
+        self._input_template = cfg["input_topic_template"]
+        self._alert_template = cfg["alert_topic_template"]
+        self._indicator_template = cfg["indicator_topic_template"]
+        self._load_rules(cfg)
+        batch_cfg = cfg.get("batch", {})
+        self._batch_max_size = max(int(batch_cfg.get("max_size", 1)), 1)
+        max_delay_ms = batch_cfg.get("max_delay_ms", 0)
+        if self._batch_max_size > 1 and max_delay_ms <= 0:
+            # Without the timer a partial batch would wait for the next message indefinitely.
+            raise ValueError("batch.max_delay_ms must be positive when batch.max_size > 1")
+        if self._batch_max_size > 1:
+            threading.Thread(
+                target=self._flush_periodically, args=(max_delay_ms / 1000.0,), name="alert-batch", daemon=True
+            ).start()
+
+        self.start_rooms(cfg["rooms"])
+        self._logger.info("Alert strategy subscribed to %s", self._input_template)
         self.mqtt.loop_forever()
 
-    def _publish_alert(self, room_id: str, temp_c: float, alert_type: str, level: str, topic: str) -> None:
+    def reload_config(self, old: dict, new: dict) -> None:
+        self._load_rules(new)
+        # Existing rooms keep their latches; only their thresholds change.
+        for room_id in list(self._room_topics):
+            self._engine.set_rule(room_id, self._rule_for(room_id))
+        self._logger.info("Reloaded alert rules for %s room(s)", len(self._room_topics))
+
+    def _load_rules(self, cfg: dict) -> None:
+        self._default_rule = RoomRule.from_dict(cfg)
+        self._room_rules = cfg.get("room_rules", {})
+
+    def _rule_for(self, room_id: str) -> RoomRule:
+        overrides = self._room_rules.get(room_id)
+        return self._default_rule if overrides is None else RoomRule.from_dict(overrides, self._default_rule)
+
+    def subscribe_room(self, room_id: str) -> None:
+        self._ensure_room(room_id)
+        topic = self._input_template.format(room_id=room_id)
+        self.mqtt.subscribe([(topic, 0)], self._handle_message, model=TelemetryPack)
+
+    def unsubscribe_room(self, room_id: str) -> None:
+        self.mqtt.unsubscribe([self._input_template.format(room_id=room_id)], self._handle_message)
+
+    def export_room_state(self, room_id: str) -> dict | None:
+        return self._engine.export_room(room_id)
+
+    def import_room_state(self, room_id: str, state: dict) -> None:
+        self._ensure_room(room_id)
+        self._engine.import_room(room_id, state)
+
+    def drop_room_state(self, room_id: str) -> None:
+        self._engine.remove_room(room_id)
+        self._room_topics.pop(room_id, None)
+
+    def export_rooms_state(self, room_ids: Iterable[str]) -> dict[str, bytes]:
+        # Snapshots store each room as one fixed-width STATE_DTYPE record.
+        room_ids = [room_id for room_id in room_ids if room_id in self._engine]
+        data = self._engine.export_states(room_ids).tobytes()
+        size = STATE_DTYPE.itemsize
+        return {room_id: data[i * size : (i + 1) * size] for i, room_id in enumerate(room_ids)}
+
+    def restore_rooms_state(self, states: Mapping[str, bytes]) -> None:
+        size = STATE_DTYPE.itemsize
+        room_ids = [room_id for room_id, blob in states.items() if len(blob) == size]
+        if len(room_ids) != len(states):
+            self._logger.warning("Skipping %s room state(s) with an unexpected size", len(states) - len(room_ids))
+        # Rooms on the default rule are added in bulk; overrides go one by one.
+        self._engine.add_rooms([room_id for room_id in room_ids if room_id not in self._room_rules], self._default_rule)
+        for room_id in room_ids:
+            self._ensure_room(room_id)
+        records = np.frombuffer(b"".join(states[room_id] for room_id in room_ids), dtype=STATE_DTYPE)
+        self._engine.import_states(room_ids, records)
+
+    def _ensure_room(self, room_id: str) -> None:
+        if room_id in self._room_topics:
+            return
+        if room_id not in self._engine:
+            self._engine.set_rule(room_id, self._rule_for(room_id))
+        # Topics are formatted once per room rather than on every trigger.
+        self._room_topics[room_id] = (
+            self._alert_template.format(room_id=room_id),
+            self._indicator_template.format(room_id=room_id),
+        )
+
+    def _handle_message(self, topic: str, samples: list[TemperatureTelemetry]) -> None:
+        # Single samples and SenML packs alike; a pack goes into one batch.
+        room_id = samples[0].room_id
+        if room_id not in self._engine:
+            return
+        slot = self._engine.slot(room_id)
+        received = int(time.time())
+        with self._batch_lock:
+            slots, temps, sample_ts, now = self._pending
+            for telemetry in samples:
+                slots.append(slot)
+                temps.append(telemetry.temp_c)
+                sample_ts.append(telemetry.ts)
+                now.append(received)
+                self._pending_traces.append(telemetry.trace)
+            self._pending_rooms.add(room_id)
+            full = len(slots) >= self._batch_max_size
+        if full:
+            self._flush()
+
+    def _flush_periodically(self, interval_s: float) -> None:
+        while True:
+            time.sleep(interval_s)
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._flush_lock:
+            with self._batch_lock:
+                batch, traces, rooms = self._pending, self._pending_traces, self._pending_rooms
+                if not batch[0]:
+                    return
+                self._pending = ([], [], [], [])
+                self._pending_traces = []
+                self._pending_rooms = set()
+            transitions = self._engine.evaluate(*batch)
+            # Only after the state changed, so a checkpoint in between cannot clear the mark early.
+            for room_id in rooms:
+                self.mark_room_dirty(room_id)
+            for transition in transitions:
+                trace = traces[transition.index]
+                self._publish_transition(transition, None if trace is None else add_hop(trace, self.service_name))
+
+    def _publish_transition(self, transition: Transition, trace: dict | None = None) -> None:
+        topics = self._room_topics.get(transition.room_id)
+        if topics is None:
+            return
+        alert_topic, indicator_topic = topics
+        self._publish_alert(
+            transition.room_id, transition.temp_c, transition.type, transition.level, alert_topic, trace
+        )
+        if transition.type == RAPID_RISE:
+            return
+        command = {
+            "state": "ON" if transition.type == OVERHEAT else "OFF",
+            "room_id": transition.room_id,
+            "ts": transition.ts,
+            "reason": transition.type,
+        }
+        if trace is not None:
+            command["trace"] = trace
+        self.mqtt.publish_json(indicator_topic, command, qos=1)
+
+    def _publish_alert(
+        self, room_id: str, temp_c: float, alert_type: str, level: str, topic: str, trace: dict | None = None
+    ) -> None:
         payload = AlertEvent(
             ts=int(time.time()),
             room_id=room_id,
             type=alert_type,
             level=level,
             temp_c=float(temp_c),
+            trace=trace,
         ).to_dict()
         self.mqtt.publish_json(topic, payload, qos=1)
         self._logger.info("Published alert %s for %s", alert_type, room_id)
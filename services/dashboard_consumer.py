@@ -1,52 +1,115 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
-from datetime import datetime, timezone
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from common.live_feed import FrameBroadcaster, LatestValueTable
+from common.models import TemperatureTelemetry
 from common.runtime import get_home_catalog_url
 from common.service_base import ServiceBase
 
 
+def topic_kind(template: str) -> str:
+    """Cell name for a topic template: ``iot/{room_id}/hvac/state`` -> ``hvac/state``."""
+    return template.split("{room_id}/", 1)[-1]
+
+
+def create_app(table: LatestValueTable, broadcaster: FrameBroadcaster) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+        frames = asyncio.get_running_loop().create_task(broadcaster.run())
+        yield
+        frames.cancel()
+
+    app = FastAPI(title="Dashboard", version="1.0.0", lifespan=lifespan)
+
+    @app.get("/latest")
+    def latest() -> dict:
+        return {"rooms": table.snapshot(), "viewers": broadcaster.viewers}
+
+    @app.get("/events")
+    def events() -> StreamingResponse:
+        return StreamingResponse(
+            broadcaster.stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    return app
+
+
 class DashboardConsumer(ServiceBase):
-    """Lightweight CLI dashboard for observability and demos."""
+    """Live dashboard: a latest-value table per room served as coalesced SSE frames."""
 
     def __init__(self, home_catalog_url: str) -> None:
         super().__init__("dashboard_consumer", home_catalog_url)
         self._logger = logging.getLogger("dashboard_consumer")
+        self._table = LatestValueTable()
+        self._handlers: dict[str, object] = {}
+        self._topic_templates: list[str] = []
+        self._log_messages = False
 
     def start(self) -> None:
         self.load_config()
         self.connect_mqtt()
         self.mqtt.loop_start()
 
-        topic_templates = self.service_config["topic_templates"]
-        rooms = self.service_config["rooms"]
-        topics = [
-            (
-                template.format(room_id=room_id),
-                1 if template.endswith("/state") else 0,
-            )
-            for room_id in rooms
-            for template in topic_templates
-        ]
-
-        def handle_message(topic: str, payload: dict) -> None:
-            ts = payload.get("ts")
-            timestamp = (
-                datetime.fromtimestamp(ts, tz=timezone.utc).isoformat() if ts else "n/a"
-            )
-            self._logger.info(
-                "topic=%s ts=%s payload=%s",
-                topic,
-                timestamp,
-                json.dumps(payload, ensure_ascii=False),
+        cfg = self.service_config
+        self._topic_templates = cfg["topic_templates"]
+        self._log_messages = cfg.get("log_messages", False)
+        self._handlers = {template: self._handler(topic_kind(template)) for template in self._topic_templates}
+
+        feed_cfg = cfg.get("feed", {})
+        broadcaster = FrameBroadcaster(
+            self._table,
+            refresh_hz=feed_cfg.get("refresh_hz", 2.0),
+            max_pending_frames=feed_cfg.get("max_pending_frames", 8),
+        )
+        server = uvicorn.Server(
+            uvicorn.Config(
+                create_app(self._table, broadcaster),
+                host=feed_cfg.get("host", "0.0.0.0"),
+                port=feed_cfg.get("port", 8020),
+                log_level="warning",
             )
+        )
+        threading.Thread(target=server.run, name="dashboard-http", daemon=True).start()
 
-        self.mqtt.subscribe(topics, handle_message)
-        self._logger.info("Dashboard consumer subscribed to %s", topics)
+        self.start_rooms(cfg["rooms"])
+        self._logger.info("Dashboard serving %s room(s) on /events", len(self.rooms))
         self.mqtt.loop_forever()
 
+    def subscribe_room(self, room_id: str) -> None:
+        for template in self._topic_templates:
+            qos = 1 if template.endswith("/state") else 0
+            self.mqtt.subscribe([(template.format(room_id=room_id), qos)], self._handlers[template])
+
+    def unsubscribe_room(self, room_id: str) -> None:
+        for template in self._topic_templates:
+            self.mqtt.unsubscribe([template.format(room_id=room_id)], self._handlers[template])
+
+    def _handler(self, kind: str):
+        table = self._table
+
+        def handle_message(topic: str, payload: dict | list) -> None:
+            if isinstance(payload, list):
+                # SenML pack: the table keeps the newest sample.
+                payload = TemperatureTelemetry.from_pack(payload)[-1].to_dict()
+            room_id = payload.get("room_id") or topic.split("/")[1]
+            table.update(room_id, kind, payload)
+            if self._log_messages:
+                self._logger.info("topic=%s payload=%s", topic, json.dumps(payload, ensure_ascii=False))
+
+        return handle_message
+
 
 def main() -> None:
     logging.basicConfig(level=logging.INFO)
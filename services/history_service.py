@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, HTTPException
+
+from common.history_store import ALERT_CODES, ALERTS, LEVEL_CODES, RAW, RESOLUTIONS, STATE_CODES, HistoryStore
+from common.models import ActuatorState, AlertEvent, TelemetryPack, TemperatureTelemetry
+from common.runtime import get_home_catalog_url
+from common.service_base import ServiceBase
+
+DEFAULT_RANGE_S = 86400
+_ALERT_NAMES = {code: name for name, code in ALERT_CODES.items()}
+_LEVEL_NAMES = {code: name for name, code in LEVEL_CODES.items()}
+_STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+
+
+def create_app(store: HistoryStore) -> FastAPI:
+    app = FastAPI(title="History", version="1.0.0")
+
+    @app.get("/health")
+    def health() -> dict:
+        return {"status": "ok"}
+
+    @app.get("/history/{room_id}/{series}")
+    def history(
+        room_id: str,
+        series: str,
+        start: int | None = None,
+        end: int | None = None,
+        resolution: str = "1m",
+    ) -> dict:
+        """Columnar rows for ``start <= ts < end`` (default: the last 24 h)."""
+        if series not in store.series_names:
+            raise HTTPException(status_code=404, detail="unknown series")
+        if resolution not in RESOLUTIONS:
+            raise HTTPException(status_code=400, detail=f"resolution must be one of {list(RESOLUTIONS)}")
+        end = int(time.time()) + 1 if end is None else end
+        start = end - DEFAULT_RANGE_S if start is None else start
+        try:
+            rows = store.query(room_id, series, start, end, resolution if series == "temperature" else RAW)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from None
+        return {
+            "room_id": room_id,
+            "series": series,
+            "resolution": resolution if series == "temperature" else RAW,
+            "start": start,
+            "end": end,
+            "columns": _columns(series, rows),
+        }
+
+    return app
+
+
+def _columns(series: str, rows: dict[str, np.ndarray]) -> dict[str, list]:
+    columns = {name: values.tolist() for name, values in rows.items()}
+    if series == ALERTS and "code" in columns:
+        columns["type"] = [_ALERT_NAMES.get(code) for code in columns.pop("code")]
+        columns["level"] = [_LEVEL_NAMES.get(code) for code in columns["level"]]
+        columns["temp_c"] = columns.pop("value")
+    elif "code" in columns:
+        columns["state"] = [_STATE_NAMES.get(code) for code in columns.pop("code")]
+    return columns
+
+
+class HistoryService(ServiceBase):
+    """Record telemetry, alerts and actuator states per room and serve range queries."""
+
+    def __init__(self, home_catalog_url: str) -> None:
+        super().__init__("history", home_catalog_url)
+        self._logger = logging.getLogger("history")
+        self._store: HistoryStore | None = None
+        self._telemetry_template = ""
+        self._alert_template = ""
+        self._state_templates: dict[str, str] = {}
+        self._state_handlers: dict = {}
+
+    def start(self) -> None:
+        self.load_config()
+        self.connect_mqtt()
+        self.mqtt.loop_start()
+
+        cfg = self.service_config
+        self._telemetry_template = cfg["telemetry_topic_template"]
+        self._alert_template = cfg["alert_topic_template"]
+        self._state_templates = cfg.get("state_topic_templates", {})
+        self._state_handlers = {series: self._state_handler(series) for series in self._state_templates}
+        self._store = HistoryStore(
+            cfg.get("data_dir", "state/history"),
+            segment_s=cfg.get("segment_s", 86400),
+            retention_s=cfg.get("retention_s", {}),
+            state_series=self._state_templates,
+        )
+        self.mqtt.metrics.gauge("history_rollup_late_dropped", self._store.rollup_late_dropped)
+        threading.Thread(
+            target=self._maintain,
+            args=(cfg.get("flush_interval_s", 10), cfg.get("purge_interval_s", 3600)),
+            name="history-maintenance",
+            daemon=True,
+        ).start()
+        http_cfg = cfg.get("http", {})
+        server = uvicorn.Server(
+            uvicorn.Config(
+                create_app(self._store),
+                host=http_cfg.get("host", "0.0.0.0"),
+                port=http_cfg.get("port", 8010),
+                log_level="warning",
+            )
+        )
+        threading.Thread(target=server.run, name="history-http", daemon=True).start()
+
+        self.start_rooms(cfg["rooms"])
+        self._logger.info("History service recording %s room(s)", len(self.rooms))
+        self.mqtt.loop_forever()
+
+    def subscribe_room(self, room_id: str) -> None:
+        self.mqtt.subscribe(
+            [(self._telemetry_template.format(room_id=room_id), 0)], self._handle_telemetry, model=TelemetryPack
+        )
+        self.mqtt.subscribe([(self._alert_template.format(room_id=room_id), 1)], self._handle_alert, model=AlertEvent)
+        for series, template in self._state_templates.items():
+            self.mqtt.subscribe(
+                [(template.format(room_id=room_id), 1)], self._state_handlers[series], model=ActuatorState
+            )
+
+    def unsubscribe_room(self, room_id: str) -> None:
+        self.mqtt.unsubscribe([self._telemetry_template.format(room_id=room_id)], self._handle_telemetry)
+        self.mqtt.unsubscribe([self._alert_template.format(room_id=room_id)], self._handle_alert)
+        for series, template in self._state_templates.items():
+            self.mqtt.unsubscribe([template.format(room_id=room_id)], self._state_handlers[series])
+
+    def drop_room_state(self, room_id: str) -> None:
+        # History stays on disk; only the open segments are released.
+        self._store.drop_room(room_id)
+
+    def _handle_telemetry(self, topic: str, samples: list[TemperatureTelemetry]) -> None:
+        for telemetry in samples:
+            self._store.record_temperature(telemetry.room_id, telemetry.ts, telemetry.temp_c)
+
+    def _handle_alert(self, topic: str, alert: AlertEvent) -> None:
+        self._store.record_alert(alert.room_id, alert.ts, alert.type, alert.level, alert.temp_c)
+
+    def _state_handler(self, series: str):
+        def handle_state(topic: str, state: ActuatorState) -> None:
+            self._store.record_state(state.room_id, series, state.ts, state.state)
+
+        return handle_state
+
+    def _maintain(self, flush_interval_s: float, purge_interval_s: float) -> None:
+        next_purge = 0.0
+        while True:
+            time.sleep(flush_interval_s)
+            self._store.flush()
+            if time.monotonic() >= next_purge:
+                removed = self._store.purge(int(time.time()))
+                if removed:
+                    self._logger.info("Retention removed %s segment(s)", removed)
+                next_purge = time.monotonic() + purge_interval_s
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    service = HistoryService(home_catalog_url=get_home_catalog_url())
+    service.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,172 @@
 from __future__ import annotations
 
 import logging
+import threading
 import time
-from collections import deque
-from typing import Deque
 
-from common.models import TemperatureTelemetry
+from common.aggregates import WindowAggregator
+from common.models import TelemetryPack, TemperatureTelemetry
 from common.runtime import get_home_catalog_url
 from common.service_base import ServiceBase
+from common.tracing import add_hop
+from common.windows import ClosedWindow, EventTimeWindower
+
+EVENT_TIME_AGGREGATES = ("mean", "min", "max", "variance", "stddev")
 
 
 class TimeShiftProcessor(ServiceBase):
     def __init__(self, home_catalog_url: str) -> None:
         super().__init__("postprocess_time_shift", home_catalog_url)
         self._logger = logging.getLogger("postprocess_time_shift")
-        self._window: dict[str, Deque[float]] = {}
+        self._window: dict[str, WindowAggregator] = {}
+        self._event_windows: EventTimeWindower | None = None
+        self._window_size = 0
+        self._emit = "mean"
+        self._aggregates: list[str] = []
+        self._ewma_alpha = 0.3
+        self._input_template = ""
+        self._output_template = ""
+        self._pack_output = False
 
     def start(self) -> None:
         self.load_config()
         self.connect_mqtt()
         self.mqtt.loop_start()
 
-        window_size = self.service_config["window_size"]
-        input_template = self.service_config["input_topic_template"]
-        output_template = self.service_config["output_topic_template"]
-        rooms = self.service_config["rooms"]
-
-        def handle_message(topic: str, payload: dict) -> None:
-            try:
-                telemetry = TemperatureTelemetry.from_dict(payload)
-            except ValueError as exc:
-                self._logger.warning("%s", exc)
-                return
-            window = self._window.setdefault(telemetry.room_id, deque(maxlen=window_size))
-            window.append(float(telemetry.temp_c))
-            avg_temp = sum(window) / len(window)
-            processed = TemperatureTelemetry(
-                bn=telemetry.bn,
-                ts=int(time.time()),
-                room_id=telemetry.room_id,
-                temp_c=round(avg_temp, 2),
-            ).to_dict()
-            output_topic = output_template.format(room_id=telemetry.room_id)
-            self.mqtt.publish_json(output_topic, processed)
-
-        input_topics = [(input_template.format(room_id=room_id), 0) for room_id in rooms]
-        self.mqtt.subscribe(input_topics, handle_message)
-        self._logger.info("Processing %s -> %s", input_template, output_template)
+        self._window_size = self.service_config["window_size"]
+        self._emit = self.service_config.get("emit", "mean")
+        self._aggregates = list(dict.fromkeys([self._emit, *self.service_config.get("aggregates", [])]))
+        self._ewma_alpha = self.service_config.get("ewma_alpha", 0.3)
+        self._input_template = self.service_config["input_topic_template"]
+        self._output_template = self.service_config["output_topic_template"]
+        self._pack_output = self.service_config.get("pack_output", False)
+
+        event_cfg = self.service_config.get("event_time", {})
+        if event_cfg.get("enabled"):
+            self._start_event_time(event_cfg)
+
+        self.start_rooms(self.service_config["rooms"])
+        self._logger.info("Processing %s -> %s", self._input_template, self._output_template)
         self.mqtt.loop_forever()
 
+    def subscribe_room(self, room_id: str) -> None:
+        topic = self._input_template.format(room_id=room_id)
+        # Packs and single samples both arrive as a list of samples.
+        self.mqtt.subscribe([(topic, 0)], self._handle_message, model=TelemetryPack)
+
+    def unsubscribe_room(self, room_id: str) -> None:
+        self.mqtt.unsubscribe([self._input_template.format(room_id=room_id)], self._handle_message)
+
+    def export_room_state(self, room_id: str) -> dict | None:
+        if self._event_windows is not None:
+            return self._event_windows.export_room(room_id)
+        window = self._window.get(room_id)
+        return None if window is None else window.export_state()
+
+    def import_room_state(self, room_id: str, state: dict) -> None:
+        if self._event_windows is not None:
+            self._event_windows.import_room(room_id, state, time.monotonic())
+            return
+        window = self._new_window()
+        window.restore_state(state)
+        self._window[room_id] = window
+
+    def drop_room_state(self, room_id: str) -> None:
+        self._window.pop(room_id, None)
+        if self._event_windows is not None:
+            self._event_windows.drop_room(room_id)
+
+    def _new_window(self) -> WindowAggregator:
+        return WindowAggregator(self._window_size, self._aggregates, self._ewma_alpha)
+
+    def _handle_message(self, topic: str, samples: list[TemperatureTelemetry]) -> None:
+        room_id = samples[0].room_id
+        if self._event_windows is not None:
+            closed_windows = [
+                closed
+                for telemetry in samples
+                for closed in self._event_windows.add(
+                    telemetry.room_id, telemetry.ts, telemetry.temp_c, telemetry.bn, time.monotonic()
+                )
+            ]
+            # Marked after the update, so a checkpoint in between cannot clear the mark early.
+            self.mark_room_dirty(room_id)
+            for closed in closed_windows:
+                self._publish_window(closed)
+            return
+        window = self._window.get(room_id)
+        if window is None:
+            window = self._window[room_id] = self._new_window()
+        now = int(time.time())
+        processed = []
+        for telemetry in samples:
+            result = window.update(telemetry.temp_c)
+            processed.append(
+                (
+                    TemperatureTelemetry(
+                        bn=telemetry.bn,
+                        ts=now,
+                        room_id=room_id,
+                        temp_c=round(result[self._emit], 2),
+                        trace=None if telemetry.trace is None else add_hop(telemetry.trace, self.service_name),
+                    ),
+                    result,
+                )
+            )
+        self.mark_room_dirty(room_id)
+        output_topic = self._output_template.format(room_id=room_id)
+        if self._pack_output and len(processed) > 1 and len(self._aggregates) == 1:
+            # One pack in, one pack out (packs have no room for extra aggregates).
+            self.mqtt.publish_json(output_topic, TemperatureTelemetry.to_pack([sample for sample, _ in processed]))
+            return
+        for sample, result in processed:
+            payload = sample.to_dict()
+            if len(self._aggregates) > 1:
+                payload["aggregates"] = {name: round(value, 3) for name, value in result.items()}
+            self.mqtt.publish_json(output_topic, payload)
+
+    def _start_event_time(self, event_cfg: dict) -> None:
+        """Switch to event-time windows: one aggregate per window and room, stamped with the window end."""
+        unsupported = [name for name in self._aggregates if name not in EVENT_TIME_AGGREGATES]
+        if self._emit in unsupported:
+            raise ValueError(f"emit={self._emit} is not available in event-time mode")
+        if unsupported:
+            self._logger.warning("Ignoring aggregates not supported in event-time mode: %s", unsupported)
+        self._aggregates = [name for name in self._aggregates if name in EVENT_TIME_AGGREGATES]
+        window_s = event_cfg["window_s"]
+        allowed_lateness_s = event_cfg.get("allowed_lateness_s", 0)
+        idle_flush_s = event_cfg.get("idle_flush_s", window_s + allowed_lateness_s)
+        windows = EventTimeWindower(window_s, event_cfg.get("hop_s"), allowed_lateness_s)
+        self._event_windows = windows
+
+        def flush_idle_rooms() -> None:
+            # Rooms that stop reporting never advance their watermark; close
+            # their windows on wall-clock time instead.
+            while True:
+                time.sleep(max(idle_flush_s / 2, 0.5))
+                for closed in windows.flush_idle(time.monotonic(), idle_flush_s):
+                    self._publish_window(closed)
+
+        threading.Thread(target=flush_idle_rooms, name="event-time-flush", daemon=True).start()
+        self._logger.info(
+            "Event-time windows: window_s=%s hop_s=%s allowed_lateness_s=%s",
+            window_s,
+            windows.hop_s,
+            allowed_lateness_s,
+        )
+
+    def _publish_window(self, closed: ClosedWindow) -> None:
+        processed = TemperatureTelemetry(
+            bn=closed.bn,
+            ts=closed.end,
+            room_id=closed.room_id,
+            temp_c=round(closed.value(self._emit), 2),
+        ).to_dict()
+        processed["window"] = {"start": closed.start, "end": closed.end, "count": closed.count}
+        if len(self._aggregates) > 1:
+            processed["aggregates"] = {name: round(closed.value(name), 3) for name in self._aggregates}
+        self.mqtt.publish_json(self._output_template.format(room_id=closed.room_id), processed)
+
 
 def main() -> None:
     logging.basicConfig(level=logging.INFO)
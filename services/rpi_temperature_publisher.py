@@ -2,11 +2,93 @@ from __future__ import annotations
 
 import logging
 import random
+import threading
 import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import requests
 
 from common.models import TemperatureTelemetry
+from common.reporting import ExceptionReporter, ReportingConfig
 from common.runtime import get_home_catalog_url
 from common.service_base import ServiceBase
+from common.simulation import FleetSimulator, SimulationConfig
+from common.tracing import TraceConfig, start_trace
+
+
+@dataclass
+class PackConfig:
+    enabled: bool = False
+    # A room's pack is sent once it holds max_samples or its oldest sample is max_delay_s old.
+    max_samples: int = 10
+    max_delay_s: float = 5.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Dict[str, Any]]) -> "PackConfig":
+        config = cls(**(payload or {}))
+        if config.max_samples < 1 or config.max_delay_s <= 0:
+            raise ValueError("Pack max_samples and max_delay_s must be positive")
+        return config
+
+
+class SenMLPacker:
+    """Buffers samples per topic and sends each topic's buffer as one SenML pack."""
+
+    def __init__(self, config: PackConfig, publish: Callable[[str, List[Dict[str, Any]]], None]) -> None:
+        self._config = config
+        self._publish = publish
+        self._buffers: Dict[str, List[TemperatureTelemetry]] = {}
+        self._opened: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.packs = 0
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._flush_periodically, name="senml-packer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Send whatever is buffered and stop the age-based flushing."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def add(self, topic: str, sample: TemperatureTelemetry) -> None:
+        with self._lock:
+            buffer = self._buffers.get(topic)
+            if buffer is None:
+                buffer = self._buffers[topic] = []
+                self._opened[topic] = time.monotonic()
+            buffer.append(sample)
+            if len(buffer) < self._config.max_samples:
+                return
+            del self._buffers[topic]
+            del self._opened[topic]
+        self._send(topic, buffer)
+
+    def flush(self, older_than_s: float = 0.0) -> None:
+        cutoff = time.monotonic() - older_than_s
+        with self._lock:
+            due = [topic for topic, opened in self._opened.items() if opened <= cutoff]
+            packs = [(topic, self._buffers.pop(topic)) for topic in due]
+            for topic in due:
+                del self._opened[topic]
+        for topic, buffer in packs:
+            self._send(topic, buffer)
+
+    def _send(self, topic: str, samples: List[TemperatureTelemetry]) -> None:
+        self._publish(topic, TemperatureTelemetry.to_pack(samples))
+        self.packs += 1
+
+    def _flush_periodically(self) -> None:
+        interval_s = self._config.max_delay_s / 4
+        while not self._stopping.wait(interval_s):
+            self.flush(self._config.max_delay_s)
 
 
 class TemperaturePublisher(ServiceBase):
@@ -18,25 +100,162 @@ class TemperaturePublisher(ServiceBase):
         self.load_config()
         self.connect_mqtt()
         self.mqtt.loop_start()
+        # No rooms to start: a config refreshed from the catalog applies from here on.
+        self.mark_started()
 
         topic_template = self.service_config["topic_template"]
+        simulation = SimulationConfig.from_dict(self.service_config.get("simulation"))
+        if simulation.enabled:
+            self.run_fleet(FleetSimulator(simulation), topic_template)
+            return
         sampling_s = self.service_config["sampling_s"]
         room_id = self.service_config["room_id"]
         device_id = self.service_config["device_id"]
+        tracing = TraceConfig.from_dict(self.service_config.get("tracing"))
+        packer = self._start_packer()
+        reporter = self._start_reporter([device_id], [room_id], [0], sampling_s)
+        device = np.zeros(1, dtype=np.intp)
 
         topic = topic_template.format(room_id=room_id)
         self._logger.info("Publishing temperature telemetry to %s", topic)
         while True:
             now = int(time.time())
             temp_c = round(random.uniform(23.5, 27.5), 2)
-            payload = TemperatureTelemetry(
+            if reporter is not None and not reporter.report(device, np.array([temp_c]), time.monotonic())[0]:
+                time.sleep(reporter.intervals[0])
+                continue
+            sample = TemperatureTelemetry(
                 bn=device_id,
                 ts=now,
                 room_id=room_id,
                 temp_c=temp_c,
-            ).to_dict()
-            self.mqtt.publish_json(topic, payload)
-            time.sleep(sampling_s)
+                trace=start_trace(self.service_name) if tracing.sample() else None,
+            )
+            if packer is not None:
+                packer.add(topic, sample)
+            else:
+                self.mqtt.publish_json(topic, sample.to_dict())
+            time.sleep(sampling_s if reporter is None else reporter.intervals[0])
+
+    def _start_packer(self) -> SenMLPacker | None:
+        config = PackConfig.from_dict(self.service_config.get("pack"))
+        if not config.enabled:
+            return None
+        packer = SenMLPacker(config, self.mqtt.publish_json)
+        packer.start()
+        self._logger.info(
+            "Sending SenML packs of up to %s sample(s), at most %ss old", config.max_samples, config.max_delay_s
+        )
+        return packer
+
+    def _start_reporter(
+        self, device_ids: Sequence[str], room_ids: Sequence[str], device_rooms: Sequence[int], base_interval_s: float
+    ) -> ExceptionReporter | None:
+        """Report-by-exception state for the given devices, or None when it is disabled."""
+        config = ReportingConfig.from_dict(self.service_config.get("report_by_exception"))
+        if not config.enabled:
+            return None
+        thresholds = self._high_thresholds(config, room_ids)
+        reporter = ExceptionReporter(
+            [config.rule_for(device_id) for device_id in device_ids],
+            base_interval_s,
+            [thresholds[room] for room in device_rooms],
+        )
+        self.mqtt.metrics.gauge("publisher_suppression_ratio", reporter.suppression_ratio)
+        self._logger.info(
+            "Reporting by exception: deadband %s C, heartbeat every %ss, adaptive sampling %s",
+            config.default.deadband_c,
+            config.default.max_silence_s,
+            "on" if config.default.adaptive else "off",
+        )
+        return reporter
+
+    def _high_thresholds(self, config: ReportingConfig, room_ids: Sequence[str]) -> List[float]:
+        """High alert threshold per room: the configured one, else the alert strategy's rules."""
+        if config.high_threshold is not None:
+            return [float(config.high_threshold)] * len(room_ids)
+        try:
+            alert_config = self.home_catalog.get_service_config("alert_strategy")
+        except requests.RequestException as exc:
+            self._logger.warning("Alert thresholds unavailable (%s); adaptive sampling only backs off", exc)
+            return [float("nan")] * len(room_ids)
+        default = alert_config.get("high_threshold", float("nan"))
+        room_rules = alert_config.get("room_rules", {})
+        return [float(room_rules.get(room_id, {}).get("high_threshold", default)) for room_id in room_ids]
+
+    def run_fleet(
+        self,
+        fleet: FleetSimulator,
+        topic_template: str,
+        duration_s: float | None = None,
+        on_tick: Callable[[float], None] | None = None,
+    ) -> int:
+        """Sample every simulated device once per tick; returns the number of samples sent.
+
+        With ``report_by_exception`` enabled only due devices whose reading
+        left the deadband (or whose heartbeat expired) are published.
+
+        ``on_tick`` receives the ``time.perf_counter()`` of each tick before
+        its samples go out (the load benchmark uses it as the send time).
+        """
+        topics = [topic_template.format(room_id=room_id) for room_id in fleet.room_ids]
+        device_rooms = fleet.device_rooms.tolist()
+        interval_s = fleet.interval_s
+        tracing = TraceConfig.from_dict(self.service_config.get("tracing"))
+        packer = self._start_packer()
+        reporter = self._start_reporter(fleet.device_ids, fleet.room_ids, device_rooms, interval_s)
+        if reporter is not None:
+            # Devices sampling faster than the fleet rate need a faster tick.
+            interval_s = min(interval_s, reporter.fastest_interval_s)
+        self._logger.info(
+            "Simulating %s room(s) x %s device(s) at %s Hz",
+            fleet.config.rooms,
+            fleet.config.devices_per_room,
+            fleet.config.rate_hz,
+        )
+        sent = 0
+        start = time.monotonic()
+        next_tick = start
+        while duration_s is None or next_tick - start < duration_s:
+            # Traces of one tick share its sampling time as their origin.
+            origin_ns = time.time_ns()
+            now = origin_ns / 1e9
+            ts = int(now)
+            if on_tick is not None:
+                on_tick(time.perf_counter())
+            temps = fleet.sample(now)
+            if reporter is None:
+                devices = range(len(device_rooms))
+            else:
+                due = reporter.due(now)
+                devices = due[reporter.report(due, temps[due], now)].tolist()
+            temps = temps.tolist()
+            for device in devices:
+                room = device_rooms[device]
+                sample = TemperatureTelemetry(
+                    bn=fleet.device_ids[device],
+                    ts=ts,
+                    room_id=fleet.room_ids[room],
+                    temp_c=temps[device],
+                    trace=start_trace(self.service_name, origin_ns) if tracing.sample() else None,
+                )
+                if packer is not None:
+                    packer.add(topics[room], sample)
+                else:
+                    self.mqtt.publish_json(topics[room], sample.to_dict())
+            sent += len(devices)
+            # Fixed-rate schedule: a slow tick shortens the next sleep instead of drifting.
+            next_tick += interval_s
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+        if packer is not None:
+            packer.stop()
+        if reporter is not None:
+            self._logger.info("Suppressed %.1f%% of %s reading(s)", reporter.suppression_ratio() * 100, reporter.sampled)
+        return sent
 
 
 def main() -> None:
@@ -0,0 +1,138 @@
+"""Run several services in one process on one broker connection.
+
+    python -m services.runner postprocess_time_shift alert_strategy arduino_indicator
+
+Every hosted service keeps its own catalog entry, client id and status topic,
+but they share one catalog client and one MQTT connection (``common/bridge.py``),
+and messages between them never leave the process.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import inspect
+import logging
+import os
+import signal
+import threading
+from typing import Callable, Dict, List
+
+from common.bridge import MqttBridge
+from common.config_client import HomeCatalogClient
+from common.mqtt_client import MqttConfig
+from common.runtime import get_catalog_cache_dir, get_home_catalog_url, get_service_replica
+from common.service_base import ServiceBase
+from common.transport import TRANSPORT_LOOPBACK, LoopbackBroker, LoopbackTransport
+
+# Catalog service name -> "module:Class"; modules are only imported when hosted.
+SERVICE_CLASSES = {
+    "rpi_temperature_publisher": "services.rpi_temperature_publisher:TemperaturePublisher",
+    "postprocess_time_shift": "services.postprocess_time_shift:TimeShiftProcessor",
+    "alert_strategy": "services.alert_strategy:AlertStrategy",
+    "arduino_indicator": "services.arduino_indicator:ArduinoIndicator",
+    "hvac_connector": "services.hvac_connector:HvacConnector",
+    "actuator_gateway": "services.actuator_gateway:ActuatorGateway",
+    "telegram_bot": "services.telegram_bot_service:TelegramBotService",
+    "thingspeak_adapter": "services.thingspeak_adapter:ThingSpeakAdapter",
+    "history": "services.history_service:HistoryService",
+    "dashboard_consumer": "services.dashboard_consumer:DashboardConsumer",
+}
+
+
+def load_service_class(name: str) -> type:
+    try:
+        module_name, class_name = SERVICE_CLASSES[name].split(":")
+    except KeyError:
+        raise ValueError(f"Unknown service: {name} (expected one of {sorted(SERVICE_CLASSES)})") from None
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class ServiceRunner:
+    def __init__(self, home_catalog_url: str, service_names: List[str], client_id: str = "service-runner") -> None:
+        if not service_names:
+            raise ValueError("No services to run")
+        self._logger = logging.getLogger("runner")
+        self._home_catalog_url = home_catalog_url
+        self._service_names = list(dict.fromkeys(service_names))
+        self._client_id = client_id
+        self.home_catalog = HomeCatalogClient(home_catalog_url, cache_dir=get_catalog_cache_dir())
+        self.broker = LoopbackBroker()
+        self.bridge: MqttBridge | None = None
+        self.services: Dict[str, ServiceBase] = {}
+        # Client id -> hosted service name (partitioned services add a replica suffix).
+        self._clients: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        service_classes = [load_service_class(name) for name in self._service_names]
+        # Broker settings come with any hosted service's bootstrap (cached copies included).
+        bootstrap, _ = self.home_catalog.bootstrap(self._service_names[0], get_service_replica())
+        mqtt_config = MqttConfig(**bootstrap["mqtt"])
+        if mqtt_config.transport == TRANSPORT_LOOPBACK:
+            # Everything is in-process already; share the process-wide broker.
+            self.broker = LoopbackBroker.default()
+        else:
+            self.bridge = MqttBridge(self._client_id, mqtt_config, self.broker)
+            self.bridge.start()
+        for name, service_cls in zip(self._service_names, service_classes):
+            service = service_cls(self._home_catalog_url)
+            service.home_catalog = self.home_catalog
+            service.transport_factory = self._transport_factory(name)
+            self.services[name] = service
+            threading.Thread(target=self._run, args=(service,), name=f"service-{name}", daemon=True).start()
+        self._logger.info("Hosting %s on one connection", ", ".join(self._service_names))
+
+    def stop(self) -> None:
+        # A hosted service going away looks like a lost connection: its will marks it OFFLINE.
+        with self._lock:
+            client_ids = list(self._clients)
+        for client_id in client_ids:
+            self.broker.drop_client(client_id)
+        if self.bridge is not None:
+            self.bridge.stop()
+
+    def _transport_factory(self, name: str) -> Callable[[str], LoopbackTransport]:
+        def create(client_id: str) -> LoopbackTransport:
+            with self._lock:
+                self._clients[client_id] = name
+            return LoopbackTransport(client_id, self.broker)
+
+        return create
+
+    def _run(self, service: ServiceBase) -> None:
+        try:
+            if inspect.iscoroutinefunction(service.start):
+                # Asyncio services (the Telegram bot) get an event loop of their own in this thread.
+                asyncio.run(service.start())
+            else:
+                service.start()
+        except Exception:
+            self._logger.exception("Service %s failed", service.service_name)
+            with self._lock:
+                client_ids = [client_id for client_id, name in self._clients.items() if name == service.service_name]
+            for client_id in client_ids:
+                self.broker.drop_client(client_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("services", nargs="*", help=f"catalog service names: {', '.join(SERVICE_CLASSES)}")
+    parser.add_argument("--client-id", default=os.getenv("RUNNER_CLIENT_ID", "service-runner"))
+    args = parser.parse_args()
+    service_names = args.services or [name for name in os.getenv("RUNNER_SERVICES", "").split(",") if name]
+    logging.basicConfig(level=logging.INFO)
+    runner = ServiceRunner(get_home_catalog_url(), service_names, client_id=args.client_id)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    runner.start()
+    try:
+        stopping.wait()
+    except KeyboardInterrupt:
+        pass
+    runner.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,41 +10,49 @@ from typing import Optional
 from telegram import Bot, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+from common.alert_delivery import AlertDelivery, DeliveryConfig
+from common.mqtt_client import AsyncMqttServiceClient, MessageStream
 from common.runtime import get_home_catalog_url
 from common.service_base import ServiceBase
 
+# Seconds a manual HVAC command waits for the broker's acknowledgement before replying.
+HVAC_ACK_TIMEOUT_S = 5.0
+
 
 class TelegramBotService(ServiceBase):
+    # MQTT runs on the bot's event loop: no network thread, no per-message hop.
+    mqtt_client_class = AsyncMqttServiceClient
+
     def __init__(self, home_catalog_url: str) -> None:
         super().__init__("telegram_bot", home_catalog_url)
         self._logger = logging.getLogger("telegram_bot")
-        self._chat_id: Optional[str] = None
+        self._chat_ids: list[str] = []
         self._hvac_state: dict[str, str] = {}
-        self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._bot: Optional[Bot] = None
+        self._delivery: Optional[AlertDelivery] = None
+        self._alert_task: Optional[asyncio.Task] = None
 
     async def start(self) -> None:
         self.load_config()
-        self.connect_mqtt()
-        self.mqtt.loop_start()
-        self._loop = asyncio.get_running_loop()
+        await self.mqtt.connect()
+        # No rooms to start: a config refreshed from the catalog applies from here on.
+        self.mark_started()
 
         cfg = self.service_config
-        self._chat_id = cfg["chat_id"]
+        # Alerts go to every configured chat; placeholders are skipped.
+        self._chat_ids = [
+            chat_id for chat_id in cfg.get("chat_ids") or [cfg["chat_id"]] if chat_id and chat_id != "REPLACE_ME"
+        ]
         alert_template = cfg["alert_topic_template"]
         hvac_command_template = cfg["hvac_command_topic_template"]
         status_template = cfg["status_topic_template"]
         rooms = cfg["rooms"]
 
-        def handle_alerts(topic: str, payload: dict) -> None:
-            if not self._chat_id or self._chat_id == "REPLACE_ME":
-                return
-            message = (
-                f"Alert {payload.get('type')} in {payload.get('room_id')}: "
-                f"{payload.get('temp_c')}°C (level {payload.get('level')})"
-            )
-            if self._loop:
-                self._loop.call_soon_threadsafe(asyncio.create_task, self._send_message(message))
+        delivery = self._delivery = AlertDelivery(DeliveryConfig.from_dict(cfg.get("delivery")), self._send_message)
+        delivery.start()
+        metrics = self.mqtt.metrics
+        for counter in ("queue_depth", "dropped", "delivered", "failed", "rate_limited"):
+            metrics.gauge(f"alert_delivery_{counter}", lambda counter=counter: delivery.stats()[counter])
 
         def handle_hvac_state(topic: str, payload: dict) -> None:
             room_id = payload.get("room_id", "unknown")
@@ -54,11 +62,8 @@ class TelegramBotService(ServiceBase):
 
         alert_topics = [(alert_template.format(room_id=room_id), 0) for room_id in rooms]
         status_topics = [(status_template.format(room_id=room_id), 1) for room_id in rooms]
-        topic_names = {topic for topic, _ in alert_topics}
-        self.mqtt.subscribe(
-            alert_topics + status_topics,
-            lambda t, p: handle_alerts(t, p) if t in topic_names else handle_hvac_state(t, p),
-        )
+        self._alert_task = asyncio.create_task(self._forward_alerts(self.mqtt.messages(alert_topics)))
+        self.mqtt.subscribe(status_topics, handle_hvac_state)
 
         app = Application.builder().token(cfg["bot_token"]).build()
         self._bot = app.bot
@@ -72,13 +77,17 @@ class TelegramBotService(ServiceBase):
         await app.updater.start_polling()
         await app.updater.idle()
 
-    async def _send_message(self, text: str) -> None:
-        if not self._chat_id or self._chat_id == "REPLACE_ME" or not self._bot:
-            return
-        try:
-            await self._bot.send_message(chat_id=self._chat_id, text=text)
-        except Exception as exc:  # pragma: no cover - best-effort alerting
-            self._logger.warning("Failed to send Telegram message: %s", exc)
+    async def _forward_alerts(self, alerts: MessageStream) -> None:
+        async with alerts:
+            async for _, payload in alerts:
+                for chat_id in self._chat_ids:
+                    self._delivery.offer(chat_id, payload)
+
+    async def _send_message(self, chat_id: str, text: str) -> None:
+        # Failures propagate: the delivery pipeline retries them (and waits out 429s).
+        if self._bot is None:
+            raise RuntimeError("Telegram bot not initialized")
+        await self._bot.send_message(chat_id=chat_id, text=text)
 
     def _make_hvac_cmd(self, topic_template: str, state: str):
         async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -91,7 +100,11 @@ class TelegramBotService(ServiceBase):
                 return
             payload = {"state": state, "ts": int(time.time()), "room_id": room_id}
             topic = topic_template.format(room_id=room_id)
-            self.mqtt.publish_json(topic, payload, qos=1)
+            try:
+                await asyncio.wait_for(self.mqtt.publish(topic, payload, qos=1), HVAC_ACK_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                await update.message.reply_text(f"HVAC command for room {room_id} not acknowledged by the broker yet")
+                return
             await update.message.reply_text(f"HVAC command sent: {state} for room {room_id}")
 
         return handler
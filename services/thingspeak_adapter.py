@@ -1,49 +1,234 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import requests
 
+from common.models import TemperatureTelemetry
 from common.runtime import get_home_catalog_url
 from common.service_base import ServiceBase
 
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+@dataclass
+class UploaderConfig:
+    queue_size: int = 1000
+    flush_size: int = 100
+    flush_interval_s: float = 15.0
+    max_retries: int = 3
+    backoff_s: float = 1.0
+    max_backoff_s: float = 30.0
+    drop_policy: str = DROP_OLDEST
+    timeout_s: float = 10.0
+
+    @classmethod
+    def from_dict(cls, payload: Optional[Dict[str, Any]]) -> "UploaderConfig":
+        config = cls(**(payload or {}))
+        if config.drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop_policy: {config.drop_policy}")
+        return config
+
+
+@dataclass(frozen=True)
+class Channel:
+    """ThingSpeak channel an update is written to."""
+
+    channel_id: Optional[str]
+    api_key: str
+
+
+class ThingSpeakUploader:
+    """Bounded queue plus background sender for ThingSpeak uploads.
+
+    Updates are grouped per channel and written with the bulk-update endpoint
+    over a single pooled ``requests.Session``. Channels without a
+    ``channel_id`` fall back to one ``update.json`` request per message.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bulk_endpoint_template: str,
+        config: UploaderConfig,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        self._logger = logging.getLogger("thingspeak_adapter.uploader")
+        self._endpoint = endpoint
+        self._bulk_endpoint_template = bulk_endpoint_template
+        self._config = config
+        self._session = session or requests.Session()
+        self._queue: Deque[Tuple[Channel, Dict[str, Any]]] = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"queued": 0, "sent": 0, "dropped": 0, "retried": 0, "failed": 0}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="thingspeak-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Flush whatever is queued and stop the sender thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, channel: Channel, update: Dict[str, Any]) -> bool:
+        """Queue an update without blocking; returns False when it was dropped."""
+        with self._cond:
+            if len(self._queue) >= self._config.queue_size:
+                self._counters["dropped"] += 1
+                if self._config.drop_policy == DROP_NEWEST:
+                    return False
+                self._queue.popleft()
+            self._queue.append((channel, update))
+            self._counters["queued"] += 1
+            if len(self._queue) >= self._config.flush_size:
+                self._cond.notify()
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            counters = dict(self._counters)
+            counters["queue_depth"] = len(self._queue)
+        return counters
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self._config.flush_interval_s
+                while not self._stopping and len(self._queue) < self._config.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self._config.flush_size))]
+                stopping = self._stopping and not self._queue
+            if batch:
+                self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch: List[Tuple[Channel, Dict[str, Any]]]) -> None:
+        # Coalesce per channel so each channel costs one request per flush.
+        grouped: Dict[Channel, List[Dict[str, Any]]] = {}
+        for channel, update in batch:
+            grouped.setdefault(channel, []).append(update)
+        for channel, updates in grouped.items():
+            if channel.channel_id:
+                url = self._bulk_endpoint_template.format(channel_id=channel.channel_id)
+                body = {"write_api_key": channel.api_key, "updates": updates}
+                self._send(url, body, len(updates))
+            else:
+                for update in updates:
+                    self._send(self._endpoint, {"api_key": channel.api_key, **update}, 1)
+
+    def _send(self, url: str, body: Dict[str, Any], count: int) -> None:
+        attempt = 0
+        while True:
+            try:
+                response = self._session.post(url, json=body, timeout=self._config.timeout_s)
+                response.raise_for_status()
+            except requests.RequestException as exc:
+                status = exc.response.status_code if exc.response is not None else None
+                if status is not None and status < 500 and status != 429:
+                    # A bad API key or channel id will not fix itself; retrying only delays the queue.
+                    self._logger.warning("ThingSpeak rejected %s update(s) (HTTP %s); dropping them", count, status)
+                    with self._cond:
+                        self._counters["failed"] += count
+                    return
+                if attempt >= self._config.max_retries:
+                    self._logger.warning("ThingSpeak upload failed after %s attempts: %s", attempt + 1, exc)
+                    with self._cond:
+                        self._counters["failed"] += count
+                    return
+                delay = min(self._config.backoff_s * (2 ** attempt), self._config.max_backoff_s)
+                attempt += 1
+                with self._cond:
+                    self._counters["retried"] += count
+                self._logger.info("ThingSpeak upload failed (%s); retry %s in %.1fs", exc, attempt, delay)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            with self._cond:
+                self._counters["sent"] += count
+            self._logger.debug("Uploaded %s update(s) to %s", count, url)
+            return
+
 
 class ThingSpeakAdapter(ServiceBase):
     def __init__(self, home_catalog_url: str) -> None:
         super().__init__("thingspeak_adapter", home_catalog_url)
         self._logger = logging.getLogger("thingspeak_adapter")
+        self._uploader: Optional[ThingSpeakUploader] = None
 
     def start(self) -> None:
         self.load_config()
         self.connect_mqtt()
         self.mqtt.loop_start()
+        # No rooms to start: a config refreshed from the catalog applies from here on.
+        self.mark_started()
 
         cfg = self.service_config
         topic_templates = cfg["topic_templates"]
-        endpoint = cfg["endpoint"]
-        api_key = cfg["api_key"]
         rooms = cfg["rooms"]
+        default_channel = Channel(cfg.get("channel_id"), cfg["api_key"])
+        room_channels = {
+            room_id: Channel(channel.get("channel_id"), channel.get("api_key", cfg["api_key"]))
+            for room_id, channel in cfg.get("room_channels", {}).items()
+        }
+        self._uploader = ThingSpeakUploader(
+            endpoint=cfg["endpoint"],
+            bulk_endpoint_template=cfg.get(
+                "bulk_endpoint_template",
+                "https://api.thingspeak.com/channels/{channel_id}/bulk_update.json",
+            ),
+            config=UploaderConfig.from_dict(cfg.get("uploader")),
+        )
+        self._uploader.start()
         topics = [template.format(room_id=room_id) for room_id in rooms for template in topic_templates]
         subscriptions = [(topic, 1 if topic.endswith("/state") else 0) for topic in topics]
 
-        def handle_message(topic: str, payload: dict) -> None:
-            data = self._format_payload(api_key, topic, payload)
-            if not data:
-                return
-            try:
-                response = requests.post(endpoint, json=data, timeout=10)
-                response.raise_for_status()
-                self._logger.info("Uploaded data to ThingSpeak for %s", topic)
-            except requests.RequestException as exc:
-                self._logger.warning("ThingSpeak upload failed: %s", exc)
+        def handle_message(topic: str, payload: dict | list) -> None:
+            # A SenML pack becomes one update per sample; the uploader sends them in bulk.
+            records = (
+                [sample.to_dict() for sample in TemperatureTelemetry.from_pack(payload)]
+                if isinstance(payload, list)
+                else [payload]
+            )
+            for record in records:
+                update = self._format_update(topic, record)
+                if not update:
+                    continue
+                channel = room_channels.get(record.get("room_id"), default_channel)
+                if not self._uploader.submit(channel, update):
+                    self._logger.warning("ThingSpeak queue full; dropped update for %s", topic)
 
         self.mqtt.subscribe(subscriptions, handle_message)
         self._logger.info("ThingSpeak adapter subscribed to %s", topics)
-        self.mqtt.loop_forever()
+        try:
+            self.mqtt.loop_forever()
+        finally:
+            self._uploader.stop(timeout=30)
 
-    def _format_payload(self, api_key: str, topic: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        data: Dict[str, Any] = {"api_key": api_key, "status": topic}
+    def _format_update(self, topic: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"status": topic}
+        ts = payload.get("ts")
+        if isinstance(ts, (int, float)):
+            data["created_at"] = datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
         if "temp_c" in payload:
             data["field1"] = payload["temp_c"]
         if "state" in payload:
@@ -0,0 +1,99 @@
+"""Throughput of the vectorized alert rule engine versus per-message Python.
+
+    python -m tools.bench_alert_rules [--rooms 20000] [--batch 1024] [--samples 500000] [--json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from common.alert_rules import AlertRuleEngine, RoomRule
+
+
+def _rules(rooms: int, rng: random.Random) -> List[RoomRule]:
+    rules = []
+    for _ in range(rooms):
+        high = rng.uniform(25.0, 28.0)
+        rules.append(
+            RoomRule(
+                high_threshold=high,
+                low_threshold=high - rng.uniform(1.0, 3.0),
+                cooldown_s=rng.choice((0, 30, 60)),
+                rate_threshold_c_per_s=rng.choice((0.0, 0.5)),
+                sustain_s=rng.choice((0, 10)),
+            )
+        )
+    return rules
+
+
+def bench_engine(rules: List[RoomRule], samples: int, batch: int, seed: int) -> Dict[str, Any]:
+    engine = AlertRuleEngine(capacity=len(rules))
+    for index, rule in enumerate(rules):
+        engine.set_rule(f"room-{index}", rule)
+    rng = np.random.default_rng(seed)
+    slots = rng.integers(0, len(rules), samples)
+    temps = rng.normal(25.5, 1.5, samples)
+    ts = 1_700_000_000 + np.arange(samples) // max(len(rules), 1)
+    transitions = 0
+    start = time.perf_counter()
+    for offset in range(0, samples, batch):
+        window = slice(offset, offset + batch)
+        transitions += len(engine.evaluate(slots[window], temps[window], ts[window], ts[window]))
+    elapsed = time.perf_counter() - start
+    return {"mode": f"vectorized(batch={batch})", "samples_per_s": round(samples / elapsed), "transitions": transitions}
+
+
+def bench_scalar(rules: List[RoomRule], samples: int, seed: int) -> Dict[str, Any]:
+    """The previous per-message logic (threshold, hysteresis, cooldown only)."""
+    rng = np.random.default_rng(seed)
+    slots = rng.integers(0, len(rules), samples).tolist()
+    temps = rng.normal(25.5, 1.5, samples).tolist()
+    in_alert = [False] * len(rules)
+    last_alert = [0] * len(rules)
+    transitions = 0
+    start = time.perf_counter()
+    for index, (slot, temp) in enumerate(zip(slots, temps)):
+        now = 1_700_000_000 + index // max(len(rules), 1)
+        rule = rules[slot]
+        if in_alert[slot]:
+            if temp <= rule.low_threshold:
+                in_alert[slot] = False
+                last_alert[slot] = now
+                transitions += 1
+        elif temp >= rule.high_threshold and now - last_alert[slot] >= rule.cooldown_s:
+            in_alert[slot] = True
+            last_alert[slot] = now
+            transitions += 1
+    elapsed = time.perf_counter() - start
+    return {"mode": "scalar", "samples_per_s": round(samples / elapsed), "transitions": transitions}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, default=20_000)
+    parser.add_argument("--samples", type=int, default=500_000)
+    parser.add_argument("--batch", type=int, action="append")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+    rules = _rules(args.rooms, random.Random(args.seed))
+    results = [bench_scalar(rules, args.samples, args.seed)]
+    for batch in args.batch or [64, 1024, 8192]:
+        results.append(bench_engine(rules, args.samples, batch, args.seed))
+    for row in results:
+        row["rooms"] = args.rooms
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for row in results:
+        print(f"{row['mode']:<26}{row['samples_per_s']:>12,} samples/s  transitions={row['transitions']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Compare the JSON and binary payload codecs: bytes on the wire and speed.
+
+    python -m tools.bench_codec [--iterations 100000] [--json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from common.models import (
+    ActuatorState,
+    AlertEvent,
+    BinaryCodec,
+    JsonCodec,
+    TemperatureTelemetry,
+    decode_payload,
+)
+
+SAMPLES: Dict[str, Dict[str, Any]] = {
+    "TemperatureTelemetry": TemperatureTelemetry(
+        bn="rpi-1", ts=1738000000, room_id="equip-1", temp_c=25.3
+    ).to_dict(),
+    "AlertEvent": AlertEvent(
+        ts=1738000005, room_id="equip-1", type="OVERHEAT", level="WARN", temp_c=26.1
+    ).to_dict(),
+    "ActuatorState": ActuatorState(
+        ts=1738000010, device="hvac-1", room_id="equip-1", state="ON"
+    ).to_dict(),
+}
+
+
+def _per_op_us(func: Callable[[], object], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run(iterations: int) -> List[Dict[str, Any]]:
+    results = []
+    for model, payload in SAMPLES.items():
+        for codec in (JsonCodec(), BinaryCodec()):
+            encoded = codec.encode(payload)
+            assert decode_payload(encoded) == payload
+            results.append(
+                {
+                    "model": model,
+                    "codec": codec.name,
+                    "bytes": len(encoded),
+                    "encode_us": round(_per_op_us(lambda: codec.encode(payload), iterations), 3),
+                    "decode_us": round(_per_op_us(lambda: decode_payload(encoded), iterations), 3),
+                }
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+    results = run(args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'model':<22}{'codec':<8}{'bytes':>7}{'encode_us':>11}{'decode_us':>11}")
+    for row in results:
+        print(
+            f"{row['model']:<22}{row['codec']:<8}{row['bytes']:>7}"
+            f"{row['encode_us']:>11.3f}{row['decode_us']:>11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
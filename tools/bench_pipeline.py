@@ -0,0 +1,293 @@
+"""End-to-end load benchmark: publisher fleet -> time shift -> alerts -> indicator.
+
+Runs the home catalog and the pipeline services in one process (no outside
+services), drives them with the fleet simulator and reports throughput and
+sensor-to-stage latency per stage:
+
+    python -m tools.bench_pipeline [--rooms 200] [--devices 2] [--rate-hz 2] [--duration 20]
+                                   [--transport loopback|mqtt] [--synchronous] [--pack 10] [--deadband 0.1]
+                                   [--out report.json]
+
+``--transport loopback`` (the default) connects the services through the
+in-process loopback broker, so the report shows the pipeline's own cost;
+``--synchronous`` additionally runs every hop inline in the publishing
+thread. ``--transport mqtt`` goes through sockets to the in-repo MQTT broker
+stand-in with the usual JSON encoding, which adds the wire cost. ``--pack N``
+makes the publisher send SenML packs of up to N samples per room, and the
+broker counters show the drop in message rate. ``--deadband C`` enables
+report-by-exception with adaptive sampling on the publisher; the report then
+shows how many readings were suppressed.
+
+Every sample is traced (``common/tracing.py``): latency is measured from the
+simulator tick that produced the sample to its arrival at each stage, and the
+trace hops give the time spent between consecutive services. Alerts and
+indicator messages carry the trace of the sample that triggered them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import uvicorn
+
+from common.mqtt_client import MqttConfig, MqttServiceClient
+from common.simulation import FleetSimulator, SimulationConfig
+from common.tracing import TraceCollector
+from common.transport import TRANSPORT_LOOPBACK, TRANSPORT_PAHO, LoopbackBroker
+from tools.mqtt_broker_stub import MqttBrokerStub
+
+CONFIG_PATH = Path(__file__).resolve().parents[1] / "config" / "home_catalog.json"
+RAW = "raw"
+PROCESSED = "processed"
+ALERT = "alert"
+INDICATOR_CMD = "indicator_cmd"
+INDICATOR_STATE = "indicator_state"
+STAGES = (RAW, PROCESSED, ALERT, INDICATOR_CMD, INDICATOR_STATE)
+OBSERVED_TOPICS = {
+    "iot/+/temperature/raw": RAW,
+    "iot/+/temperature/processed": PROCESSED,
+    "iot/+/alerts": ALERT,
+    "iot/+/indicator/cmd": INDICATOR_CMD,
+    "iot/+/indicator/state": INDICATOR_STATE,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(condition: Callable[[], bool], timeout_s: float, what: str) -> None:
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"timed out waiting for {what}")
+        time.sleep(0.05)
+
+
+def bench_config(
+    simulation: Dict[str, Any],
+    transport: str,
+    broker_port: int,
+    room_ids: List[str],
+    pack_samples: int = 0,
+    deadband_c: float = 0.0,
+) -> Dict[str, Any]:
+    """The shipped catalog config pointed at the local broker and the simulated rooms."""
+    config = json.loads(CONFIG_PATH.read_text(encoding="utf-8"))
+    config["mqtt"].update({"host": "127.0.0.1", "port": broker_port, "transport": transport})
+    services = config["services"]
+    services["rpi_temperature_publisher"]["simulation"] = dict(simulation, enabled=True)
+    services["rpi_temperature_publisher"]["tracing"] = {"enabled": True, "sample_rate": 1.0}
+    services["rpi_temperature_publisher"]["pack"] = {
+        "enabled": pack_samples > 1,
+        "max_samples": max(pack_samples, 1),
+        "max_delay_s": 1.0,
+    }
+    services["rpi_temperature_publisher"]["report_by_exception"] = {
+        "enabled": deadband_c > 0,
+        "deadband_c": deadband_c,
+        "max_silence_s": 10,
+        "adaptive": True,
+        "max_sampling_s": 4,
+    }
+    services["postprocess_time_shift"]["rooms"] = room_ids
+    services["postprocess_time_shift"]["pack_output"] = pack_samples > 1
+    services["alert_strategy"]["rooms"] = room_ids
+    services["arduino_indicator"]["room_id"] = room_ids[0]
+    return config
+
+
+class StageObserver:
+    """Subscribes to every stage with wildcards and records the traces that arrive."""
+
+    def __init__(self, mqtt_config: MqttConfig, capacity: int) -> None:
+        self.collector = TraceCollector(capacity)
+        self._client = MqttServiceClient("bench-observer", mqtt_config)
+        self._client.connect()
+        self._client.loop_start()
+        for topic_filter, stage in OBSERVED_TOPICS.items():
+            self._client.subscribe([(topic_filter, 1)], self._handler(stage))
+
+    def stop(self) -> None:
+        self._client.loop_stop()
+        self._client.disconnect()
+
+    def count(self, stage: str) -> int:
+        return self.collector.count(stage)
+
+    def _handler(self, stage: str) -> Callable[[str, Any], None]:
+        collector = self.collector
+
+        def observe(topic: str, payload: Any) -> None:
+            # SenML packs carry one trace per record.
+            for record in payload if isinstance(payload, list) else (payload,):
+                trace = record.get("trace") if isinstance(record, dict) else None
+                if trace is not None:
+                    collector.observe(stage, trace)
+
+        return observe
+
+
+def _stage_report(summary: Dict[str, Any], elapsed_s: float) -> Dict[str, Any]:
+    if not summary.get("count"):
+        return {"messages": 0}
+    return {
+        "messages": summary["count"],
+        "rate_per_s": round(summary["count"] / elapsed_s, 1),
+        "latency_ms": {"p50": summary["p50_ms"], "p99": summary["p99_ms"], "max": summary["max_ms"]},
+    }
+
+
+def run(
+    simulation: Dict[str, Any],
+    duration_s: float,
+    settle_s: float,
+    transport: str = TRANSPORT_LOOPBACK,
+    synchronous: bool = False,
+    pack_samples: int = 0,
+    deadband_c: float = 0.0,
+) -> Dict[str, Any]:
+    sim_config = SimulationConfig.from_dict(dict(simulation, enabled=True))
+    fleet = FleetSimulator(sim_config)
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    if transport == TRANSPORT_LOOPBACK:
+        broker: Any = LoopbackBroker(synchronous=synchronous)
+        LoopbackBroker.set_default(broker)
+        broker_port = 0
+    else:
+        broker = MqttBrokerStub().start()
+        broker_port = broker.port
+    config = bench_config(simulation, transport, broker_port, fleet.room_ids, pack_samples, deadband_c)
+    config_path = os.path.join(workdir, "home_catalog.json")
+    with open(config_path, "w", encoding="utf-8") as handle:
+        json.dump(config, handle)
+    os.environ["HOME_CATALOG_CONFIG"] = config_path
+    os.environ["HOME_CATALOG_STATE"] = os.path.join(workdir, "registry.json")
+    os.environ["HOME_CATALOG_CACHE_DIR"] = ""
+    catalog_port = _free_port()
+    catalog_url = f"http://127.0.0.1:{catalog_port}"
+
+    # Imported late: the catalog and services read their environment on import.
+    from home_catalog.app import app
+    from services.alert_strategy import AlertStrategy
+    from services.arduino_indicator import ArduinoIndicator
+    from services.postprocess_time_shift import TimeShiftProcessor
+    from services.rpi_temperature_publisher import TemperaturePublisher
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=catalog_port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-catalog", daemon=True).start()
+    _wait_for(lambda: server.started, 10, "the home catalog")
+
+    # Enough room to keep every raw sample of the run.
+    capacity = int(len(fleet.device_ids) * sim_config.rate_hz * (duration_s + 1)) + 1
+    observer = StageObserver(MqttConfig(**config["mqtt"]), capacity)
+    for service_cls in (TimeShiftProcessor, AlertStrategy, ArduinoIndicator):
+        threading.Thread(target=service_cls(catalog_url).start, name=service_cls.__name__, daemon=True).start()
+    # Two services per room plus the indicator and the observer's wildcards.
+    expected = 2 * len(fleet.room_ids) + 1 + len(OBSERVED_TOPICS)
+    _wait_for(lambda: broker.subscriptions >= expected, 60, "service subscriptions")
+
+    publisher = TemperaturePublisher(catalog_url)
+    publisher.load_config()
+    publisher.connect_mqtt()
+    publisher.mqtt.loop_start()
+    # The indicator room always overheats so the last stage is exercised.
+    fleet.start_episode(0, time.time())
+    start = time.perf_counter()
+    sent = publisher.run_fleet(fleet, publisher.service_config["topic_template"], duration_s=duration_s)
+    published_s = time.perf_counter() - start
+    # Let the pipeline drain: stop once processed output stops growing.
+    deadline = time.monotonic() + settle_s
+    previous = -1
+    while time.monotonic() < deadline and observer.count(PROCESSED) != previous:
+        previous = observer.count(PROCESSED)
+        time.sleep(0.5)
+    elapsed_s = time.perf_counter() - start
+    observer.stop()
+    publisher.mqtt.loop_stop()
+    server.should_exit = True
+    traces = observer.collector.report()
+
+    return {
+        "simulation": {
+            "rooms": sim_config.rooms,
+            "devices_per_room": sim_config.devices_per_room,
+            "rate_hz": sim_config.rate_hz,
+            "duration_s": duration_s,
+            "overheat": vars(sim_config.overheat),
+        },
+        "transport": transport,
+        "synchronous": synchronous,
+        "pack_samples": pack_samples,
+        "deadband_c": deadband_c,
+        "published": {
+            "samples": sent,
+            "suppression_ratio": publisher.mqtt.metrics.snapshot()["gauges"].get("publisher_suppression_ratio", 0.0),
+            "target_rate_per_s": round(len(fleet.device_ids) * sim_config.rate_hz, 1),
+            "rate_per_s": round(sent / published_s, 1),
+            "overheat_episodes": fleet.episodes_started,
+        },
+        "delivered_ratio": round(observer.count(PROCESSED) / sent, 4) if sent else None,
+        "stages": {stage: _stage_report(traces["end_to_end"].get(stage, {}), elapsed_s) for stage in STAGES},
+        "hops": traces["hops"],
+        "broker": {
+            "messages_in": broker.messages_in,
+            "messages_out": broker.messages_out,
+            "dropped": getattr(broker, "dropped", 0),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=2, help="devices per room")
+    parser.add_argument("--rate-hz", type=float, default=2.0, help="samples per device and second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--settle", type=float, default=10.0, help="max seconds to wait for the pipeline to drain")
+    parser.add_argument("--episodes-per-hour", type=float, default=120.0, help="overheat episodes per room and hour")
+    parser.add_argument("--peak-c", type=float, default=28.5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--transport",
+        choices=(TRANSPORT_LOOPBACK, "mqtt"),
+        default=TRANSPORT_LOOPBACK,
+        help="in-process loopback broker, or sockets to the MQTT broker stand-in",
+    )
+    parser.add_argument("--synchronous", action="store_true", help="loopback only: run every hop inline")
+    parser.add_argument("--pack", type=int, default=0, help="publish SenML packs of up to N samples per room")
+    parser.add_argument("--deadband", type=float, default=0.0, help="report by exception with this deadband in C")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    simulation = {
+        "rooms": args.rooms,
+        "devices_per_room": args.devices,
+        "rate_hz": args.rate_hz,
+        "seed": args.seed,
+        # Short episodes so several fit in one run.
+        "overheat": {"episodes_per_hour": args.episodes_per_hour, "peak_c": args.peak_c, "ramp_s": 2, "hold_s": 5},
+    }
+    transport = TRANSPORT_PAHO if args.transport == "mqtt" else TRANSPORT_LOOPBACK
+    report = json.dumps(
+        run(simulation, args.duration, args.settle, transport, args.synchronous, args.pack, args.deadband), indent=2
+    )
+    if args.out:
+        Path(args.out).write_text(report + "\n", encoding="utf-8")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
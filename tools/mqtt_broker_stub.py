@@ -0,0 +1,341 @@
+"""Minimal in-process MQTT 3.1.1 / 5 broker for local runs and benchmarks.
+
+Supports what the services use: CONNECT/CONNACK with last-will, PUBLISH at
+QoS 0/1 (QoS 2 is acknowledged and delivered as QoS 1), retained messages,
+SUBSCRIBE/UNSUBSCRIBE with ``+``/``#`` wildcards, PINGREQ and DISCONNECT.
+MQTT 5 clients may connect too; their properties are skipped, but the
+``noLocal``, ``retainAsPublished`` and retain-handling subscription options
+are honored (the multi-service runner's bridge relies on them). There is no
+persistence, authentication or redelivery of unacknowledged messages; it is
+a stand-in, not a broker to deploy:
+
+    python -m tools.mqtt_broker_stub --port 1883
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from common.topics import TopicRouter
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def _packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _string(value: bytes) -> bytes:
+    return struct.pack("!H", len(value)) + value
+
+
+def _skip_properties(body: bytes, offset: int) -> int:
+    """Offset just past an MQTT 5 property block (variable-byte length + properties)."""
+    length, multiplier = 0, 1
+    while True:
+        byte = body[offset]
+        offset += 1
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return offset + length
+
+
+class _Session:
+    __slots__ = ("client_id", "writer", "will", "filters", "next_id", "clean_exit", "v5")
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.client_id = ""
+        self.writer = writer
+        self.will: Optional[Tuple[str, bytes, int, bool]] = None
+        self.filters: Dict[str, int] = {}
+        self.next_id = 0
+        self.clean_exit = False
+        self.v5 = False
+
+    def packet_id(self) -> int:
+        self.next_id = self.next_id % 65535 + 1
+        return self.next_id
+
+
+class _Subscription:
+    __slots__ = ("session", "qos", "no_local", "retain_as_published")
+
+    def __init__(self, session: _Session, qos: int, no_local: bool = False, retain_as_published: bool = False) -> None:
+        self.session = session
+        self.qos = qos
+        self.no_local = no_local
+        self.retain_as_published = retain_as_published
+
+
+class MqttBrokerStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.messages_in = 0
+        self.messages_out = 0
+        self._router: TopicRouter[_Subscription] = TopicRouter()
+        self._retained: Dict[str, Tuple[bytes, int]] = {}
+        self._sessions: Dict[str, _Session] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._logger = logging.getLogger("mqtt_broker_stub")
+
+    @property
+    def subscriptions(self) -> int:
+        return len(self._router)
+
+    def start(self) -> "MqttBrokerStub":
+        self._thread = threading.Thread(target=self._run, name="mqtt-broker-stub", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> "MqttBrokerStub":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = _Session(writer)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+                if not self._dispatch(session, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._close(session)
+
+    def _dispatch(self, session: _Session, packet_type: int, flags: int, body: bytes) -> bool:
+        if packet_type == PUBLISH:
+            self._on_publish(session, flags, body)
+        elif packet_type == CONNECT:
+            self._on_connect(session, body)
+        elif packet_type == SUBSCRIBE:
+            self._on_subscribe(session, body)
+        elif packet_type == UNSUBSCRIBE:
+            self._on_unsubscribe(session, body)
+        elif packet_type == PINGREQ:
+            session.writer.write(_packet(PINGRESP, 0, b""))
+        elif packet_type == PUBREC:
+            session.writer.write(_packet(PUBREL, 2, body[:2]))
+        elif packet_type == PUBREL:
+            session.writer.write(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == DISCONNECT:
+            session.clean_exit = True
+            return False
+        return True
+
+    def _on_connect(self, session: _Session, body: bytes) -> None:
+        offset = 2 + struct.unpack_from("!H", body, 0)[0]  # protocol name
+        session.v5 = body[offset] == 5
+        flags = body[offset + 1]
+        offset += 4  # level, flags, keepalive
+        if session.v5:
+            offset = _skip_properties(body, offset)
+        client_id, offset = self._read_string(body, offset)
+        session.client_id = client_id.decode("utf-8")
+        if flags & 0x04:
+            if session.v5:
+                offset = _skip_properties(body, offset)
+            will_topic, offset = self._read_string(body, offset)
+            will_payload, offset = self._read_string(body, offset)
+            session.will = (will_topic.decode("utf-8"), will_payload, (flags >> 3) & 0x03, bool(flags & 0x20))
+        previous = self._sessions.get(session.client_id)
+        if previous is not None and previous is not session:
+            # Same client id: the new connection takes over, as on a real broker.
+            previous.clean_exit = True
+            previous.writer.close()
+        self._sessions[session.client_id] = session
+        session.writer.write(_packet(CONNACK, 0, b"\x00\x00\x00" if session.v5 else b"\x00\x00"))
+
+    def _on_publish(self, session: _Session, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        topic, offset = self._read_string(body, 0)
+        if qos:
+            packet_id = body[offset : offset + 2]
+            offset += 2
+            if qos == 1:
+                session.writer.write(_packet(PUBACK, 0, packet_id))
+            else:
+                session.writer.write(_packet(PUBREC, 0, packet_id))
+        if session.v5:
+            offset = _skip_properties(body, offset)
+        self.publish(topic.decode("utf-8"), body[offset:], min(qos, 1), bool(flags & 0x01), origin=session)
+
+    def publish(
+        self, topic: str, payload: bytes, qos: int = 0, retain: bool = False, origin: Optional[_Session] = None
+    ) -> None:
+        """Route a message to subscribers (must run on the broker loop)."""
+        self.messages_in += 1
+        if retain:
+            if payload:
+                self._retained[topic] = (payload, qos)
+            else:
+                self._retained.pop(topic, None)
+        delivered = set()
+        for subscription in self._router.match(topic):
+            # Overlapping filters of one client still deliver the message once.
+            if id(subscription.session) in delivered:
+                continue
+            if subscription.no_local and subscription.session is origin:
+                continue
+            delivered.add(id(subscription.session))
+            flag = retain and subscription.retain_as_published
+            self._send(subscription.session, topic, payload, min(qos, subscription.qos), flag)
+
+    def _on_subscribe(self, session: _Session, body: bytes) -> None:
+        packet_id = body[:2]
+        offset = _skip_properties(body, 2) if session.v5 else 2
+        granted = bytearray()
+        new_filters: List[str] = []
+        while offset < len(body):
+            topic_filter, offset = self._read_string(body, offset)
+            options = body[offset]
+            qos = min(options & 0x03, 1)
+            offset += 1
+            name = topic_filter.decode("utf-8")
+            existed = name in session.filters
+            subscription = _Subscription(session, qos)
+            if session.v5:
+                subscription.no_local = bool(options & 0x04)
+                subscription.retain_as_published = bool(options & 0x08)
+            try:
+                self._router.remove(name, lambda item: item.session is session)
+                self._router.add(name, subscription)
+            except ValueError:
+                granted.append(0x80)
+                continue
+            session.filters[name] = qos
+            granted.append(qos)
+            # Retain handling: 0 = always send retained, 1 = only for new subscriptions, 2 = never.
+            retain_handling = (options >> 4) & 0x03 if session.v5 else 0
+            if retain_handling == 0 or (retain_handling == 1 and not existed):
+                new_filters.append(name)
+        properties = b"\x00" if session.v5 else b""
+        session.writer.write(_packet(SUBACK, 0, packet_id + properties + bytes(granted)))
+        for name in new_filters:
+            matcher: TopicRouter[bool] = TopicRouter()
+            matcher.add(name, True)
+            for topic, (payload, qos) in list(self._retained.items()):
+                if matcher.match(topic):
+                    self._send(session, topic, payload, min(qos, session.filters[name]), True)
+
+    def _on_unsubscribe(self, session: _Session, body: bytes) -> None:
+        packet_id = body[:2]
+        offset = _skip_properties(body, 2) if session.v5 else 2
+        reasons = bytearray()
+        while offset < len(body):
+            topic_filter, offset = self._read_string(body, offset)
+            name = topic_filter.decode("utf-8")
+            self._router.remove(name, lambda item: item.session is session)
+            session.filters.pop(name, None)
+            reasons.append(0)
+        # MQTT 5 acknowledges with properties and one reason code per filter.
+        ack = packet_id + b"\x00" + bytes(reasons) if session.v5 else packet_id
+        session.writer.write(_packet(UNSUBACK, 0, ack))
+
+    def _send(self, session: _Session, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        if session.writer.is_closing():
+            return
+        body = _string(topic.encode("utf-8"))
+        if qos:
+            body += struct.pack("!H", session.packet_id())
+        if session.v5:
+            body += b"\x00"
+        session.writer.write(_packet(PUBLISH, (qos << 1) | int(retain), body + payload))
+        self.messages_out += 1
+
+    def _close(self, session: _Session) -> None:
+        for name in session.filters:
+            self._router.remove(name, lambda item: item.session is session)
+        session.filters.clear()
+        if self._sessions.get(session.client_id) is session:
+            del self._sessions[session.client_id]
+        if session.will is not None and not session.clean_exit:
+            topic, payload, qos, retain = session.will
+            self.publish(topic, payload, min(qos, 1), retain)
+        session.writer.close()
+
+    @staticmethod
+    def _read_string(body: bytes, offset: int) -> Tuple[bytes, int]:
+        (length,) = struct.unpack_from("!H", body, offset)
+        start = offset + 2
+        return body[start : start + length], start + length
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    broker = MqttBrokerStub(args.host, args.port).start()
+    logging.getLogger("mqtt_broker_stub").info("Listening on %s:%s", broker.host, broker.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
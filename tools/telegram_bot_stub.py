@@ -0,0 +1,154 @@
+"""Offline stand-in for the Telegram Bot API plus a delivery benchmark.
+
+``StubBot.send_message`` enforces per-chat and global flood limits the way
+Telegram does, refusing excess messages with ``RetryAfter`` (429), and
+records what it accepted. Running the module replays a heat event through
+``common.alert_delivery`` and reports delivered alerts, messages sent,
+flood-limit refusals and alert-to-delivery latency. ``--no-coalesce`` instead
+sends one message per alert with no queue, rate limit or retry (the service's
+previous behavior) and counts the alerts lost to the flood limits:
+
+    python -m tools.telegram_bot_stub [--rooms 200] [--chats 2] [--alerts-per-room 3] [--spread 10]
+                                      [--window 2] [--no-coalesce]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import asdict
+from typing import Any, Dict, List, Tuple
+
+from common.alert_delivery import AlertDelivery, DeliveryConfig
+
+
+class RetryAfter(Exception):
+    """Same shape as ``telegram.error.RetryAfter``."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class StubBot:
+    """Accepts messages within per-chat and global rate windows; refuses the rest with RetryAfter."""
+
+    def __init__(
+        self,
+        chat_per_window: int = 1,
+        chat_window_s: float = 1.0,
+        global_per_s: int = 30,
+        latency_s: float = 0.05,
+        retry_after_s: float = 3.0,
+    ) -> None:
+        self.chat_per_window = chat_per_window
+        self.chat_window_s = chat_window_s
+        self.global_per_s = global_per_s
+        self.latency_s = latency_s
+        self.retry_after_s = retry_after_s
+        self.messages: List[Tuple[float, str, str]] = []
+        self.refused = 0
+        self._chat_sent: Dict[str, List[float]] = {}
+        self._global_sent: List[float] = []
+
+    async def send_message(self, chat_id: str, text: str) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency_s)
+        now = time.monotonic()
+        chat_sent = self._chat_sent.setdefault(chat_id, [])
+        chat_sent[:] = [sent for sent in chat_sent if now - sent < self.chat_window_s]
+        self._global_sent[:] = [sent for sent in self._global_sent if now - sent < 1.0]
+        if len(chat_sent) >= self.chat_per_window or len(self._global_sent) >= self.global_per_s:
+            self.refused += 1
+            raise RetryAfter(self.retry_after_s)
+        chat_sent.append(now)
+        self._global_sent.append(now)
+        self.messages.append((now, chat_id, text))
+        return {"message_id": len(self.messages), "chat": {"id": chat_id}, "text": text}
+
+
+def format_alert(alert: Dict[str, Any]) -> str:
+    return f"Alert {alert['type']} in {alert['room_id']}: {alert['temp_c']}°C (level {alert['level']})"
+
+
+async def send_unmanaged(bot: StubBot, chat_id: str, alert: Dict[str, Any], lost: List[int]) -> None:
+    try:
+        await bot.send_message(chat_id, format_alert(alert))
+    except RetryAfter:
+        lost[0] += 1
+
+
+async def run(
+    rooms: int,
+    chats: int,
+    alerts_per_room: int,
+    spread_s: float,
+    config: DeliveryConfig | None,
+    seed: int,
+) -> Dict[str, Any]:
+    """Replay the heat event through ``AlertDelivery``, or one task per alert when ``config`` is None."""
+    rng = random.Random(seed)
+    bot = StubBot()
+    delivery = None if config is None else AlertDelivery(config, bot.send_message)
+    if delivery is not None:
+        delivery.start()
+    unmanaged: List[asyncio.Task] = []
+    lost = [0]
+    chat_ids = [f"chat-{index}" for index in range(chats)]
+    # Every room raises its alerts at random times within the spread.
+    events = sorted(
+        (rng.uniform(0, spread_s), f"room-{room:04d}", alert_type)
+        for room in range(rooms)
+        for alert_type in (["OVERHEAT", "RAPID_RISE", "OVERHEAT"] * alerts_per_room)[:alerts_per_room]
+    )
+    start = time.monotonic()
+    for offset, room_id, alert_type in events:
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        alert = {"ts": int(time.time()), "room_id": room_id, "type": alert_type, "level": "WARN", "temp_c": 27.4}
+        for chat_id in chat_ids:
+            if delivery is None:
+                unmanaged.append(asyncio.create_task(send_unmanaged(bot, chat_id, alert, lost)))
+            else:
+                delivery.offer(chat_id, alert)
+    report: Dict[str, Any] = {"rooms": rooms, "chats": chats, "alerts": len(events) * chats}
+    if delivery is None:
+        await asyncio.gather(*unmanaged)
+        report["lost"] = lost[0]
+    else:
+        await delivery.stop()
+        latency = delivery.latency
+        report["delivery"] = asdict(config)
+        report["stats"] = delivery.stats()
+        report["latency_s"] = {
+            "mean": round(latency.total / latency.count, 3) if latency.count else None,
+            "p50_le": latency.quantile(0.5),
+            "p99_le": latency.quantile(0.99),
+        }
+    report["bot"] = {"messages": len(bot.messages), "refused": bot.refused}
+    report["elapsed_s"] = round(time.monotonic() - start, 2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=2)
+    parser.add_argument("--alerts-per-room", type=int, default=3)
+    parser.add_argument("--spread", type=float, default=10.0, help="seconds over which the alerts arrive")
+    parser.add_argument("--window", type=float, default=2.0, help="coalesce window in seconds")
+    parser.add_argument("--no-coalesce", action="store_true", help="one unmanaged message per alert, for comparison")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    config = None if args.no_coalesce else DeliveryConfig(coalesce_window_s=args.window, queue_size=100000)
+    report = asyncio.run(run(args.rooms, args.chats, args.alerts_per_room, args.spread, config, args.seed))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
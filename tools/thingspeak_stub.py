@@ -0,0 +1,119 @@
+"""Local stand-in for the ThingSpeak update APIs.
+
+Records every request it receives and can be told to fail a fraction of them
+so the adapter's batching, retry and drop behavior can be exercised offline:
+
+    python -m tools.thingspeak_stub --port 8081 --fail-rate 0.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+class ThingSpeakStub:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        fail_rate: float = 0.0,
+        fail_status: int = 429,
+        latency_s: float = 0.0,
+    ) -> None:
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.latency_s = latency_s
+        self.requests: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def update_endpoint(self) -> str:
+        return f"{self.url}/update.json"
+
+    @property
+    def bulk_endpoint_template(self) -> str:
+        return f"{self.url}/channels/{{channel_id}}/bulk_update.json"
+
+    def updates_received(self) -> int:
+        with self._lock:
+            return sum(
+                len(entry["body"].get("updates", [])) or 1
+                for entry in self.requests
+                if entry["status"] == 200
+            )
+
+    def start(self) -> "ThingSpeakStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "ThingSpeakStub":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def _make_handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:  # noqa: N802 - http.server naming
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    body = {}
+                if stub.latency_s:
+                    threading.Event().wait(stub.latency_s)
+                status = stub.fail_status if random.random() < stub.fail_rate else 200
+                with stub._lock:
+                    stub.requests.append({"path": self.path, "body": body, "status": status})
+                response = json.dumps({"success": status == 200}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format: str, *args: object) -> None:
+                logging.getLogger("thingspeak_stub").debug(format, *args)
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--latency-s", type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    stub = ThingSpeakStub(args.host, args.port, args.fail_rate, args.fail_status, args.latency_s)
+    logging.getLogger("thingspeak_stub").info("Serving on %s", stub.url)
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
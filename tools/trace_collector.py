@@ -0,0 +1,83 @@
+"""Collect pipeline traces from the broker and report latency distributions.
+
+Enable ``tracing`` on the publisher, then run:
+
+    python -m tools.trace_collector [--interval 10] [--topic 'iot/+/alerts' ...] [--out report.json]
+
+Broker settings come from the home catalog (``HOME_CATALOG_URL``). Every
+traced payload on the watched topics is recorded: end-to-end latency (trace
+origin to arrival here) per topic filter, and per-hop latency between the
+stages listed in the trace. A JSON report is printed every ``--interval``
+seconds (or rewritten to ``--out``).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from common.config_client import HomeCatalogClient
+from common.mqtt_client import MqttConfig, MqttServiceClient
+from common.runtime import get_home_catalog_url
+from common.tracing import TRACE_KEY, TraceCollector
+
+DEFAULT_TOPICS = (
+    "iot/+/temperature/processed",
+    "iot/+/alerts",
+    "iot/+/indicator/cmd",
+    "iot/+/indicator/state",
+    "iot/+/hvac/state",
+)
+
+
+def observe_topic(collector: TraceCollector, label: str) -> Callable[[str, Any], None]:
+    """A subscription handler recording traced payloads under ``label``."""
+
+    def observe(topic: str, payload: Any) -> None:
+        # SenML packs carry one trace per record.
+        for record in payload if isinstance(payload, list) else (payload,):
+            trace = record.get(TRACE_KEY) if isinstance(record, dict) else None
+            if trace is not None:
+                collector.observe(label, trace)
+
+    return observe
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topic", action="append", help="topic filter to watch (repeatable)")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between reports")
+    parser.add_argument("--capacity", type=int, default=10000, help="latest samples kept per series")
+    parser.add_argument("--client-id", default="trace-collector")
+    parser.add_argument("--out", help="rewrite the JSON report here instead of printing it")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    mqtt_config = MqttConfig(**HomeCatalogClient(get_home_catalog_url()).get_mqtt_config())
+    collector = TraceCollector(args.capacity)
+    client = MqttServiceClient(args.client_id, mqtt_config)
+    client.connect()
+    client.loop_start()
+    for topic_filter in args.topic or DEFAULT_TOPICS:
+        client.subscribe([(topic_filter, 1)], observe_topic(collector, topic_filter))
+    try:
+        while True:
+            time.sleep(args.interval)
+            report = json.dumps(collector.report(), indent=2)
+            if args.out:
+                Path(args.out).write_text(report + "\n", encoding="utf-8")
+            else:
+                print(report, flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()